@@ -0,0 +1,48 @@
+# Times calls to a function whose body uses a file, with more and more
+# top-level lets before it. Each call runs the use on top of an older
+# version of the globals, so the time per call shouldn't grow with them.
+#
+#     python benchmarks/bench_body_use.py [calls]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+
+from modl import ENGINES
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+FUNCTION = """
+let f <- { x | use "test.dl"; odd x; };
+let loop <- { n | cond | n == 0 -> 0; | otherwise -> f 1; loop (n - 1); ; };
+let after <- 0;
+"""
+
+
+def main(args):
+    calls = int(args[1]) if len(args) > 1 else 2000
+    for lets in (0, 1000, 10000):
+        source = (
+            'use "std.dl";'
+            + "".join("let pad{} <- {};".format(i, i) for i in range(lets))
+            + FUNCTION
+        )
+        for name, engine in sorted(ENGINES.items()):
+            env = engine.get_default_env()
+            for statement in Parser(Scanner(source).scan_tokens()).program():
+                _, env = engine.interpret(statement, env)
+            statement = Parser(Scanner("loop {};".format(calls)).scan_tokens())
+            statement = statement.program()[0]
+            start = time.perf_counter()
+            engine.interpret(statement, env)
+            elapsed = time.perf_counter() - start
+            print(
+                "{} lets, {}: {:.1f}us per call".format(
+                    lets, name, elapsed / calls * 1e6
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
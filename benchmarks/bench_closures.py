@@ -0,0 +1,50 @@
+# Reports how much memory closures keep alive, for closures made by a
+# function with a big local list they don't use.
+#
+#     python benchmarks/bench_closures.py [closures]
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath("."))
+
+from modl import ENGINES
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+PRELUDE = """
+use "std.dl";
+let make <- { k |
+    let big <- range 0 100;
+    { x | x + k; };
+};
+"""
+
+PROGRAM = "let adders <- map make (range 0 {});"
+
+
+def run(engine, source, env):
+    result = None
+    for statement in Parser(Scanner(source).scan_tokens()).program():
+        result, env = engine.interpret(statement, env)
+    return result, env
+
+
+def main(args):
+    n = int(args[1]) if len(args) > 1 else 1000
+    for name, engine in ENGINES.items():
+        _, env = run(engine, PRELUDE, engine.get_default_env())
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        _, env = run(engine, PROGRAM.format(n), env)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print("{}: {:.0f} bytes per closure".format(name, (after - before) / n))
+        del env
+
+
+if __name__ == "__main__":
+    main(sys.argv)
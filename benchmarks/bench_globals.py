@@ -0,0 +1,46 @@
+# Times a loop that looks up globals, after a given number of top-level
+# lets have been run.
+#
+#     python benchmarks/bench_globals.py [lets] [iterations]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+
+from modl import ENGINES
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+LOOP = """
+let loop <- { n a |
+    cond
+    | n == 0 -> a;
+    | otherwise -> loop (n - 1) (a + (head (n :: empty)));
+    ;
+};
+"""
+
+
+def main(args):
+    lets = int(args[1]) if len(args) > 1 else 500
+    iterations = int(args[2]) if len(args) > 2 else 100000
+    source = (
+        'use "std.dl";'
+        + "".join("let pad{} <- {};".format(i, i) for i in range(lets))
+        + LOOP
+    )
+
+    for name, engine in sorted(ENGINES.items()):
+        env = engine.get_default_env()
+        for statement in Parser(Scanner(source).scan_tokens()).program():
+            _, env = engine.interpret(statement, env)
+        statement = Parser(Scanner("loop {} 0;".format(iterations)).scan_tokens())
+        statement = statement.program()[0]
+        start = time.perf_counter()
+        engine.interpret(statement, env)
+        print("{}: {:.2f}s".format(name, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
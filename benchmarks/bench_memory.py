@@ -0,0 +1,66 @@
+# Reports how much memory tokens and AST nodes take for a generated source.
+#
+#     python benchmarks/bench_memory.py [megabytes]
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath("."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_scanner import generate
+from modl import expr
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+
+def count_nodes(statements):
+    count = 0
+    pending = list(statements)
+    while pending:
+        node = pending.pop()
+        count += 1
+        if isinstance(node, expr.Let):
+            for name, value in node.assignments:
+                pending.extend((name, value))
+        elif isinstance(node, expr.Symchain):
+            pending.extend((node.left, node.op, node.right))
+        elif isinstance(node, expr.Expression):
+            pending.extend(node.call)
+        elif isinstance(node, expr.Function):
+            pending.extend(node.args)
+            pending.extend(node.body)
+        elif isinstance(node, expr.Conditional):
+            for condition, body in node.cases:
+                pending.append(condition)
+                pending.extend(body)
+    return count
+
+
+def measure(function):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main(args):
+    megabytes = float(args[1]) if len(args) > 1 else 1
+    source = generate(megabytes)
+
+    tokens, token_bytes = measure(lambda: Scanner(source).scan_tokens())
+    print(
+        "{} tokens, {:.1f} bytes per token".format(
+            len(tokens), token_bytes / len(tokens)
+        )
+    )
+
+    statements, node_bytes = measure(lambda: Parser(iter(tokens)).program())
+    nodes = count_nodes(statements)
+    print("{} nodes, {:.1f} bytes per node".format(nodes, node_bytes / nodes))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
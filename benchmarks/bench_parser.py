@@ -0,0 +1,51 @@
+# Parses generated multi-megabyte sources, one of ordinary definitions and
+# one of very long symbol chains, and reports throughput.
+#
+#     python benchmarks/bench_parser.py [megabytes] [chain length]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_scanner import generate
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+
+def generate_chains(megabytes, length):
+    parts = []
+    size = 0
+    i = 0
+    while size < megabytes * 1024 * 1024:
+        terms = " + ".join("x_{}".format(j) for j in range(length))
+        part = "let chain_{} <- {} :: empty;\n".format(i, terms)
+        parts.append(part)
+        size += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def measure(name, source):
+    tokens = Scanner(source).scan_tokens()
+    start = time.perf_counter()
+    statements = Parser(iter(tokens)).program()
+    elapsed = time.perf_counter() - start
+    megabytes = len(source) / 1024 / 1024
+    print(
+        "{}: {:.1f} MB, {} statements in {:.2f}s ({:.1f} MB/s)".format(
+            name, megabytes, len(statements), elapsed, megabytes / elapsed
+        )
+    )
+
+
+def main(args):
+    megabytes = float(args[1]) if len(args) > 1 else 4
+    length = int(args[2]) if len(args) > 2 else 100000
+    measure("definitions", generate(megabytes))
+    measure("chains", generate_chains(megabytes, length))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,48 @@
+# Scans a generated multi-megabyte source and reports throughput.
+#
+#     python benchmarks/bench_scanner.py [megabytes]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+
+from modl.scanner import Scanner
+
+CHUNK = """/* Generated definitions */
+let value_{0} <- {{ x y |
+  cond
+  | x == {0} -> "string number {0}\\n";
+  | otherwise -> x + y * {0}.5 :: value_{0} (x - 1) y;
+  ;
+}};
+"""
+
+
+def generate(megabytes):
+    parts = []
+    size = 0
+    i = 0
+    while size < megabytes * 1024 * 1024:
+        part = CHUNK.format(i)
+        parts.append(part)
+        size += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def main(args):
+    megabytes = float(args[1]) if len(args) > 1 else 4
+    source = generate(megabytes)
+    start = time.perf_counter()
+    tokens = Scanner(source).scan_tokens()
+    elapsed = time.perf_counter() - start
+    print(
+        "{:.1f} MB, {} tokens in {:.2f}s ({:.1f} MB/s)".format(
+            len(source) / 1024 / 1024, len(tokens), elapsed, megabytes / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,103 @@
+# Counts the frames and tail calls each engine allocates per iteration of
+# tail-recursive loops, and times them.
+#
+#     python benchmarks/bench_tail_calls.py [n]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("."))
+
+from modl import closures, interpreter, vm
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+ENGINES = {"tree": interpreter, "closure": closures, "vm": vm}
+
+PROGRAMS = {
+    "count": "count {};",
+    "range": "range 0 {};",
+}
+
+PRELUDE = """
+use "std.dl";
+let count <- { n |
+    cond
+    | n == 0 -> 0;
+    | otherwise -> count (n - 1);
+    ;
+};
+"""
+
+counts = {"frames": 0, "tail calls": 0}
+
+
+class Frame(interpreter.Frame):
+    __slots__ = ()
+
+    def __init__(self, *args):
+        counts["frames"] += 1
+        super().__init__(*args)
+
+
+class CallFrame(interpreter.CallFrame):
+    __slots__ = ()
+
+    def __init__(self, *args):
+        counts["frames"] += 1
+        super().__init__(*args)
+
+
+class TailCall(interpreter.TailCall):
+    __slots__ = ()
+
+    def __init__(self, *args):
+        counts["tail calls"] += 1
+        super().__init__(*args)
+
+
+def run(engine, source, env):
+    result = None
+    for statement in Parser(Scanner(source).scan_tokens()).program():
+        result, env = engine.interpret(statement, env)
+    return result, env
+
+
+def count(engine, source, env):
+    # The vm never makes a TailCall
+    patches = [(module, "Frame", Frame) for module in ENGINES.values()]
+    for module in (interpreter, closures):
+        patches += [(module, "CallFrame", CallFrame), (module, "TailCall", TailCall)]
+    plain = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    counts.update(dict.fromkeys(counts, 0))
+    try:
+        run(engine, source, env)
+    finally:
+        for module, name, value in plain:
+            setattr(module, name, value)
+    return dict(counts)
+
+
+def main(args):
+    n = int(args[1]) if len(args) > 1 else 1000000
+    for name, engine in ENGINES.items():
+        _, env = run(engine, PRELUDE, engine.get_default_env())
+        for program, source in PROGRAMS.items():
+            start = time.perf_counter()
+            allocated = count(engine, source.format(n), env)
+            print(
+                "{} {}: {:.2f}s, {:.2f} frames and {:.2f} tail calls per "
+                "iteration".format(
+                    name,
+                    program,
+                    time.perf_counter() - start,
+                    allocated["frames"] / n,
+                    allocated["tail calls"] / n,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv)
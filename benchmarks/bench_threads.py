@@ -0,0 +1,35 @@
+# Runs the same program in separate Interpreters from a growing number of
+# threads, reporting how many runs per second each thread count manages.
+#
+#     python benchmarks/bench_threads.py [engine] [runs]
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath("."))
+
+from modl import Interpreter
+
+PROGRAM = 'use "test.dl"; fibo 15;'
+
+
+def work(engine):
+    return Interpreter(engine).run(PROGRAM)
+
+
+def main(args):
+    engine = args[1] if len(args) > 1 else "vm"
+    runs = int(args[2]) if len(args) > 2 else 64
+    work(engine)  # Compile test.dl first
+
+    for threads in (1, 2, 4, 8):
+        with ThreadPoolExecutor(threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(work, [engine] * runs))
+            elapsed = time.perf_counter() - start
+        print("{} threads: {:.1f} runs/s".format(threads, runs / elapsed))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
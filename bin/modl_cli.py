@@ -3,48 +3,221 @@ import os
 
 sys.path.insert(0, os.path.abspath("."))
 
+import argparse
 import codecs
+import contextlib
 import traceback
 
+from modl import expr, loader, snapshot
+from modl.bytecode import compile_expression, disassemble
 from modl.parser import Parser
+from modl.resolver import resolve
 from modl.scanner import Scanner
-from modl import interpreter
+from modl import ENGINES
+from modl.optimizer import Optimizing
+from modl.profiler import Profiler, Sampler
+from modl.server import Server
 
 
 def main(args):
-    if len(args) > 2:
-        print("Usage: {} [script]".format(sys.args[0]), file=sys.stderr)
-        exit(-1)
-    elif len(args) == 2:
-        exit(run_file(args[1]))
+    arg_parser = argparse.ArgumentParser(prog=args[0])
+    arg_parser.add_argument("script", nargs="?")
+    arg_parser.add_argument(
+        "--engine", choices=sorted(ENGINES), default="tree", help="evaluation engine"
+    )
+    arg_parser.add_argument(
+        "--disassemble", action="store_true", help="print the script's bytecode"
+    )
+    arg_parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="optimize each statement, reporting what was done on stderr",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every function, printing the results on stderr",
+    )
+    arg_parser.add_argument(
+        "--profile-json",
+        metavar="FILE",
+        help="time every function, writing the results to FILE as JSON",
+    )
+    arg_parser.add_argument(
+        "--sample",
+        metavar="FILE",
+        help="sample the running functions, writing collapsed stacks to FILE",
+    )
+    arg_parser.add_argument(
+        "--sample-interval",
+        metavar="MS",
+        type=float,
+        default=1.0,
+        help="milliseconds between samples (default 1)",
+    )
+    arg_parser.add_argument(
+        "--compile", metavar="DIR", help="precompile every .dl file under DIR"
+    )
+    arg_parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="start from the environment saved in FILE by --save-snapshot",
+    )
+    arg_parser.add_argument(
+        "--save-snapshot",
+        metavar="FILE",
+        help="save the environment to FILE once the script is done",
+    )
+    arg_parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="run scripts sent by bin/modl_client.py to the Unix socket SOCKET",
+    )
+    arg_parser.add_argument(
+        "--prelude",
+        metavar="FILE",
+        action="append",
+        help="file to use before every script with --serve (default std.dl)",
+    )
+    options = arg_parser.parse_args(args[1:])
+
+    engine = ENGINES[options.engine]
+    profiler = None
+    profiling = contextlib.nullcontext()
+    if options.profile or options.profile_json:
+        profiler = Profiler()
+        profiling = engine.profiling(profiler)
+    elif options.sample:
+        profiler = Sampler(options.sample_interval / 1000)
+        profiling = sampling(engine, profiler)
+    if options.optimize:
+        engine = Optimizing(engine)
+    if options.compile is not None:
+        for path in loader.compile_tree(options.compile):
+            print("Compiled", path)
+    elif options.serve is not None:
+        prelude = options.prelude
+        if prelude is None:
+            prelude = [] if options.snapshot else ["std.dl"]
+        with Server(options.serve, engine, prelude, options.snapshot) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    elif options.disassemble:
+        disassemble_file(options.script)
+    elif options.script is not None:
+        env = initial_env(engine, options)
+        with profiling:
+            (result, env) = run_file(options.script, engine, env)
+        print_report(engine)
+        print_profile(profiler, options)
+        if options.save_snapshot:
+            snapshot.save(options.save_snapshot, env, engine)
+        exit(result)
     else:
-        run_prompt()
+        env = initial_env(engine, options)
+        with profiling:
+            run_prompt(engine, env)
+        print_report(engine)
+        print_profile(profiler, options)
 
 
-def run_file(path):
+def initial_env(engine, options):
+    if options.snapshot:
+        return snapshot.load(options.snapshot, engine)
+    return engine.get_default_env()
+
+
+def run_file(path, engine, env):
+    path = os.path.abspath(path)
+    with codecs.open(path, encoding="utf8") as script:
+        scanner = Scanner()
+        parser = Parser(scanner.scan_stream(script), path)
+
+        # The script is loading like any used file, so its top-level calls
+        # are labelled with it when sampled
+        token = loader.LOADING.set((path,))
+        try:
+            result = None
+            for statement in parser.statements():
+                (result, env) = engine.interpret(statement, env)
+        finally:
+            loader.LOADING.reset(token)
+
+        return (result, env)
+
+
+def print_report(engine):
+    for line in getattr(engine, "report", ()):
+        print("optimizer:", line, file=sys.stderr)
+
+
+@contextlib.contextmanager
+def sampling(engine, sampler):
+    with engine.profiling(sampler), sampler:
+        yield
+
+
+def print_profile(profiler, options):
+    if profiler is None:
+        return
+    if options.sample:
+        with open(options.sample, "w") as output:
+            output.write(profiler.collapsed())
+    if options.profile:
+        print(profiler.report(), file=sys.stderr)
+    if options.profile_json:
+        with open(options.profile_json, "w") as output:
+            profiler.dump(output)
+
+
+def disassemble_file(path):
     with codecs.open(path, encoding="utf8") as script:
-        env = interpreter.get_default_env()
-        scanner = Scanner(command)
+        scanner = Scanner(script.read())
         parser = Parser(scanner.scan_tokens())
 
         for statement in parser.program():
-            (result, env) = interpreter.interpret(statement, env)
-
-        return result
+            resolve(statement)
+            if isinstance(statement, expr.Use):
+                print(statement)
+            elif isinstance(statement, expr.Let):
+                for (name, value) in statement.assignments:
+                    print(disassemble(compile_expression(value, name.name)))
+            else:
+                print(disassemble(compile_expression(statement)))
+
+
+class Prompt:
+    # A stream that reads a line at a time from the user, so statements can
+    # span several lines
+    def __init__(self):
+        self.continuation = False
+
+    def read(self, size=-1):
+        try:
+            line = input("... " if self.continuation else "> ")
+        except EOFError:
+            return ""
+        self.continuation = True
+        return line + "\n"
 
 
-def run_prompt():
-    env = interpreter.get_default_env()
+def run_prompt(engine, env):
+    prompt = Prompt()
     while True:
+        scanner = Scanner()
+        parser = Parser(scanner.scan_stream(prompt))
         try:
-            command = input("> ")
-            scanner = Scanner(command)
-            parser = Parser(scanner.scan_tokens())
-            (result, env) = interpreter.interpret(parser.statement(), env)
-            print(result)
-            hadError = False
+            for statement in parser.statements():
+                (result, env) = engine.interpret(statement, env)
+                print(result)
+                prompt.continuation = False
+                hadError = False
+            return
         except Exception as e:
             print(traceback.format_exc())
+            prompt.continuation = False
 
 
 def error(line, message):
@@ -0,0 +1,56 @@
+# Runs a script on a server started with `modl_cli.py --serve SOCKET`, as if
+# it were run with modl_cli.py. It doesn't import modl, so that it starts as
+# fast as Python does; the protocol is described in modl/server.py.
+#
+#     python bin/modl_client.py SOCKET script.dl
+import os
+import socket
+import struct
+import sys
+
+HEADER = struct.Struct(">cI")
+
+
+def send(stream, kind, payload=b""):
+    stream.write(HEADER.pack(kind, len(payload)) + payload)
+    stream.flush()
+
+
+def receive(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise EOFError()
+    kind, size = HEADER.unpack(header)
+    return kind, stream.read(size)
+
+
+def main(args):
+    if len(args) != 3:
+        print("Usage: {} SOCKET SCRIPT".format(args[0]), file=sys.stderr)
+        return 2
+    with open(args[2], "rb") as script:
+        source = script.read()
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(args[1])
+    with connection, connection.makefile("rb") as rfile:
+        with connection.makefile("wb") as wfile:
+            send(wfile, b"d", os.getcwd().encode("utf8"))
+            send(wfile, b"s", source)
+            while True:
+                kind, payload = receive(rfile)
+                if kind == b"o":
+                    sys.stdout.buffer.write(payload)
+                elif kind == b"e":
+                    sys.stdout.flush()
+                    sys.stderr.buffer.write(payload)
+                elif kind == b"?":
+                    sys.stdout.flush()
+                    send(wfile, b"i", sys.stdin.buffer.readline())
+                elif kind == b"x":
+                    sys.stdout.flush()
+                    return int(payload)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,11 @@
+from . import closures, interpreter, lazy, parallel, vm
+from .runtime import Interpreter
+
+# Every engine provides get_default_env(), interpret(statement, environment)
+# and profiling(profiler)
+ENGINES = {
+    "tree": interpreter,
+    "closure": closures,
+    "vm": vm,
+    "lazy": lazy,
+}
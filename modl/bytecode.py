@@ -0,0 +1,281 @@
+# A flat bytecode for MODL. Every instruction is an opcode followed by a
+# single argument, both stored in an array of machine integers. Constants
+# (literals and nested function code) and names live in per-code pools that
+# the arguments index into.
+from array import array
+from . import expr as expr
+
+LOAD_CONST = 0
+LOAD_LOCAL = 1  # arg: slot in the current frame
+LOAD_DEREF = 2  # arg: depth << 16 | slot
+LOAD_GLOBAL = 3  # arg: index into names
+LOAD_BUILTIN = 4  # arg: index into names
+MAKE_CLOSURE = 5  # arg: index into consts, which holds a Code
+CALL = 6  # arg: number of parameters, on top of the function
+TAIL_CALL = 7  # arg: number of parameters, on top of the function
+JUMP_IF_FALSE = 8  # arg: target; conditions must be booleans
+JUMP = 9  # arg: target
+POP = 10
+RETURN = 11
+ENTER_LET = 12  # arg: number of slots in the new frame
+STORE_LOCAL = 13  # arg: slot in the current frame
+LEAVE_LET = 14  # arg: number of frames to drop
+ENTER_LETREC = 15  # arg: number of slots; like ENTER_LET, for FIX_LET
+FIX_LET = 16  # fills in what closures copied from the let before it was set
+SWAP = 17  # swaps the two values on top of the stack
+USE = 18  # arg: index into consts, which holds an expr.Use; like ENTER_LET
+
+OPNAMES = {
+    value: name
+    for name, value in list(globals().items())
+    if name.isupper() and isinstance(value, int)
+}
+
+
+class Code:
+    def __init__(self, name, function=None):
+        self.name = name
+        # The expr.Function this was compiled from, if any
+        self.function = function
+        self.arity = len(function.args) if function is not None else 0
+        self.intrinsic = function.intrinsic if function is not None else None
+        self.ops = array("l")
+        self.consts = []
+        self.names = []
+        # Line of each call, by the position after its instruction
+        self.lines = {}
+        # Identifier each LOAD_LOCAL and LOAD_DEREF loads, the same way, to
+        # name it in errors
+        self.identifiers = {}
+
+    def __repr__(self):
+        return "<code {} arity {}>".format(self.name, self.arity)
+
+
+class Compiler:
+    def __init__(self, code, work=None):
+        self.code = code
+        # Where each constant (by identity) and name is in the code's pools
+        self.consts = {}
+        self.names = {}
+        # Steps left to do, last first, each a function and its arguments,
+        # shared with the compilers of the functions inside. Nodes are
+        # compiled from here rather than on the call stack, so expressions
+        # can nest to any depth.
+        self.work = [] if work is None else work
+
+    def run(self):
+        work = self.work
+        while work:
+            step, *args = work.pop()
+            step(*args)
+
+    def schedule(self, steps):
+        # Runs steps in order, before those scheduled earlier
+        self.work.extend(reversed(steps))
+
+    def emit(self, op, arg=0):
+        self.code.ops.append(op)
+        self.code.ops.append(arg)
+        return len(self.code.ops) - 1
+
+    def call(self, op, count, line):
+        self.emit(op, count)
+        if line is not None:
+            self.code.lines[len(self.code.ops)] = line
+
+    def patch(self, position):
+        self.code.ops[position] = len(self.code.ops)
+
+    def const(self, value):
+        # Constants are compared by identity: 1 and True must stay apart.
+        # The pool keeps them alive, so their ids can't be reused.
+        if id(value) not in self.consts:
+            self.consts[id(value)] = len(self.code.consts)
+            self.code.consts.append(value)
+        return self.consts[id(value)]
+
+    def load_const(self, value):
+        self.emit(LOAD_CONST, self.const(value))
+
+    def use(self, statement):
+        self.emit(USE, self.const(statement))
+
+    def name(self, name):
+        if name not in self.names:
+            self.names[name] = len(self.code.names)
+            self.code.names.append(name)
+        return self.names[name]
+
+    def body(self, body, is_tail_call):
+        # The steps that compile body
+        steps = []
+        lets = 0
+        for statement in body[:-1]:
+            if isinstance(statement, expr.Let):
+                steps.append((self.let, statement))
+                lets += 1
+            elif isinstance(statement, expr.Use):
+                steps.append((self.use, statement))
+                steps.append((self.emit, POP))
+                lets += 1
+            else:
+                steps.append((self.expression, statement))
+                steps.append((self.emit, POP))
+
+        last = body[-1]
+        if isinstance(last, expr.Let):
+            steps.append((self.let, last))
+            lets += 1
+            steps.append((self.load_const, None))
+            if is_tail_call:
+                steps.append((self.emit, RETURN))
+        elif isinstance(last, expr.Use):
+            # Pushes what the file returned
+            steps.append((self.use, last))
+            lets += 1
+            if is_tail_call:
+                steps.append((self.emit, RETURN))
+        else:
+            steps.append((self.expression, last, is_tail_call))
+
+        if lets and not is_tail_call:
+            steps.append((self.emit, LEAVE_LET, lets))
+        return steps
+
+    def let(self, statement):
+        self.emit(ENTER_LETREC if statement.recursive else ENTER_LET, statement.size)
+        steps = []
+        for (name, value) in statement.assignments:
+            if isinstance(value, expr.Function):
+                steps.append((self.closure, value, name.name))
+            else:
+                steps.append((self.expression, value))
+            steps.append((self.emit, STORE_LOCAL, name.slot))
+        if statement.recursive:
+            steps.append((self.emit, FIX_LET))
+        self.schedule(steps)
+
+    def closure(self, function, name="<lambda>"):
+        # The function's code is filled in by the steps this schedules
+        code = Code(name, function)
+        self.emit(MAKE_CLOSURE, self.const(code))
+        self.schedule(Compiler(code, self.work).body(function.body, True))
+
+    def expression(self, e, is_tail_call=False):
+        if isinstance(e, expr.Expression):
+            steps = [(self.expression, s) for s in e.call]
+            op = TAIL_CALL if is_tail_call else CALL
+            steps.append((self.call, op, len(e.call) - 1, e.line))
+            self.schedule(steps)
+            return
+        elif isinstance(e, expr.Symchain):
+            # Evaluated left to right like the other engines, with the
+            # operator then moved under the left operand for the call
+            op = TAIL_CALL if is_tail_call else CALL
+            self.schedule(
+                [
+                    (self.expression, e.left),
+                    (self.expression, e.op),
+                    (self.emit, SWAP),
+                    (self.expression, e.right),
+                    (self.call, op, 2, e.line),
+                ]
+            )
+            return
+        elif isinstance(e, expr.Conditional):
+            self.conditional(e, is_tail_call)
+            return
+        elif isinstance(e, expr.Literal):
+            self.emit(LOAD_CONST, self.const(e.value))
+        elif isinstance(e, expr.Identifier):
+            if e.depth is None:
+                self.emit(LOAD_GLOBAL, self.name(e.name))
+            else:
+                if e.depth == 0:
+                    self.emit(LOAD_LOCAL, e.slot)
+                else:
+                    self.emit(LOAD_DEREF, e.depth << 16 | e.slot)
+                self.code.identifiers[len(self.code.ops)] = e
+        elif isinstance(e, expr.Builtin):
+            self.emit(LOAD_BUILTIN, self.name(e.name))
+        elif isinstance(e, expr.Function):
+            self.closure(e)
+        else:
+            raise Exception("Trying to compile unknown thing", e)
+
+        if is_tail_call:
+            self.emit(RETURN)
+
+    def conditional(self, e, is_tail_call):
+        # Lets done inside a case only live until the end of the case
+        ends = []
+        steps = []
+        for condition, body in e.cases:
+            steps.append((self.expression, condition))
+            steps.append((self.case, body, is_tail_call, ends))
+        # All conditions were false
+        steps.append((self.otherwise, is_tail_call, ends))
+        self.schedule(steps)
+
+    def case(self, body, is_tail_call, ends):
+        next_case = self.emit(JUMP_IF_FALSE)
+        steps = self.body(body, is_tail_call)
+        steps.append((self.next_case, next_case, is_tail_call, ends))
+        self.schedule(steps)
+
+    def next_case(self, position, is_tail_call, ends):
+        if not is_tail_call:
+            ends.append(self.emit(JUMP))
+        self.patch(position)
+
+    def otherwise(self, is_tail_call, ends):
+        self.load_const(None)
+        if is_tail_call:
+            self.emit(RETURN)
+        for end in ends:
+            self.patch(end)
+
+
+def compile_function(function, name="<lambda>"):
+    code = Code(name, function)
+    compiler = Compiler(code)
+    compiler.schedule(compiler.body(function.body, True))
+    compiler.run()
+    return code
+
+
+def compile_expression(e, name="<lambda>"):
+    code = Code("<top>")
+    compiler = Compiler(code)
+    if isinstance(e, expr.Function):
+        compiler.closure(e, name)
+    else:
+        compiler.expression(e)
+    compiler.run()
+    compiler.emit(RETURN)
+    return code
+
+
+def disassemble(code, indent=""):
+    lines = ["{}{!r}".format(indent, code)]
+    nested = []
+    ops = code.ops
+    for pc in range(0, len(ops), 2):
+        op, arg = ops[pc], ops[pc + 1]
+        if op in (LOAD_CONST, MAKE_CLOSURE):
+            detail = repr(code.consts[arg])
+            if op == MAKE_CLOSURE:
+                nested.append(code.consts[arg])
+        elif op in (LOAD_GLOBAL, LOAD_BUILTIN):
+            detail = code.names[arg]
+        elif op == LOAD_DEREF:
+            detail = "depth {}, slot {}".format(arg >> 16, arg & 0xFFFF)
+        else:
+            detail = ""
+        lines.append(
+            "{}{:>5} {:<14}{:>4} {}".format(indent, pc, OPNAMES[op], arg, detail)
+        )
+    for child in nested:
+        lines.append(disassemble(child, indent + "    "))
+    return "\n".join(line.rstrip() for line in lines)
@@ -0,0 +1,387 @@
+# Compiles every node into a Python closure that takes a frame and returns
+# its value, so the dispatch on node types happens once instead of on every
+# evaluation. Frames, scoping and tail calls work exactly as in the
+# interpreter.
+from functools import partial
+from . import expr as expr
+from .interpreter import AGAIN, FUEL, PROFILER, CallFrame, Frame, Memo, Partial
+from .interpreter import TailCall, UNSET, burn, capture, let_frame, running_call
+from .interpreter import use_locally
+from . import interpreter, resolver
+
+# Every engine module offers these, for modl.ENGINES
+get_default_env = interpreter.get_default_env
+profiling = interpreter.profiling
+
+
+class Code:
+    def __init__(self, function, body):
+        self.function = function
+        self.arity = len(function.args)
+        self.intrinsic = function.intrinsic
+        self.body = body
+
+
+class Closure:
+    def __init__(self, code, frame):
+        self.code = code
+        self.frame = frame
+
+    @property
+    def function(self):
+        return self.code.function
+
+    def __reduce__(self):
+        # Compiled closures can't be pickled, so they're compiled again
+        return (make_closure, (self.code.function, self.frame))
+
+
+def make_closure(function, frame):
+    return Closure(Code(function, compile_body(function.body, True)), frame)
+
+
+def interpret(statement, environment):
+    return resolver.interpret(statement, environment, top, interpret)
+
+
+def top(statement, environment, name=None):
+    return compile(statement)(Frame((), None, environment))
+
+
+def compile(statement, is_tail_call=False):
+    if isinstance(statement, expr.Literal):
+        return compile_literal(statement)
+    elif isinstance(statement, expr.Identifier):
+        return compile_identifier(statement)
+    elif isinstance(statement, expr.Function):
+        code = Code(statement, compile_body(statement.body, True))
+        return lambda frame: Closure(code, capture(statement, frame))
+    elif isinstance(statement, expr.Builtin):
+        name = statement.name
+        return lambda frame: frame.globals.builtins[name]
+    elif isinstance(statement, expr.Let):
+        bind = compile_let(statement)
+
+        def let(frame):
+            bind(frame)
+            return None
+
+        return let
+    elif isinstance(statement, expr.Use):
+        return lambda frame: use_locally(statement, frame, interpret)[0]
+    elif isinstance(statement, expr.Expression):
+        call = [compile(s) for s in statement.call]
+        return compile_call(call, is_tail_call, statement.line)
+    elif isinstance(statement, expr.Symchain):
+        return compile_symchain(statement, is_tail_call)
+    elif isinstance(statement, expr.Conditional):
+        return compile_conditional(statement, is_tail_call)
+    else:
+        raise Exception("Trying to compile unknown thing", statement)
+
+
+def compile_literal(statement):
+    value = statement.value
+    return lambda frame: value
+
+
+def compile_identifier(statement):
+    name = statement.name
+    depth = statement.depth
+    slot = statement.slot
+
+    if depth is None:
+        return lambda frame: frame.globals[name]
+
+    def load(frame):
+        for _ in range(depth):
+            frame = frame.parent
+        value = frame.slots[slot]
+        if value is UNSET:
+            raise Exception(statement, "Name used before it was assigned")
+        return value
+
+    def load_local(frame):
+        value = frame.slots[slot]
+        if value is UNSET:
+            raise Exception(statement, "Name used before it was assigned")
+        return value
+
+    return load_local if depth == 0 else load
+
+
+def compile_call(call, is_tail_call, line):
+    if is_tail_call:
+        return compile_tail_call(call, line)
+    if len(call) == 2:
+        f, a = call
+        return lambda frame: do_call(f(frame), a(frame), line=line)
+    elif len(call) == 3:
+        f, a, b = call
+        return lambda frame: do_call(f(frame), a(frame), b(frame), line=line)
+
+    f, args = call[0], call[1:]
+    return lambda frame: do_call(f(frame), *[a(frame) for a in args], line=line)
+
+
+def compile_tail_call(call, line):
+    # A call to the running function puts its parameters in the running
+    # frame instead
+    f, args = call[0], call[1:]
+    arity = len(args)
+
+    if arity == 1:
+        a = args[0]
+
+        def tail_call(frame):
+            callee = f(frame)
+            running = calling_itself(callee, 1, frame)
+            if running is None:
+                return TailCall(callee, [a(frame)], line)
+            running.params(1)[0] = a(frame)
+            return running.again()
+
+    elif arity == 2:
+        a, b = args
+
+        def tail_call(frame):
+            callee = f(frame)
+            running = calling_itself(callee, 2, frame)
+            if running is None:
+                return TailCall(callee, [a(frame), b(frame)], line)
+            params = running.params(2)
+            params[0] = a(frame)
+            params[1] = b(frame)
+            return running.again()
+
+    else:
+
+        def tail_call(frame):
+            callee = f(frame)
+            running = calling_itself(callee, arity, frame)
+            if running is None:
+                return TailCall(callee, [a(frame) for a in args], line)
+            params = running.params(arity)
+            for i, a in enumerate(args):
+                params[i] = a(frame)
+            return running.again()
+
+    return tail_call
+
+
+def calling_itself(f, arity, frame):
+    # The frame of the running call, if calling f with arity parameters
+    # would call the same function again
+    if type(f) is not Closure or f.code.arity != arity:
+        return None
+    return running_call(frame, f.frame)
+
+
+def compile_symchain(statement, is_tail_call):
+    left = compile(statement.left)
+    op = compile(statement.op)
+    line = statement.line
+    if type(statement.right) is expr.Symchain:
+        right = compile_spine(statement.right)
+    else:
+        right = compile(statement.right)
+
+    if is_tail_call:
+
+        def symchain(frame):
+            l = left(frame)
+            callee = op(frame)
+            running = calling_itself(callee, 2, frame)
+            if running is None:
+                return TailCall(callee, [l, right(frame)], line)
+            params = running.params(2)
+            params[0] = l
+            params[1] = right(frame)
+            return running.again()
+
+    else:
+
+        def symchain(frame):
+            l = left(frame)
+            return do_call(op(frame), l, right(frame), line=line)
+
+    return symchain
+
+
+def compile_spine(statement):
+    # Chains nest to the right, so a long one is compiled, and run, down its
+    # right operands in a loop rather than a closure calling the next
+    links = []
+    while type(statement) is expr.Symchain:
+        links.append((compile(statement.left), compile(statement.op), statement.line))
+        statement = statement.right
+    last = compile(statement)
+
+    def spine(frame):
+        # Operands are evaluated left to right, and the calls made last first
+        calls = [(left(frame), op(frame), line) for left, op, line in links]
+        value = last(frame)
+        for left, op, line in reversed(calls):
+            value = do_call(op, left, value, line=line)
+        return value
+
+    return spine
+
+
+def compile_conditional(statement, is_tail_call):
+    # Lets done inside a case only live until the end of the case
+    cases = [
+        (compile(condition), compile_body(body, is_tail_call))
+        for condition, body in statement.cases
+    ]
+
+    def conditional(frame):
+        for condition, body in cases:
+            value = condition(frame)
+            if value is True:
+                return body(frame)
+            elif value is False:
+                continue
+            else:
+                raise Exception("Type mismatch, condition must be boolean", value)
+        return None  # All conditions were false
+
+    return conditional
+
+
+def compile_let(statement):
+    recursive = statement.recursive
+    assignments = [
+        (name.slot, compile(value)) for (name, value) in statement.assignments
+    ]
+
+    def bind(frame):
+        frame = let_frame(statement, frame)
+        slots = frame.slots
+        for slot, value in assignments:
+            slots[slot] = value(frame)
+        if recursive:
+            frame.fix()
+        return frame
+
+    return bind
+
+
+def compile_use(statement):
+    def use(frame):
+        return use_locally(statement, frame, interpret)[1]
+
+    return use
+
+
+def compile_step(statement):
+    # Whether the step returns the frame the rest of the body runs in, and
+    # the step itself
+    if isinstance(statement, expr.Let):
+        return (True, compile_let(statement))
+    elif isinstance(statement, expr.Use):
+        return (True, compile_use(statement))
+    return (False, compile(statement))
+
+
+def compile_body(body, is_tail_call):
+    last = compile(body[-1], is_tail_call)
+    if len(body) == 1:
+        return last
+
+    steps = [compile_step(st) for st in body[:-1]]
+
+    def run(frame):
+        for is_let, step in steps:
+            if is_let:
+                frame = step(frame)
+            else:
+                step(frame)
+        return last(frame)
+
+    return run
+
+
+def do_call(f, *params, line=None):
+    # line is where the call is, for profiling
+    profiler = PROFILER.get()
+    if profiler is not None:
+        return profiled_call(profiler, f, params, line)
+    fuel = FUEL.get()
+    while True:
+        if type(f) is Partial:
+            params = (*f.params, *params)
+            f = f.function
+        if type(f) is Memo:
+            return f.call(do_call, params)
+        # Currying, but optimized if there are multiple parameters
+        if type(f) is Closure:
+            code = f.code
+            if code.arity == len(params):
+                if code.intrinsic is not None:
+                    return f.frame.globals.builtins[code.intrinsic](*params)
+                if fuel is not None:
+                    burn(fuel)
+                frame = CallFrame(list(params), f.frame, f.frame.globals)
+                result = code.body(frame)
+                while result is AGAIN:
+                    if fuel is not None:
+                        burn(fuel)
+                    result = code.body(frame)
+                if type(result) is TailCall:
+                    f = result.f
+                    params = result.params
+                    continue
+                return result
+            elif code.arity > len(params):
+                return Partial(f, tuple(params))
+            else:
+                raise Exception(f, "Function received too many parameters")
+        elif callable(f):
+            return f(*params)
+        else:
+            raise Exception(f, "Tried to call a non-function object")
+
+
+def profiled_call(profiler, f, params, line):
+    # do_call, reporting every function it runs to the profiler
+    fuel = FUEL.get()
+    entered = False
+    try:
+        while True:
+            if type(f) is Partial:
+                params = (*f.params, *params)
+                f = f.function
+            if type(f) is Memo:
+                return f.call(partial(do_call, line=line), params)
+            if type(f) is Closure:
+                code = f.code
+                if code.arity > len(params):
+                    return Partial(f, tuple(params))
+                elif code.arity < len(params):
+                    raise Exception(f, "Function received too many parameters")
+
+                if entered:
+                    profiler.tail(code.function, line)
+                else:
+                    profiler.enter(code.function, line)
+                    entered = True
+                if code.intrinsic is not None:
+                    return f.frame.globals.builtins[code.intrinsic](*params)
+                if fuel is not None:
+                    burn(fuel)
+                frame = f.frame
+                result = code.body(Frame(list(params), frame, frame.globals))
+                if type(result) is TailCall:
+                    f = result.f
+                    params = result.params
+                    line = result.line
+                    continue
+                return result
+            elif callable(f):
+                return f(*params)
+            else:
+                raise Exception(f, "Tried to call a non-function object")
+    finally:
+        if entered:
+            profiler.leave()
@@ -0,0 +1,134 @@
+# The global environment. Every top-level `let` makes a new version of it,
+# and code only sees the versions up to the one it was defined in. Instead
+# of a layer per version, all of them keep their bindings in one Table,
+# each with the version it was bound at, and every Environment caches what
+# it looked up in itself, so looking up a global is a dict lookup however
+# many versions there are. A version made from one that isn't the newest,
+# like the globals a `use` in a function body runs on, gets a table of its
+# own layered over the one it came from.
+import threading
+from .loader import Registry
+
+
+class Table:
+    def __init__(self, bindings=None, version=0, parent=None):
+        # name -> [(version, value), ...], oldest first
+        self.bindings = {} if bindings is None else bindings
+        # (table, version) seen under these bindings, if any
+        self.parent = parent
+        # The newest version handed out
+        self.version = version
+        # How many times a binding was made, so copies of what code can see
+        # can tell whether they're still current
+        self.changes = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, name, version):
+        table = self
+        while table is not None:
+            for bound, value in reversed(table.bindings.get(name, ())):
+                if bound <= version:
+                    return value
+            table, version = table.parent or (None, None)
+        raise KeyError(name)
+
+    def __getstate__(self):
+        return (self.bindings, self.version, self.parent)
+
+    def __setstate__(self, state):
+        self.bindings, self.version, self.parent = state
+        self.changes = 0
+        self.lock = threading.Lock()
+
+
+class Environment(dict):
+    # The dict itself only caches values looked up in the table. Everything
+    # that can see past the cache goes to the table instead.
+    def __init__(self, table=None, version=0, builtins=None, modules=None):
+        super().__init__()
+        self.table = Table() if table is None else table
+        self.version = version
+        # What {#name} means in code that sees this environment, and the
+        # files used in it, which every later version shares
+        self.builtins = builtins
+        self.modules = Registry() if modules is None else modules
+
+    def __missing__(self, name):
+        value = self.table.lookup(name, self.version)
+        dict.__setitem__(self, name, value)
+        return value
+
+    def __setitem__(self, name, value):
+        with self.table.lock:
+            entries = self.table.bindings.setdefault(name, [])
+            i = len(entries)
+            while i and entries[i - 1][0] > self.version:
+                i -= 1
+            if i and entries[i - 1][0] == self.version:
+                entries[i - 1] = (self.version, value)
+            else:
+                entries.insert(i, (self.version, value))
+            self.table.changes += 1
+        dict.__setitem__(self, name, value)
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def new_child(self, bindings=None):
+        # A later version, which sees this one's bindings and its own. Only
+        # the newest version can share the table; another gets an empty one
+        # that looks up what it doesn't have in this one.
+        with self.table.lock:
+            table = self.table
+            if table.version != self.version:
+                table = Table(None, self.version, (table, self.version))
+            table.version += 1
+            child = Environment(table, table.version, self.builtins, self.modules)
+        if bindings is not None:
+            for name, value in bindings.items():
+                child[name] = value
+        return child
+
+    def changes(self, base):
+        # The bindings made after base, which this must be a later version of
+        changes = {}
+        seen = set()
+        table, version = self.table, self.version
+        while table is not None:
+            for name, entries in table.bindings.items():
+                if name in seen:
+                    continue
+                for bound, value in reversed(entries):
+                    if bound <= version:
+                        seen.add(name)
+                        if table is not base.table or bound > base.version:
+                            changes[name] = value
+                        break
+            if table is base.table:
+                break
+            table, version = table.parent or (None, None)
+        return changes
+
+    def __reduce__(self):
+        # Cached values aren't saved
+        return (
+            Environment,
+            (),
+            (self.table, self.version, self.builtins, self.modules),
+        )
+
+    def __setstate__(self, state):
+        self.table, self.version, self.builtins, self.modules = state
+
+    def __repr__(self):
+        return "<Environment version {}>".format(self.version)
@@ -1,18 +1,35 @@
 class TypedExpression:
-    types = []
+    # Nodes are slotted: big sources make millions of them
+    __slots__ = ("types", "resolved")
+
+    def __init__(self):
+        self.types = ()
+        # Whether the resolver has run on it as a statement
+        self.resolved = False
 
 
 class Use:
-    def __init__(self, filename):
+    __slots__ = ("filename", "reload")
+
+    def __init__(self, filename, reload=False):
         self.filename = filename
+        # `use!` runs the file again even if it was already used
+        self.reload = reload
 
     def __repr__(self):
-        return "USE " + repr(self.filename)
+        return ("USE! " if self.reload else "USE ") + repr(self.filename)
 
 
 class Let:
+    __slots__ = ("assignments", "size", "recursive", "resolved")
+
     def __init__(self, assignments):
         self.assignments = assignments
+        # Number of slots in the frame, and whether functions made while
+        # it's bound refer to its names, filled in by the resolver
+        self.size = None
+        self.recursive = False
+        self.resolved = False
 
     def __repr__(self):
         return (
@@ -25,10 +42,15 @@ class Let:
 
 
 class Symchain(TypedExpression):
-    def __init__(self, left, op, right):
+    __slots__ = ("left", "op", "right", "line")
+
+    def __init__(self, left, op, right, line=None):
+        super().__init__()
         self.left = left
         self.op = op
         self.right = right
+        # Where the call is, for profilers
+        self.line = line
 
     def __repr__(self):
         return (
@@ -37,25 +59,48 @@ class Symchain(TypedExpression):
 
 
 class Identifier(TypedExpression):
+    __slots__ = ("name", "depth", "slot")
+
     def __init__(self, name):
+        super().__init__()
         self.name = name
+        # Lexical address, filled in by the resolver. None means global.
+        self.depth = None
+        self.slot = None
 
     def __repr__(self):
         return self.name
 
 
 class Expression(TypedExpression):
-    def __init__(self, call):
+    __slots__ = ("call", "line")
+
+    def __init__(self, call, line=None):
+        super().__init__()
         self.call = call
+        # Where the call is, for profilers
+        self.line = line
 
     def __repr__(self):
         return "(" + " ".join(repr(v) for v in self.call) + ")"
 
 
 class Function(TypedExpression):
-    def __init__(self, args, body):
+    __slots__ = ("args", "body", "intrinsic", "free", "name", "line", "filename")
+
+    def __init__(self, args, body, line=None, filename=None):
+        super().__init__()
         self.args = args
         self.body = body
+        # Where it was defined, and the name a `let` bound it to if any
+        self.line = line
+        self.filename = filename
+        self.name = None
+        # Name of the builtin this function only forwards to, if any
+        self.intrinsic = None
+        # Addresses of the enclosing locals it uses, from where it's made,
+        # filled in by the resolver
+        self.free = ()
 
     def __repr__(self):
         return (
@@ -68,7 +113,10 @@ class Function(TypedExpression):
 
 
 class Literal(TypedExpression):
+    __slots__ = ("value",)
+
     def __init__(self, value):
+        super().__init__()
         self.value = value
 
     def __repr__(self):
@@ -76,7 +124,10 @@ class Literal(TypedExpression):
 
 
 class Builtin(TypedExpression):
+    __slots__ = ("name",)
+
     def __init__(self, name):
+        super().__init__()
         self.name = name
 
     def __repr__(self):
@@ -84,7 +135,10 @@ class Builtin(TypedExpression):
 
 
 class Conditional(TypedExpression):
+    __slots__ = ("cases",)
+
     def __init__(self, cases):
+        super().__init__()
         self.cases = cases
 
     def __repr__(self):
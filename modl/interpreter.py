@@ -1,136 +1,664 @@
-from collections import ChainMap
+import asyncio
+import contextvars
+import operator
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 from . import expr as expr
-from .parser import Parser
-from .scanner import Scanner
-
-BUILTIN = {
-    "print": lambda x: print(x),
-    "add": lambda x, y: x + y,
-    "sub": lambda x, y: x - y,
-    "mul": lambda x, y: x * y,
-    "fdiv": lambda x, y: x / y,
-    "mod": lambda x, y: x % y,
-    "read": lambda _: input(),
-    "eq": lambda x, y: x == y,
-    "gt": lambda x, y: x > y,
-    "if": lambda c, t, f: t if c else f,
-    "cons": lambda h, t: (h, t),
-    "head": lambda l: l[0],
-    "tail": lambda l: l[1],
-    "true": True,
-    "false": False,
-    "empty": (),
-}
+from .environment import Environment
+from . import resolver
+
+
+# The modl.Interpreter running in this thread or task, if any, whose streams print
+# and read use instead of the process's
+CURRENT = contextvars.ContextVar("CURRENT", default=None)
+
+# The profiler that calls made in this thread or task are reported to, if any
+PROFILER = contextvars.ContextVar("PROFILER", default=None)
+
+
+# Builtins are module-level functions rather than lambdas so that values
+# holding them can be pickled
+def write(x):
+    instance = CURRENT.get()
+    stream = None if instance is None else instance.stdout
+    if hasattr(stream, "drain"):
+        # An asyncio stream, from code that run_async can't await, like a
+        # mapping pmap does itself. It's drained by the next async write.
+        stream.write("{}\n".format(x).encode("utf8"))
+        return
+    print(x, file=stream)
+
+
+def read(_):
+    instance = CURRENT.get()
+    if instance is None:
+        return input()
+    if isinstance(instance.stdin, asyncio.StreamReader):
+        raise Exception(instance.stdin, "Can't wait for input outside of run_async")
+    line = instance.stdin.readline()
+    if not line:
+        raise EOFError()
+    return line.rstrip("\n")
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+
+
+# The same, for running inside an event loop: vm.run_async awaits them, and
+# they use asyncio streams if the Interpreter was given some
+async def write_async(x):
+    write(x)
+    instance = CURRENT.get()
+    stream = None if instance is None else instance.stdout
+    if hasattr(stream, "drain"):
+        await stream.drain()
+
+
+async def read_async(_):
+    instance = CURRENT.get()
+    stream = None if instance is None else instance.stdin
+    if not isinstance(stream, asyncio.StreamReader):
+        return read(_)
+    line = await stream.readline()
+    if not line:
+        raise EOFError()
+    return line.decode("utf8").rstrip("\n")
+
+
+async def sleep_async(seconds):
+    await asyncio.sleep(seconds)
+
+
+def choose(c, t, f):
+    return t if c else f
+
+
+def cons(h, t):
+    return (h, t)
+
+
+def head(l):
+    return l[0]
+
+
+def tail(l):
+    return l[1]
+
+
+class Builtins(dict):
+    # What {#name} means in the code that sees an environment, which keeps
+    # them as its `builtins`. The default ones are pickled by name, so that
+    # loaded values share them again; an Interpreter's own are copied.
+    def __reduce__(self):
+        if self is BUILTIN:
+            return "BUILTIN"
+        return (Builtins, (dict(self),))
+
+
+BUILTIN = Builtins(
+    {
+        "print": write,
+        "add": operator.add,
+        "sub": operator.sub,
+        "mul": operator.mul,
+        "fdiv": operator.truediv,
+        "mod": operator.mod,
+        "read": read,
+        "sleep": sleep,
+        "eq": operator.eq,
+        "gt": operator.gt,
+        "if": choose,
+        "cons": cons,
+        "head": head,
+        "tail": tail,
+        "true": True,
+        "false": False,
+        "empty": (),
+    }
+)
+
+# What {#name} means differently under vm.run_async. Everything else is
+# looked up in the environment's builtins.
+ASYNC_BUILTIN = {"print": write_async, "read": read_async, "sleep": sleep_async}
 
 
 class Function:
-    def __init__(self, function, environment):
+    def __init__(self, function, frame):
         self.function = function
-        self.environment = environment
+        self.frame = frame
+
+
+class Partial:
+    # A function applied to fewer parameters than it takes. Applying it
+    # again just adds to the flat tuple of parameters.
+    __slots__ = ("function", "params", "__weakref__")
+
+    def __init__(self, function, params):
+        self.function = function
+        self.params = params
+
+
+# How many results a memoized function keeps by default
+MEMO_SIZE = 4096
+
+
+class Memo:
+    # A function that remembers its results for the last MEMO_SIZE
+    # parameter lists it was called with. Only plain values are remembered;
+    # calls with anything else, like functions, always run.
+    def __init__(self, function, size=MEMO_SIZE):
+        if is_bang(function):
+            raise Exception(function, "Only pure functions can be memoized")
+        self.function = function
+        self.size = size
+        self.arity = arity(function)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+
+    def call(self, do_call, params):
+        if self.arity is not None and len(params) < self.arity:
+            return Partial(self, tuple(params))
+        key = self.key(params)
+        if key is None:
+            return do_call(self.function, *params)
+        found, result = self.lookup(key)
+        if not found:
+            result = do_call(self.function, *params)
+            self.store(key, result)
+        return result
+
+    # call, in steps, for engines that can't call do_call from here
+
+    def key(self, params):
+        key = memo_key(params)
+        if key is None:
+            self.uncached += 1
+        return key
+
+    def lookup(self, key):
+        cache = self.cache
+        with self.lock:
+            if key in cache:
+                self.hits += 1
+                cache.move_to_end(key)
+                return True, cache[key]
+            self.misses += 1
+        return False, None
+
+    def store(self, key, result):
+        cache = self.cache
+        with self.lock:
+            cache[key] = result
+            if len(cache) > self.size:
+                cache.popitem(last=False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncached": self.uncached,
+            "size": len(self.cache),
+        }
+
+    def __repr__(self):
+        return (
+            "<memo hits {hits} misses {misses} uncached {uncached} size {size}>"
+        ).format(**self.stats())
+
+
+def arity(f):
+    # How many parameters a function still takes, or None if it can't be told
+    if type(f) is Partial:
+        remaining = arity(f.function)
+        return None if remaining is None else remaining - len(f.params)
+    elif type(f) is Memo:
+        return f.arity
+    function = getattr(f, "function", None)
+    if isinstance(function, expr.Function):
+        return len(function.args)
+    return None
+
+
+def is_bang(f):
+    while type(f) is Partial or type(f) is Memo:
+        f = f.function
+    function = getattr(f, "function", None)
+    return isinstance(function, expr.Function) and any(
+        arg.name.endswith("!") for arg in function.args
+    )
+
+
+def memo_key(params):
+    # A hashable stand-in for the parameters that tells 1, 1.0 and True
+    # apart, or None if any of them isn't a plain value
+    key = []
+    for value in params:
+        items = []
+        while type(value) is tuple and len(value) == 2:
+            head = memo_key((value[0],))
+            if head is None:
+                return None
+            items.append(head)
+            value = value[1]
+        if type(value) is tuple and value:
+            return None
+        if value is not None and type(value) not in (bool, int, float, str, tuple):
+            return None
+        key.append((type(value), value, tuple(items)))
+    return tuple(key)
+
+
+BUILTIN["memo"] = Memo
+
+
+# How many more function calls this thread or task may make, as a list of
+# one count, while it's inside limit(). Every engine checks it before
+# running a function's body.
+FUEL = contextvars.ContextVar("FUEL", default=None)
+
+
+class OutOfFuel(Exception):
+    pass
+
+
+@contextmanager
+def limit(calls):
+    # Raises OutOfFuel in the running thread or task once it has made that
+    # many calls. None means no limit.
+    token = FUEL.set(None if calls is None else [calls])
+    try:
+        yield
+    finally:
+        FUEL.reset(token)
+
+
+def burn(fuel):
+    if fuel[0] <= 0:
+        raise OutOfFuel()
+    fuel[0] -= 1
 
 
 class TailCall:
-    def __init__(self, f, params):
+    __slots__ = ("f", "params", "line")
+
+    def __init__(self, f, params, line=None):
         self.f = f
         self.params = params
+        self.line = line
+
+
+# The arguments of a call, or the names of a `let`, stored at the slots
+# handed out by the resolver. Globals are the environment in effect when the
+# frame was created, where unresolved names are looked up.
+class Frame:
+    __slots__ = ("slots", "parent", "globals")
+
+    def __init__(self, slots, parent, globals):
+        self.slots = slots
+        self.parent = parent
+        self.globals = globals
+
+
+class CallFrame(Frame):
+    # The frame of a running call. A tail call to the same function runs its
+    # body again in it instead of making another: the new parameters go in
+    # spare, which then trades places with the slots.
+    __slots__ = ("spare",)
+
+    def __init__(self, slots, parent, globals):
+        self.slots = slots
+        self.parent = parent
+        self.globals = globals
+        self.spare = None
+
+    def params(self, arity):
+        # Where to put the parameters of the next run
+        if self.spare is None:
+            self.spare = [None] * arity
+        return self.spare
+
+    def again(self):
+        self.slots, self.spare = self.spare, self.slots
+        return AGAIN
+
+
+def running_call(frame, function_frame):
+    # The frame of the call running in frame, if it runs the function whose
+    # own frame is function_frame, or else None
+    while frame is not None:
+        if type(frame) is CallFrame:
+            return frame if frame.parent is function_frame else None
+        frame = frame.parent
+    return None
+
+
+class LetFrame(Frame):
+    # The frame of a let whose functions refer to its own names. Functions
+    # made while it's being bound copy names that may not be set yet, or be
+    # set again later in the let, so the copies are updated once it's done.
+    __slots__ = ("fixups",)
+
+    def __init__(self, slots, parent, globals):
+        super().__init__(slots, parent, globals)
+        self.fixups = []
+
+    def fix(self):
+        slots = self.slots
+        for captures, i, slot in self.fixups:
+            captures[i] = slots[slot]
+        self.fixups = None
+
+
+class Pending(Frame):
+    # Captures some of which a LetFrame has yet to update. Functions made
+    # from it before then are updated by that LetFrame too.
+    __slots__ = ("waiting",)
+
+    def __init__(self, slots, globals, waiting):
+        super().__init__(slots, None, globals)
+        # capture index -> (LetFrame, slot)
+        self.waiting = waiting
+
+
+def capture(function, frame):
+    # The frame a function made in frame keeps: the values of the enclosing
+    # locals it uses, in the order the resolver gave them slots
+    captures = []
+    waiting = None
+    for depth, slot in function.free:
+        source = frame
+        for _ in range(depth):
+            source = source.parent
+        value = source.slots[slot]
+        let = None
+        if type(source) is LetFrame:
+            let = (source, slot)
+        elif type(source) is Pending:
+            let = source.waiting.get(slot)
+        if let is not None and let[0].fixups is not None:
+            let[0].fixups.append((captures, len(captures), let[1]))
+            if waiting is None:
+                waiting = {}
+            waiting[len(captures)] = let
+        elif value is UNSET:
+            raise Exception(function, "Name used before it was assigned")
+        captures.append(value)
+    if waiting is None:
+        return Frame(captures, None, frame.globals)
+    return Pending(captures, frame.globals, waiting)
+
+
+def use_locally(statement, frame, interpret):
+    # A use inside a body runs the file on top of the globals the body sees.
+    # The rest of the body sees its definitions through a frame of its own.
+    instance = CURRENT.get()
+    if instance is not None:
+        interpret = instance.interpret
+    result, environment = interpret(statement, frame.globals)
+    return result, Frame([], frame, environment)
+
+
+def let_frame(statement, frame):
+    size = statement.size
+    if statement.recursive:
+        return LetFrame([UNSET] * size, frame, frame.globals)
+    return Frame([UNSET] * size, frame, frame.globals)
+
+
+class Sentinel:
+    # A unique marker that stays the same object when pickled
+    def __init__(self, module, name):
+        self.__module__ = module
+        self.name = name
+
+    def __reduce__(self):
+        return self.name
+
+    def __repr__(self):
+        return self.name
+
+
+# Marks `let` slots that haven't been assigned yet
+UNSET = Sentinel(__name__, "UNSET")
+
+# What a body returns once a tail call to itself set it up to run again
+AGAIN = Sentinel(__name__, "AGAIN")
 
 
 def get_default_env():
-    env = ChainMap()
+    env = Environment(builtins=BUILTIN)
     env["!"] = "!"
     return env
 
 
-def interpret(statement, environment, is_tail_call=False):
+def interpret(statement, environment):
+    return resolver.interpret(statement, environment, top, interpret)
+
+
+def top(statement, environment, name=None):
+    return evaluate(statement, Frame((), None, environment))
+
+
+def evaluate(statement, frame, is_tail_call=False):
     if isinstance(statement, expr.Literal):
-        return (statement.value, environment)
+        return statement.value
     elif isinstance(statement, expr.Identifier):
-        return (environment[statement.name], environment)
+        if statement.depth is None:
+            return frame.globals[statement.name]
+        for _ in range(statement.depth):
+            frame = frame.parent
+        value = frame.slots[statement.slot]
+        if value is UNSET:
+            raise Exception(statement, "Name used before it was assigned")
+        return value
     elif isinstance(statement, expr.Function):
-        return (Function(statement, environment), environment)
+        return Function(statement, capture(statement, frame))
     elif isinstance(statement, expr.Builtin):
-        return (BUILTIN[statement.name], environment)
-    elif isinstance(statement, expr.Use):
-        with open(statement.filename) as file:
-            contents = file.read()
-            scanner = Scanner(contents)
-            parser = Parser(scanner.scan_tokens())
-            for statement in parser.program():
-                result, environment = interpret(statement, environment)
-            return (result, environment)
+        return frame.globals.builtins[statement.name]
     elif isinstance(statement, expr.Let):
-        environment = environment.new_child()
-        for (name, value) in statement.assignments:
-            (evaluated_value, _) = interpret(value, environment)
-            environment[name.name] = evaluated_value
-        return (None, environment)
+        bind(statement, frame)
+        return None
     elif isinstance(statement, expr.Expression):
-        results = []
-        for s in statement.call:
-            result, _ = interpret(s, environment)
-            results.append(result)
+        call = statement.call
         if is_tail_call:
-            return TailCall(results[0], results[1:])
+            f = evaluate(call[0], frame)
+            running = calling_itself(f, len(call) - 1, frame)
+            if running is not None:
+                params = running.params(len(call) - 1)
+                for i in range(1, len(call)):
+                    params[i - 1] = evaluate(call[i], frame)
+                return running.again()
+            params = [evaluate(call[i], frame) for i in range(1, len(call))]
+            return TailCall(f, params, statement.line)
         else:
-            return (do_call(*results), environment)
+            return do_call(*[evaluate(s, frame) for s in call], line=statement.line)
     elif isinstance(statement, expr.Symchain):
-        (left, _) = interpret(statement.left, environment)
-        (op, _) = interpret(statement.op, environment)
-        (right, _) = interpret(statement.right, environment)
+        left = evaluate(statement.left, frame)
+        op = evaluate(statement.op, frame)
+        if type(statement.right) is expr.Symchain:
+            right = evaluate_spine(statement.right, frame)
+        else:
+            right = evaluate(statement.right, frame)
         if is_tail_call:
-            return TailCall(op, [left, right])
+            running = calling_itself(op, 2, frame)
+            if running is not None:
+                params = running.params(2)
+                params[0] = left
+                params[1] = right
+                return running.again()
+            return TailCall(op, [left, right], statement.line)
         else:
-            return (do_call(op, left, right), environment)
+            return do_call(op, left, right, line=statement.line)
     elif isinstance(statement, expr.Conditional):
-        # Discard the environment from the evaluation
-        # to disallow `let`s done inside a case
+        # Lets done inside a case only live until the end of the case
         for condition, body in statement.cases:
-            value, _ = interpret(condition, environment)
+            value = evaluate(condition, frame)
             if value is True:
-                env = environment
-                for st in body[:-1]:
-                    result, env = interpret(st, env)
-
-                if is_tail_call:
-                    return interpret(body[-1], env, True)
-                else:
-                    result, _ = interpret(nody[-1], env)
-                    return (result, environment)
+                return run_body(body, frame, is_tail_call)
             elif value is False:
                 continue
             else:
                 raise Exception("Type mismatch, condition must be boolean", value)
-        return (None, environment)  # All conditions were false
+        return None  # All conditions were false
     else:
         raise Exception("Trying to run unknown thing", statement)
 
 
-def do_call(f, *params):
+def evaluate_spine(statement, frame):
+    # Chains nest to the right, so a long one is evaluated down its right
+    # operands in a loop, left to right, and then called last first
+    calls = []
+    while type(statement) is expr.Symchain:
+        left = evaluate(statement.left, frame)
+        op = evaluate(statement.op, frame)
+        calls.append((left, op, statement.line))
+        statement = statement.right
+    value = evaluate(statement, frame)
+    for left, op, line in reversed(calls):
+        value = do_call(op, left, value, line=line)
+    return value
+
+
+def calling_itself(f, arity, frame):
+    # The frame of the running call, if calling f with arity parameters
+    # would call the same function again
+    if type(f) is not Function or len(f.function.args) != arity:
+        return None
+    return running_call(frame, f.frame)
+
+
+def bind(statement, frame):
+    frame = let_frame(statement, frame)
+    slots = frame.slots
+    for (name, value) in statement.assignments:
+        slots[name.slot] = evaluate(value, frame)
+    if statement.recursive:
+        frame.fix()
+    return frame
+
+
+def run_body(body, frame, is_tail_call=False):
+    for statement in body[:-1]:
+        if isinstance(statement, expr.Let):
+            frame = bind(statement, frame)
+        elif isinstance(statement, expr.Use):
+            _, frame = use_locally(statement, frame, interpret)
+        else:
+            evaluate(statement, frame)
+    if isinstance(body[-1], expr.Use):
+        return use_locally(body[-1], frame, interpret)[0]
+    return evaluate(body[-1], frame, is_tail_call)
+
+
+def do_call(f, *params, line=None):
+    # line is where the call is, for profiling
+    profiler = PROFILER.get()
+    if profiler is not None:
+        return profiled_call(profiler, f, params, line)
+    fuel = FUEL.get()
     while True:
+        if type(f) is Partial:
+            params = (*f.params, *params)
+            f = f.function
+        if type(f) is Memo:
+            return f.call(do_call, params)
         # Currying, but optimized if there are multiple parameters
         if isinstance(f, Function):
-            f_env = f.environment.new_child()
             args = f.function.args
-            for name, value in zip(args, params):
-                f_env[name.name] = value
+            if f.function.intrinsic is not None and len(args) == len(params):
+                return f.frame.globals.builtins[f.function.intrinsic](*params)
             if len(args) > len(params):
-                return Function(
-                    expr.Function(args[len(params) :], f.function.body), f_env
-                )
+                return Partial(f, tuple(params))
             elif len(args) == len(params):
-                v = None
-                for statement in f.function.body[:-1]:
-                    (v, f_env) = interpret(statement, f_env)
-                result = interpret(f.function.body[-1], f_env, True)
+                if fuel is not None:
+                    burn(fuel)
+                frame = CallFrame(list(params), f.frame, f.frame.globals)
+                body = f.function.body
+                result = run_body(body, frame, True)
+                while result is AGAIN:
+                    if fuel is not None:
+                        burn(fuel)
+                    result = run_body(body, frame, True)
                 if isinstance(result, TailCall):
                     f = result.f
                     params = result.params
                     continue
                 else:
-                    return result[0]
+                    return result
             else:
                 raise Exception(f, "Function received too many parameters")
         elif callable(f):
             return f(*params)
         else:
             raise Exception(f, "Tried to call a non-function object")
+
+
+def profiled_call(profiler, f, params, line):
+    # do_call, reporting every function it runs to the profiler
+    fuel = FUEL.get()
+    entered = False
+    try:
+        while True:
+            if type(f) is Partial:
+                params = (*f.params, *params)
+                f = f.function
+            if type(f) is Memo:
+                return f.call(partial(do_call, line=line), params)
+            if isinstance(f, Function):
+                args = f.function.args
+                if len(args) > len(params):
+                    return Partial(f, tuple(params))
+                elif len(args) < len(params):
+                    raise Exception(f, "Function received too many parameters")
+
+                if entered:
+                    profiler.tail(f.function, line)
+                else:
+                    profiler.enter(f.function, line)
+                    entered = True
+                if f.function.intrinsic is not None:
+                    return f.frame.globals.builtins[f.function.intrinsic](*params)
+                if fuel is not None:
+                    burn(fuel)
+                frame = Frame(list(params), f.frame, f.frame.globals)
+                result = run_body(f.function.body, frame, True)
+                if isinstance(result, TailCall):
+                    f = result.f
+                    params = result.params
+                    line = result.line
+                    continue
+                return result
+            elif callable(f):
+                return f(*params)
+            else:
+                raise Exception(f, "Tried to call a non-function object")
+    finally:
+        if entered:
+            profiler.leave()
+
+
+@contextmanager
+def profiling(profiler):
+    # Reports the calls every engine makes in this thread or task to the
+    # profiler, until the block is over
+    token = PROFILER.set(profiler)
+    try:
+        yield profiler
+    finally:
+        PROFILER.reset(token)
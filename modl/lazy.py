@@ -0,0 +1,354 @@
+# The tree interpreter, but arguments are only evaluated when something
+# needs their value: a builtin, a cond, or calling them. Until then they're
+# Thunks, which remember their value once forced, so every use of an
+# argument shares one evaluation. `!` functions, calls to them and `let`s
+# stay strict.
+#
+# Evaluation keeps what's left to do on a stack of its own instead of
+# Python's: calling a function, forcing a thunk or running a body only
+# pushes onto it, so a thunk can depend on a chain of others as long as
+# memory allows, like the accumulator of a foldl.
+from . import expr as expr
+from . import interpreter
+from .interpreter import FUEL, PROFILER, Frame, Memo, Partial, Sentinel
+from .interpreter import UNSET, burn, capture, is_bang, let_frame, use_locally
+from . import resolver
+
+# Every engine module offers these, for modl.ENGINES
+get_default_env = interpreter.get_default_env
+profiling = interpreter.profiling
+
+
+# Marks thunks that haven't been forced yet
+PENDING = Sentinel(__name__, "PENDING")
+
+# What execute is doing
+EVALUATING = 0  # e in frame
+CALLING = 1  # f with params
+RUNNING = 2  # statement i of body, in frame
+FORCING = 3  # params one by one into values, then target with them
+RETURNING = 4  # value to whatever is on top of the stack
+
+# What's left to do once a value is known, kept on the stack as tuples
+# starting with one of these
+UPDATE = 0  # thunk: remember the value
+CALL = 1  # call, frame, line: call the value with the rest of call
+BANG = 2  # f, call, params, frame, line: add the value to params, go on
+CONDITION = 3  # cases, i, frame: take case i if the value is true
+LET = 4  # let, i, frame, body, j: bind assignment i, then statement j + 1
+BODY = 5  # body, i, frame: drop the value, go on with statement i
+FORCE = 6  # target, params, values, line: add the value to values
+MEMO = 7  # memo, key: remember the value
+APPLY = 8  # params, line: call the value with params
+LEAVE = 9  # tell the profiler the call is over
+
+
+class Function(interpreter.Function):
+    # Only so that closures made here can be told from the interpreter's
+    pass
+
+
+class Thunk:
+    __slots__ = ("expression", "frame", "value")
+
+    def __init__(self, expression, frame):
+        self.expression = expression
+        self.frame = frame
+        self.value = PENDING
+
+
+def interpret(statement, environment):
+    return resolver.interpret(statement, environment, top, interpret)
+
+
+def top(statement, environment, name=None):
+    return evaluate(statement, Frame((), None, environment))
+
+
+def delay(statement, frame):
+    # Whatever is cheaper to work out now than to wrap is never a thunk
+    if isinstance(statement, expr.Literal):
+        return statement.value
+    elif isinstance(statement, expr.Identifier):
+        if statement.depth is None:
+            return frame.globals[statement.name]
+        source = frame
+        for _ in range(statement.depth):
+            source = source.parent
+        value = source.slots[statement.slot]
+        if value is UNSET:
+            # Its let may still set it; forcing it any sooner is an error
+            return Thunk(statement, frame)
+        return value
+    elif isinstance(statement, expr.Function):
+        return Function(statement, capture(statement, frame))
+    elif isinstance(statement, expr.Builtin):
+        return frame.globals.builtins[statement.name]
+    elif isinstance(statement, expr.Expression):
+        head = statement.call[0]
+        if isinstance(head, expr.Identifier) and head.name.endswith("!"):
+            # Nothing may need its value, but its effects happen all the same
+            return evaluate(statement, frame)
+    return Thunk(statement, frame)
+
+
+def evaluate(statement, frame):
+    return execute(EVALUATING, statement, frame, [])
+
+
+def force(value):
+    if type(value) is not Thunk:
+        return value
+    if value.value is not PENDING:
+        return value.value
+    return execute(EVALUATING, value.expression, value.frame, [(UPDATE, value)])
+
+
+def do_call(f, *params, line=None):
+    # line is where the call is, for profiling
+    return execute(CALLING, f, params, [], line)
+
+
+def execute(mode, a, b, stack, line=None):
+    profiler = PROFILER.get()
+    try:
+        return run(mode, a, b, stack, profiler, FUEL.get(), line)
+    except BaseException:
+        if profiler is not None:
+            for k in reversed(stack):
+                if k[0] == LEAVE:
+                    profiler.leave()
+        raise
+
+
+def run(mode, a, b, stack, profiler, fuel, line):
+    # Values are always forced before they're returned, and line is where
+    # the call being made is
+    if mode == CALLING:
+        f, params = a, b
+    else:
+        e, frame = a, b
+    value = None
+    while True:
+        if mode == EVALUATING:
+            t = type(e)
+            if t is expr.Identifier:
+                if e.depth is None:
+                    value = frame.globals[e.name]
+                else:
+                    source = frame
+                    for _ in range(e.depth):
+                        source = source.parent
+                    value = source.slots[e.slot]
+                    if value is UNSET:
+                        raise Exception(e, "Name used before it was assigned")
+                if type(value) is Thunk:
+                    if value.value is PENDING:
+                        stack.append((UPDATE, value))
+                        e, frame = value.expression, value.frame
+                        continue
+                    value = value.value
+                mode = RETURNING
+            elif t is expr.Expression:
+                stack.append((CALL, e.call, frame, e.line))
+                e = e.call[0]
+            elif t is expr.Symchain:
+                stack.append((CALL, (e.op, e.left, e.right), frame, e.line))
+                e = e.op
+            elif t is expr.Literal:
+                value = e.value
+                mode = RETURNING
+            elif t is expr.Conditional:
+                stack.append((CONDITION, e.cases, 0, frame))
+                e = e.cases[0][0]
+            elif t is expr.Function:
+                value = Function(e, capture(e, frame))
+                mode = RETURNING
+            elif t is expr.Builtin:
+                value = frame.globals.builtins[e.name]
+                mode = RETURNING
+            else:
+                raise Exception("Trying to run unknown thing", e)
+
+        elif mode == RETURNING:
+            if not stack:
+                return value
+            k = stack.pop()
+            kind = k[0]
+            if kind == UPDATE:
+                thunk = k[1]
+                thunk.value = value
+                thunk.expression = None
+                thunk.frame = None
+            elif kind == CALL:
+                _, call, frame, line = k
+                f = value
+                if not is_bang(f):
+                    params = [delay(s, frame) for s in call[1:]]
+                    mode = CALLING
+                elif len(call) > 1:
+                    stack.append((BANG, f, call, [], frame, line))
+                    e = call[1]
+                    mode = EVALUATING
+                else:
+                    params = []
+                    mode = CALLING
+            elif kind == BANG:
+                _, f, call, params, frame, line = k
+                params.append(value)
+                if len(params) < len(call) - 1:
+                    stack.append(k)
+                    e = call[len(params) + 1]
+                    mode = EVALUATING
+                else:
+                    mode = CALLING
+            elif kind == CONDITION:
+                _, cases, i, frame = k
+                if value is True:
+                    body = cases[i][1]
+                    i = 0
+                    mode = RUNNING
+                elif value is False:
+                    i += 1
+                    if i < len(cases):
+                        stack.append((CONDITION, cases, i, frame))
+                        e = cases[i][0]
+                        mode = EVALUATING
+                    else:
+                        value = None  # All conditions were false
+                else:
+                    raise Exception("Type mismatch, condition must be boolean", value)
+            elif kind == LET:
+                _, let, j, frame, body, i = k
+                assignments = let.assignments
+                frame.slots[assignments[j][0].slot] = value
+                j += 1
+                if j < len(assignments):
+                    stack.append((LET, let, j, frame, body, i))
+                    e = assignments[j][1]
+                    mode = EVALUATING
+                else:
+                    if let.recursive:
+                        frame.fix()
+                    i += 1
+                    if i < len(body):
+                        mode = RUNNING
+                    else:
+                        value = None
+            elif kind == BODY:
+                _, body, i, frame = k
+                mode = RUNNING
+            elif kind == FORCE:
+                _, target, params, values, line = k
+                values.append(value)
+                mode = FORCING
+            elif kind == MEMO:
+                k[1].store(k[2], value)
+            elif kind == APPLY:
+                _, params, line = k
+                f = value
+                mode = CALLING
+            else:
+                profiler.leave()
+
+        elif mode == CALLING:
+            t = type(f)
+            if t is Partial:
+                params = (*f.params, *params)
+                f = f.function
+            elif t is Function:
+                function = f.function
+                arity = len(function.args)
+                if arity > len(params):
+                    value = Partial(f, tuple(params))
+                    mode = RETURNING
+                    continue
+                elif arity < len(params):
+                    raise Exception(f, "Function received too many parameters")
+                if profiler is not None:
+                    if stack and stack[-1][0] == LEAVE:
+                        profiler.tail(function, line)
+                    else:
+                        profiler.enter(function, line)
+                        stack.append((LEAVE,))
+                if function.intrinsic is not None:
+                    target = f.frame.globals.builtins[function.intrinsic]
+                    values = []
+                    mode = FORCING
+                else:
+                    if fuel is not None:
+                        burn(fuel)
+                    frame = Frame(list(params), f.frame, f.frame.globals)
+                    body = function.body
+                    i = 0
+                    mode = RUNNING
+            elif t is Thunk:
+                if f.value is PENDING:
+                    stack.append((APPLY, params, line))
+                    stack.append((UPDATE, f))
+                    e, frame = f.expression, f.frame
+                    mode = EVALUATING
+                else:
+                    f = f.value
+            elif t is Memo:
+                if f.arity is not None and len(params) < f.arity:
+                    value = Partial(f, tuple(params))
+                    mode = RETURNING
+                else:
+                    target = f
+                    values = []
+                    mode = FORCING
+            elif callable(f):
+                target = f
+                values = []
+                mode = FORCING
+            else:
+                raise Exception(f, "Tried to call a non-function object")
+
+        elif mode == RUNNING:
+            statement = body[i]
+            t = type(statement)
+            if t is expr.Let:
+                let = let_frame(statement, frame)
+                stack.append((LET, statement, 0, let, body, i))
+                e, frame = statement.assignments[0][1], let
+                mode = EVALUATING
+            elif t is expr.Use:
+                value, frame = use_locally(statement, frame, interpret)
+                i += 1
+                if i == len(body):
+                    mode = RETURNING
+            else:
+                if i < len(body) - 1:
+                    stack.append((BODY, body, i + 1, frame))
+                e = statement
+                mode = EVALUATING
+
+        else:
+            # Builtins and memos get their parameters' values
+            while len(values) < len(params):
+                p = params[len(values)]
+                if type(p) is Thunk:
+                    if p.value is PENDING:
+                        stack.append((FORCE, target, params, values, line))
+                        stack.append((UPDATE, p))
+                        e, frame = p.expression, p.frame
+                        mode = EVALUATING
+                        break
+                    p = p.value
+                values.append(p)
+            else:
+                if type(target) is not Memo:
+                    value = target(*values)
+                    mode = RETURNING
+                    continue
+                key = target.key(values)
+                if key is not None:
+                    found, value = target.lookup(key)
+                    if found:
+                        mode = RETURNING
+                        continue
+                    stack.append((MEMO, target, key))
+                f = target.function
+                params = values
+                mode = CALLING
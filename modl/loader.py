@@ -0,0 +1,166 @@
+# Loads `.dl` files for `use`, keeping a compiled copy of each one next to
+# it (`std.dl` -> `std.dlc`) so later loads skip the scanner and the parser.
+#
+# A cache file holds a small header followed by the pickled statements. The
+# header is trusted when the source's mtime and size still match; otherwise
+# the source is hashed, and the cache is only rebuilt if the contents changed.
+import contextvars
+import hashlib
+import io
+import os
+import pickle
+import threading
+from .parser import Parser
+from .scanner import Scanner
+
+# Bump whenever the layout of expr nodes changes
+MAGIC = "modl-ast-10"
+SUFFIX = "c"
+
+
+def load(filename):
+    cache = filename + SUFFIX
+    stat = os.stat(filename)
+
+    # Whatever is wrong with a cache file, from missing to truncated or
+    # pickled from classes that have changed since, it's parsed again
+    header = None
+    try:
+        with open(cache, "rb") as file:
+            data = io.BytesIO(file.read())
+        header = pickle.load(data)
+        if header["magic"] != MAGIC:
+            header = None
+        elif header["mtime"] == stat.st_mtime_ns and header["size"] == stat.st_size:
+            return pickle.load(data)
+    except Exception:
+        header = None
+
+    with open(filename, "rb") as file:
+        source = file.read()
+    digest = hashlib.sha256(source).hexdigest()
+
+    statements = None
+    if header is not None:
+        try:
+            if header["hash"] == digest:
+                # Touched but unchanged, so only the header is stale
+                statements = pickle.load(data)
+        except Exception:
+            statements = None
+    if statements is None:
+        statements = parse(source.decode("utf8"), filename)
+    write(cache, stat, digest, statements)
+    return statements
+
+
+# Files being loaded by the running thread or task, innermost last
+LOADING = contextvars.ContextVar("LOADING", default=())
+
+
+class Registry:
+    # Remembers the bindings each file added, keyed by absolute path, so
+    # using a file again attaches them instead of evaluating it again. Each
+    # root environment has its own, since the bindings were made against
+    # its globals, and a file that changed since is evaluated again.
+    def __init__(self):
+        self.modules = {}
+
+    def use(self, statement, environment, interpret):
+        path, cached = self.find(statement, environment)
+        if cached is not None:
+            return cached
+        base = environment
+        result = None
+        source = stamp(path)
+        token = LOADING.set(LOADING.get() + (path,))
+        try:
+            for statement in load(path):
+                result, environment = interpret(statement, environment)
+        finally:
+            LOADING.reset(token)
+        return self.store(path, source, base, result, environment)
+
+    async def use_async(self, statement, environment, interpret):
+        # use, for an interpret that's a coroutine
+        path, cached = self.find(statement, environment)
+        if cached is not None:
+            return cached
+        base = environment
+        result = None
+        source = stamp(path)
+        token = LOADING.set(LOADING.get() + (path,))
+        try:
+            for statement in load(path):
+                result, environment = await interpret(statement, environment)
+        finally:
+            LOADING.reset(token)
+        return self.store(path, source, base, result, environment)
+
+    def find(self, statement, environment):
+        # Two threads or tasks loading the same file isn't a cycle, it just
+        # gets loaded twice
+        path = os.path.abspath(statement.filename)
+        loading = LOADING.get()
+        if path in loading:
+            cycle = loading[loading.index(path) :] + (path,)
+            raise Exception("Import cycle", " -> ".join(cycle))
+        module = self.modules.get(path)
+        if module is not None and not statement.reload:
+            source, result, bindings = module
+            if source == stamp(path):
+                return (path, (result, environment.new_child(bindings)))
+        return (path, None)
+
+    def store(self, path, source, base, result, environment):
+        # source is the file's stamp from before it was loaded, so a change
+        # made while it ran still counts
+        self.modules[path] = (source, result, environment.changes(base))
+        return (result, environment)
+
+
+def stamp(path):
+    # Changes whenever the file does, as far as the cache header can tell
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def parse(source, filename=None):
+    scanner = Scanner(source)
+    parser = Parser(scanner.scan_tokens(), filename)
+    return parser.program()
+
+
+def write(cache, stat, digest, statements):
+    header = {
+        "magic": MAGIC,
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": digest,
+    }
+    temporary = "{}.{}.{}.tmp".format(cache, os.getpid(), threading.get_ident())
+    try:
+        with open(temporary, "wb") as file:
+            pickle.dump(header, file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(statements, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, cache)
+    except OSError:
+        # Read-only directories just don't get a cache
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def compile_tree(directory):
+    compiled = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.endswith(".dl"):
+                path = os.path.join(root, name)
+                load(path)
+                compiled.append(path)
+    return compiled
@@ -0,0 +1,421 @@
+from . import expr as expr
+from . import interpreter
+
+
+# Builtins without side effects, which may run while optimizing
+PURE_BUILTINS = {
+    "add",
+    "sub",
+    "mul",
+    "fdiv",
+    "mod",
+    "eq",
+    "gt",
+    "if",
+    "cons",
+    "head",
+    "tail",
+    "true",
+    "false",
+    "empty",
+}
+
+# Function bodies up to this many nodes get inlined
+INLINE_SIZE = 12
+
+# How many function calls pre-evaluating a single expression may make
+FUEL = 100000
+
+# Stands for "can't be optimized" where None is a valid value
+MISSING = object()
+
+
+def is_data(value):
+    # Plain values that can be baked into the program as literals
+    while True:
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return True
+        if not isinstance(value, tuple) or len(value) not in (0, 2):
+            return False
+        if not value:
+            return True
+        head, value = value
+        if not is_data(head):
+            return False
+
+
+def is_pure_builtin(name, builtins):
+    # Only the default builtins are known to be pure, not whatever an
+    # Interpreter was given under the same name
+    return name in PURE_BUILTINS and builtins.get(name) is interpreter.BUILTIN[name]
+
+
+def describe(node):
+    if isinstance(node, expr.Literal) and isinstance(node.value, tuple):
+        # Long lists nest too deep for repr
+        length, rest = 0, node.value
+        while rest:
+            length, rest = length + 1, rest[1]
+        return "<list of {}>".format(length)
+    text = repr(node)
+    return text if len(text) <= 60 else text[:57] + "..."
+
+
+class Optimizer:
+    # Rewrites a statement using what's known about the global environment
+    # it's about to run in: folds builtins over literals, inlines small
+    # functions, pre-evaluates pure calls on literals inside functions and
+    # drops cond cases that can't be taken. Anything reached through a `!`
+    # name or an effectful builtin is left alone. What was done is appended
+    # to `report`.
+    def __init__(self, environment, do_call, report=None):
+        self.environment = environment
+        self.do_call = do_call
+        self.report = [] if report is None else report
+        self.scopes = []
+        self.functions = 0
+        self.inlining = []
+        self.purity = {}
+
+    def statement(self, statement):
+        if isinstance(statement, expr.Use):
+            return statement
+        elif isinstance(statement, expr.Let):
+            return self.let(statement)
+        else:
+            return self.expression(statement)
+
+    def let(self, statement):
+        # Every value can see every name in the let, and none of them is
+        # known until it runs
+        self.scopes.append({name.name for (name, _) in statement.assignments})
+        return expr.Let(
+            [(name, self.expression(value)) for (name, value) in statement.assignments]
+        )
+
+    def body(self, body):
+        depth = len(self.scopes)
+        result = []
+        for st in body:
+            if isinstance(st, expr.Use):
+                # What the file defines isn't known, so the rest is left alone
+                result.extend(body[len(result) :])
+                break
+            elif isinstance(st, expr.Let):
+                result.append(self.let(st))
+            else:
+                result.append(self.expression(st))
+        del self.scopes[depth:]
+        return result
+
+    def expression(self, e):
+        if isinstance(e, expr.Expression):
+            call = [self.expression(s) for s in e.call]
+            return self.call(e, call[0], call[1:])
+        elif isinstance(e, expr.Symchain):
+            left = self.expression(e.left)
+            right = self.expression(e.right)
+            return self.call(e, e.op, [left, right])
+        elif isinstance(e, expr.Identifier):
+            value = self.constant(e.name)
+            if value is not MISSING and is_data(value):
+                return typed(expr.Literal(value), e)
+            return e
+        elif isinstance(e, expr.Function):
+            self.scopes.append({arg.name for arg in e.args})
+            self.functions += 1
+            body = self.body(e.body)
+            self.functions -= 1
+            self.scopes.pop()
+            function = expr.Function(e.args, body, e.line, e.filename)
+            function.name = e.name
+            return typed(function, e)
+        elif isinstance(e, expr.Conditional):
+            return typed(self.conditional(e), e)
+        else:
+            return e
+
+    def conditional(self, e):
+        cases = []
+        for i, (condition, body) in enumerate(e.cases):
+            condition = self.expression(condition)
+            if isinstance(condition, expr.Literal) and condition.value is False:
+                self.report.append("dropped dead case " + describe(condition))
+                continue
+            cases.append((condition, self.body(body)))
+            if isinstance(condition, expr.Literal) and condition.value is True:
+                if i + 1 < len(e.cases):
+                    self.report.append(
+                        "dropped {} case(s) after {}".format(
+                            len(e.cases) - i - 1, describe(condition)
+                        )
+                    )
+                break
+        if not cases:
+            # What a cond gives when no case is taken
+            return expr.Literal(None)
+        return expr.Conditional(cases)
+
+    def call(self, e, head, params):
+        if isinstance(head, expr.Identifier) and head.name.endswith("!"):
+            result = MISSING
+        else:
+            result = self.fold(head, params)
+            if result is MISSING:
+                result = self.inline(head, params)
+            if result is MISSING and self.functions:
+                result = self.evaluate(head, params)
+
+        if result is not MISSING:
+            return typed(result, e)
+        elif isinstance(e, expr.Symchain):
+            return typed(expr.Symchain(params[0], head, params[1], e.line), e)
+        else:
+            return typed(expr.Expression([head] + params, e.line), e)
+
+    def constant(self, name):
+        # The value a global name will have when this code runs
+        if name.endswith("!") or any(name in scope for scope in self.scopes):
+            return MISSING
+        try:
+            return self.environment[name]
+        except KeyError:
+            return MISSING
+
+    def fold(self, head, params):
+        if not all(isinstance(p, expr.Literal) for p in params):
+            return MISSING
+        if isinstance(head, expr.Builtin):
+            name = head.name
+        else:
+            function = self.function(head)
+            if function is None or len(function.args) != len(params):
+                return MISSING
+            name = function.intrinsic
+        builtins = self.environment.builtins
+        if not is_pure_builtin(name, builtins):
+            return MISSING
+
+        try:
+            value = builtins[name](*(p.value for p in params))
+        except Exception:
+            return MISSING  # Errors are left for runtime
+        if not is_data(value):
+            return MISSING
+        result = expr.Literal(value)
+        self.report.append(
+            "folded {} {} -> {}".format(
+                describe(head), " ".join(describe(p) for p in params), describe(result)
+            )
+        )
+        return result
+
+    def function(self, head):
+        # The expr.Function behind a global closure that captures nothing
+        if not isinstance(head, expr.Identifier):
+            return None
+        value = self.constant(head.name)
+        function = getattr(value, "function", None)
+        if not isinstance(function, expr.Function) or function.free:
+            return None
+        return function
+
+    def inline(self, head, params):
+        function = self.function(head)
+        if function is None or len(function.body) != 1:
+            return MISSING
+        value = self.environment[head.name]
+        if any(value is v for v in self.inlining):
+            return MISSING
+
+        args = [arg.name for arg in function.args]
+        if (
+            len(args) != len(params)
+            or len(set(args)) != len(args)
+            or any(arg.endswith("!") for arg in args)
+        ):
+            return MISSING
+        if not all(isinstance(p, (expr.Literal, expr.Identifier)) for p in params):
+            return MISSING
+        size = self.inline_size(function.body[0], set(args), value)
+        if size is None or size > INLINE_SIZE:
+            return MISSING
+
+        body = substitute(function.body[0], dict(zip(args, params)))
+        self.report.append("inlined {} into {}".format(head.name, describe(body)))
+        self.inlining.append(value)
+        try:
+            return self.expression(body)
+        finally:
+            self.inlining.pop()
+
+    def inline_size(self, node, args, value):
+        # Number of nodes in a body that means the same inside the caller,
+        # or None
+        if isinstance(node, expr.Literal):
+            return 1
+        elif isinstance(node, expr.Builtin):
+            # It has to mean the same where it's defined and in the caller
+            builtins = (value.frame.globals.builtins, self.environment.builtins)
+            if all(is_pure_builtin(node.name, b) for b in builtins):
+                return 1
+            return None
+        elif isinstance(node, expr.Identifier):
+            if node.name in args:
+                return 1
+            bound = value.frame.globals.get(node.name, MISSING)
+            if bound is MISSING or bound is value:
+                return None
+            if self.constant(node.name) is not bound:
+                return None
+            return 1
+        elif isinstance(node, (expr.Expression, expr.Symchain)):
+            children = (
+                node.call
+                if isinstance(node, expr.Expression)
+                else [node.left, node.op, node.right]
+            )
+            total = 1
+            for child in children:
+                size = self.inline_size(child, args, value)
+                if size is None:
+                    return None
+                total += size
+            return total
+        else:
+            return None
+
+    def evaluate(self, head, params):
+        # Runs a pure call on literals now instead of every time the
+        # enclosing function runs
+        if not isinstance(head, expr.Identifier):
+            return MISSING
+        if not all(isinstance(p, expr.Literal) for p in params):
+            return MISSING
+        value = self.constant(head.name)
+        if value is MISSING or not self.pure(value):
+            return MISSING
+
+        try:
+            with interpreter.limit(FUEL):
+                result = self.do_call(value, *(p.value for p in params))
+        except Exception:
+            # Including running out of fuel
+            return MISSING
+        if not is_data(result):
+            return MISSING
+
+        literal = expr.Literal(result)
+        self.report.append(
+            "pre-evaluated {} {} -> {}".format(
+                head.name, " ".join(describe(p) for p in params), describe(literal)
+            )
+        )
+        return literal
+
+    def pure(self, value):
+        # Only whole answers are remembered: the ones found along the way
+        # may have assumed a function still being checked was pure
+        key = id(value)
+        if key not in self.purity:
+            self.purity[key] = (value, self.check_pure(value, set()))
+        return self.purity[key][1]
+
+    def check_pure(self, value, visiting):
+        if is_data(value):
+            return True
+        if isinstance(value, interpreter.Partial):
+            return self.check_pure(value.function, visiting) and all(
+                self.check_pure(p, visiting) for p in value.params
+            )
+        function = getattr(value, "function", None)
+        if isinstance(function, expr.Function):
+            if id(value) in visiting:
+                return True
+            visiting.add(id(value))
+            if function.free:
+                return False  # Can't see what it captured
+            return self.check_body(function, value.frame.globals, visiting)
+        return any(value is interpreter.BUILTIN.get(name) for name in PURE_BUILTINS)
+
+    def check_body(self, function, globals, visiting):
+        pending = [function]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, expr.Function):
+                if any(arg.name.endswith("!") for arg in node.args):
+                    return False
+                pending.extend(node.body)
+            elif isinstance(node, expr.Builtin):
+                if not is_pure_builtin(node.name, globals.builtins):
+                    return False
+            elif isinstance(node, expr.Identifier):
+                if node.name.endswith("!"):
+                    return False
+                if node.depth is None:
+                    if node.name not in globals:
+                        return False
+                    if not self.check_pure(globals[node.name], visiting):
+                        return False
+            elif isinstance(node, expr.Expression):
+                pending.extend(node.call)
+            elif isinstance(node, expr.Symchain):
+                pending.extend((node.left, node.op, node.right))
+            elif isinstance(node, expr.Let):
+                pending.extend(value for (_, value) in node.assignments)
+            elif isinstance(node, expr.Conditional):
+                for condition, body in node.cases:
+                    pending.append(condition)
+                    pending.extend(body)
+            elif not isinstance(node, expr.Literal):
+                return False
+        return True
+
+
+def typed(node, original):
+    node.types = original.types
+    return node
+
+
+def substitute(node, params):
+    if isinstance(node, expr.Identifier):
+        if node.name in params:
+            param = params[node.name]
+            if isinstance(param, expr.Identifier):
+                return typed(expr.Identifier(param.name), param)
+            return param
+        return typed(expr.Identifier(node.name), node)
+    elif isinstance(node, expr.Expression):
+        return typed(
+            expr.Expression([substitute(s, params) for s in node.call], node.line),
+            node,
+        )
+    elif isinstance(node, expr.Symchain):
+        return typed(
+            expr.Symchain(
+                substitute(node.left, params),
+                substitute(node.op, params),
+                substitute(node.right, params),
+                node.line,
+            ),
+            node,
+        )
+    else:
+        return node
+
+
+class Optimizing:
+    # Wraps an engine so that every statement, including the ones in used
+    # files, goes through the optimizer first
+    def __init__(self, engine):
+        self.engine = engine
+        self.report = []
+
+    def get_default_env(self):
+        return self.engine.get_default_env()
+
+    def interpret(self, statement, environment):
+        if isinstance(statement, expr.Use):
+            return environment.modules.use(statement, environment, self.interpret)
+        optimizer = Optimizer(environment, self.engine.do_call, self.report)
+        return self.engine.interpret(optimizer.statement(statement), environment)
@@ -0,0 +1,217 @@
+# {#pmap}: map over a list with a pool of worker processes. The pool is
+# started by the first pmap and kept for the later ones. The function is
+# pickled once, together with everything it can see, and pickled again only
+# if the globals it sees have changed since. Each worker keeps
+# it by digest once unpickled. The first time the pool maps a function, the
+# first chunk for each worker carries it; after that, chunks of the list
+# only carry the digest, and a chunk is sent again with the function if its
+# worker didn't have it.
+import hashlib
+import io
+import math
+import os
+import pickle
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from . import closures, interpreter, lazy, vm
+from .interpreter import BUILTIN, Memo, Partial, Pending, is_bang
+
+# Worker processes to use; None means one per CPU
+WORKERS = None
+
+# Chunks per worker, so a slow chunk doesn't leave the others idle
+CHUNKS_PER_WORKER = 4
+
+# Functions unpickled by a worker process, by digest; None outside of one
+FUNCTIONS = None
+
+# Functions a worker keeps at most
+KEEP = 8
+
+# The pool, with the process that started it and how many workers it has:
+# a forked child can't use its parent's
+POOL = None
+POOL_OWNER = None
+POOL_LOCK = threading.Lock()
+
+# Digests of the functions the pool has been sent
+SENT = set()
+
+# function -> (stamp, payload, digest), for the functions pickled so far
+PICKLED = weakref.WeakKeyDictionary()
+
+
+class Pickler(pickle.Pickler):
+    # Cons lists nest as deep as they are long, too deep for pickle, so
+    # they're written flat
+    def persistent_id(self, obj):
+        if type(obj) is not tuple or len(obj) != 2:
+            return None
+        if type(obj[1]) is not tuple or not obj[1]:
+            return None
+        items = []
+        while type(obj) is tuple and len(obj) == 2:
+            items.append(obj[0])
+            obj = obj[1]
+        return (items, obj)
+
+
+class Unpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        return build_list(*pid)
+
+
+def build_list(items, end):
+    l = end
+    for item in reversed(items):
+        l = (item, l)
+    return l
+
+
+def dumps(value):
+    output = io.BytesIO()
+    Pickler(output, pickle.HIGHEST_PROTOCOL).dump(value)
+    return output.getvalue()
+
+
+def loads(data):
+    return Unpickler(io.BytesIO(data)).load()
+
+
+def call(f, *params):
+    # Runs a function with the engine that made it
+    base = f
+    while type(base) is Partial or type(base) is Memo:
+        base = base.function
+    if type(base) is closures.Closure:
+        return closures.do_call(f, *params)
+    elif type(base) is vm.Closure:
+        return vm.do_call(f, *params)
+    elif type(base) is lazy.Function:
+        return lazy.force(lazy.do_call(f, *params))
+    else:
+        return interpreter.do_call(f, *params)
+
+
+def pmap(f, l):
+    if is_bang(f):
+        raise Exception(f, "Only pure functions can be mapped in parallel")
+    items = []
+    while l:
+        items.append(l[0])
+        l = l[1]
+
+    workers = WORKERS or os.cpu_count() or 1
+    results = None
+    # Workers don't use pools of their own
+    if FUNCTIONS is None and workers > 1 and len(items) > 1:
+        try:
+            payload, digest = pickled(f)
+        except (pickle.PicklingError, TypeError, AttributeError, RecursionError):
+            payload = None  # Mapped here instead
+        if payload is not None:
+            results = run(payload, digest, items, workers)
+    if results is None:
+        results = [call(f, item) for item in items]
+    return build_list(results, ())
+
+
+def pickled(f):
+    # The function pickled, and its digest. What it can see is pickled with
+    # it, so that's only done again once it may have changed.
+    try:
+        cached = PICKLED.get(f)
+    except TypeError:
+        cached = current = None  # Builtins that can't be weakly referenced
+    else:
+        current = stamp(f)
+    if cached is not None and current is not None and cached[0] == current:
+        return cached[1:]
+    payload = dumps(f)
+    digest = hashlib.sha256(payload).digest()
+    if current is not None:
+        PICKLED[f] = (current, payload, digest)
+    return payload, digest
+
+
+def stamp(f):
+    # Changes to the globals a function sees, or None if what it captured
+    # may still change: a let it was made in hasn't been fully bound yet
+    while type(f) is Partial or type(f) is Memo:
+        f = f.function
+    frame = getattr(f, "frame", None)
+    if frame is None:
+        return 0
+    if type(frame) is Pending:
+        for let, _ in frame.waiting.values():
+            if let.fixups is not None:
+                return None
+    return (frame.globals.table, frame.globals.table.changes)
+
+
+def pool(workers):
+    global POOL, POOL_OWNER
+    with POOL_LOCK:
+        owner = (os.getpid(), workers)
+        if POOL is None or POOL_OWNER != owner:
+            if POOL is not None and POOL_OWNER[0] == owner[0]:
+                POOL.shutdown(wait=False)
+            POOL = ProcessPoolExecutor(workers, initializer=start)
+            POOL_OWNER = owner
+            SENT.clear()
+        return POOL
+
+
+def run(payload, digest, items, workers):
+    global POOL
+    size = math.ceil(len(items) / (workers * CHUNKS_PER_WORKER))
+    chunks = [dumps(items[i : i + size]) for i in range(0, len(items), size)]
+    executor = pool(workers)
+    # Workers take chunks in order, so the first few reach each of them
+    with_payload = 0 if digest in SENT else workers
+    SENT.add(digest)
+    done = [None] * len(chunks)
+    try:
+        tasks = {
+            executor.submit(
+                run_chunk, digest, payload if i < with_payload else None, chunk
+            ): i
+            for i, chunk in enumerate(chunks)
+        }
+        retries = {}
+        for task in as_completed(tasks):
+            i = tasks[task]
+            done[i] = task.result()
+            if done[i] is None:
+                retries[executor.submit(run_chunk, digest, payload, chunks[i])] = i
+        for task in as_completed(retries):
+            done[retries[task]] = task.result()
+    except BrokenProcessPool:
+        # A worker died; the next pmap starts a new pool
+        with POOL_LOCK:
+            if POOL is executor:
+                POOL = None
+        raise
+    return [result for chunk in done for result in loads(chunk)]
+
+
+def start():
+    global FUNCTIONS
+    FUNCTIONS = {}
+
+
+def run_chunk(digest, payload, chunk):
+    # None when the function isn't kept here and payload wasn't sent
+    f = FUNCTIONS.get(digest)
+    if f is None:
+        if payload is None:
+            return None
+        if len(FUNCTIONS) >= KEEP:
+            FUNCTIONS.clear()
+        f = FUNCTIONS[digest] = loads(payload)
+    return dumps([call(f, item) for item in loads(chunk)])
+
+
+BUILTIN["pmap"] = pmap
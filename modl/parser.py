@@ -3,22 +3,31 @@ from .tokens import Token, TokenType
 
 
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.current = 0
+    def __init__(self, tokens, filename=None):
+        # Tokens are pulled one at a time, so they may come from a generator
+        self.tokens = iter(tokens)
+        # The file they come from, if any, for the functions defined in it
+        self.filename = filename
+        self.lookahead = None
+        self.last = None
 
     def program(self):
-        statements = []
+        return list(self.statements())
+
+    def statements(self):
+        # Yields each statement as soon as its `;` has been read
         while not self.is_at_end():
-            statements.append(self.statement())
-        return statements
+            yield self.statement()
 
     def statement(self):
-        stmt = None
-        if self.match(TokenType.USE):
+        token_type = self.peek().token_type
+        if token_type is TokenType.USE or token_type is TokenType.USE_BANG:
+            self.advance()
+            reload = token_type is TokenType.USE_BANG
             string = self.consume("Need a filename to import", TokenType.STRING)
-            stmt = expr.Use(string.literal)
-        elif self.match(TokenType.LET):
+            stmt = expr.Use(string.literal, reload)
+        elif token_type is TokenType.LET:
+            self.advance()
             stmt = self.let()
         else:
             stmt = self.symchain()
@@ -37,32 +46,49 @@ class Parser:
 
             self.consume("Missing <-", TokenType.LEFT_ARROW)
             value = self.symchain()
+            if isinstance(value, expr.Function):
+                value.name = identifier.name
             assignments.append((identifier, value))
             if not self.match(TokenType.COMMA):
                 break
         return expr.Let(assignments)
 
     def symchain(self):
+        # Symbols are right associative, and a chain ends where a type
+        # annotation is, which goes to its innermost right operand. After
+        # one, the chain it ended goes on as the left operand of the next
+        # symbol. Operands waiting for their right side are kept in a list
+        # rather than on the call stack, so chains can be any length.
+        pending = []
         e = self.expression()
-
-        while self.match(TokenType.SYMBOLIC):
-            # We only care about the name
-            symbol = expr.Identifier(self.previous().lexeme)
-            right = self.symchain()
-            e = expr.Symchain(e, symbol, right)
-
-        types = []
-        if self.match(TokenType.COLON):
-            t = self.consume("Expected a type after :", TokenType.TYPENAME)
+        while True:
+            if self.peek().token_type is TokenType.SYMBOLIC:
+                # We only care about the name
+                token = self.advance()
+                symbol = expr.Identifier(token.lexeme)
+                pending.append((e, symbol, token.line))
+                e = self.expression()
+                continue
+
+            e.types = self.types()
+            if not pending:
+                return e
+            left, symbol, line = pending.pop()
+            e = expr.Symchain(left, symbol, e, line)
+
+    def types(self):
+        if self.peek().token_type is not TokenType.COLON:
+            return ()
+        self.advance()
+        t = self.consume("Expected a type after :", TokenType.TYPENAME)
+        types = [t.lexeme]
+        while self.match(TokenType.RIGHT_ARROW):
+            t = self.consume("Expected a type after ->", TokenType.TYPENAME)
             types.append(t.lexeme)
-
-            while self.match(TokenType.RIGHT_ARROW):
-                t = self.consume("Expected a type after ->", TokenType.TYPENAME)
-                types.append(t.lexeme)
-        e.types = types
-        return e
+        return tuple(types)
 
     def expression(self):
+        line = self.peek().line
         chain = []
 
         while True:
@@ -80,62 +106,67 @@ class Parser:
         if len(chain) == 1:
             return chain[0]
         else:
-            return expr.Expression(chain)
+            return expr.Expression(chain, line)
 
     def try_primary(self):
-        if self.match(TokenType.OPEN_BRACKETS):
-            argument_list = []
-            head_arg = self.consume(
-                "Argument list cannot be empty", TokenType.BANG, TokenType.IDENTIFIER
+        parse = PRIMARIES.get(self.peek().token_type)
+        if parse is None:
+            return None
+        return parse(self, self.advance())
+
+    def function(self, token):
+        argument_list = []
+        head_arg = self.consume(
+            "Argument list cannot be empty", TokenType.BANG, TokenType.IDENTIFIER
+        )
+        argument_list.append(expr.Identifier(head_arg.lexeme))
+        while self.match(TokenType.IDENTIFIER):
+            argument_list.append(expr.Identifier(self.previous().lexeme))
+        self.consume("Missing argument delimiter", TokenType.PIPE)
+        body = [self.statement()]
+        while not self.check(TokenType.CLOSE_BRACKETS):
+            e = self.statement()
+            body.append(e)
+        self.consume("Unclosed function definition", TokenType.CLOSE_BRACKETS)
+        return expr.Function(argument_list, body, token.line, self.filename)
+
+    def literal(self, token):
+        return expr.Literal(token.literal)
+
+    def identifier(self, token):
+        return expr.Identifier(token.lexeme)
+
+    def builtin(self, token):
+        return expr.Builtin(token.literal)
+
+    def parentheses(self, token):
+        if self.match(TokenType.SYMBOLIC):
+            identifier = expr.Identifier(self.previous().lexeme)
+            self.consume(
+                "Symbol expressions can only contain a symbol",
+                TokenType.CLOSE_PARENTHESES,
             )
-            argument_list.append(expr.Identifier(head_arg.lexeme))
-            while self.match(TokenType.IDENTIFIER):
-                argument_list.append(expr.Identifier(self.previous().lexeme))
-            self.consume("Missing argument delimiter", TokenType.PIPE)
+            return identifier
+        e = self.symchain()
+        self.consume("Missing closing parentheses", TokenType.CLOSE_PARENTHESES)
+        return e
+
+    def conditional(self, token):
+        cases = []
+        while True:
+            self.consume("Missing condition delimiter", TokenType.PIPE)
+            condition = self.symchain()
+            self.consume("Missing condition delimiter", TokenType.RIGHT_ARROW)
+
             body = [self.statement()]
-            while not self.check(TokenType.CLOSE_BRACKETS):
-                e = self.statement()
-                body.append(e)
-            self.consume("Unclosed function definition", TokenType.CLOSE_BRACKETS)
-            return expr.Function(argument_list, body)
-        elif self.match(TokenType.STRING, TokenType.B10_FLOAT, TokenType.B10_INTEGER):
-            return expr.Literal(self.previous().literal)
-        elif self.match(TokenType.IDENTIFIER):
-            return expr.Identifier(self.previous().lexeme)
-        elif self.match(TokenType.BUILTIN):
-            return expr.Builtin(self.previous().literal)
-        elif self.match(TokenType.OPEN_PARENTHESES):
-            if self.check(TokenType.SYMBOLIC):
-                symbol = self.match(TokenType.SYMBOLIC)
-                identifier = expr.Identifier(self.previous().lexeme)
-                self.consume(
-                    "Symbol expressions can only contain a symbol",
-                    TokenType.CLOSE_PARENTHESES,
-                )
-                return identifier
-            e = self.symchain()
-            self.consume("Missing closing parentheses", TokenType.CLOSE_PARENTHESES)
-            return e
-        elif self.match(TokenType.COND):
-            cases = []
-            while True:
-                self.consume("Missing condition delimiter", TokenType.PIPE)
-                condition = self.symchain()
-                self.consume("Missing condition delimiter", TokenType.RIGHT_ARROW)
-
-                body = [self.statement()]
-                while not self.check(
-                    TokenType.PIPE, TokenType.SEMICOLON, TokenType.COLON
-                ):
-                    body.append(self.statement())
-                cases.append((condition, body))
-
-                if not self.check(TokenType.PIPE):
-                    break
-
-            return expr.Conditional(cases)
-        else:
-            return None
+            while not self.check(TokenType.PIPE, TokenType.SEMICOLON, TokenType.COLON):
+                body.append(self.statement())
+            cases.append((condition, body))
+
+            if not self.check(TokenType.PIPE):
+                break
+
+        return expr.Conditional(cases)
 
     def check(self, *types):
         if self.is_at_end():
@@ -156,14 +187,30 @@ class Parser:
 
     def advance(self):
         if not self.is_at_end():
-            self.current += 1
+            self.last = self.lookahead
+            self.lookahead = None
         return self.previous()
 
     def is_at_end(self):
         return self.peek().token_type == TokenType.EOF
 
     def peek(self):
-        return self.tokens[self.current]
+        if self.lookahead is None:
+            self.lookahead = next(self.tokens)
+        return self.lookahead
 
     def previous(self):
-        return self.tokens[self.current - 1]
+        return self.last
+
+
+# What each token that can start a primary is parsed by, once it's read
+PRIMARIES = {
+    TokenType.OPEN_BRACKETS: Parser.function,
+    TokenType.STRING: Parser.literal,
+    TokenType.B10_FLOAT: Parser.literal,
+    TokenType.B10_INTEGER: Parser.literal,
+    TokenType.IDENTIFIER: Parser.identifier,
+    TokenType.BUILTIN: Parser.builtin,
+    TokenType.OPEN_PARENTHESES: Parser.parentheses,
+    TokenType.COND: Parser.conditional,
+}
@@ -0,0 +1,184 @@
+# Profilers for MODL functions. Engines only report to them while
+# profiling, so ordinary runs barely pay for it. Profiler times every call;
+# Sampler only keeps a stack of names and looks at it every so often.
+import collections
+import json
+import sys
+import threading
+import time
+from .loader import LOADING
+
+
+def label(function):
+    if function.name is not None:
+        return function.name
+    return "<lambda:{}>".format(function.line)
+
+
+def location(function, line=None, filename=None):
+    # Where it was called from, or else where it was defined. Names and
+    # lines alone repeat across files.
+    if line is None:
+        line, filename = function.line, function.filename
+    return "{} ({}:{})".format(function.name or "<lambda>", filename or "<input>", line)
+
+
+class FunctionStats:
+    __slots__ = ("function", "calls", "tail_calls", "self_time", "cumulative", "active")
+
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+        # Iterations reached through a tail call, which reuse the caller's
+        # place on the stack instead of being a call of their own
+        self.tail_calls = 0
+        self.self_time = 0.0
+        self.cumulative = 0.0
+        # How many times it's on the stack, so recursion isn't counted twice
+        self.active = 0
+
+    def as_dict(self):
+        return {
+            "function": label(self.function),
+            "line": self.function.line,
+            "calls": self.calls,
+            "tail_calls": self.tail_calls,
+            "self": self.self_time,
+            "cumulative": self.cumulative,
+        }
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.functions = {}
+        # One [stats, start, time spent in callees] per running call
+        self.stack = []
+
+    def stats(self, function):
+        stats = self.functions.get(function)
+        if stats is None:
+            stats = self.functions[function] = FunctionStats(function)
+        return stats
+
+    # line is where the call is, which only Sampler keeps
+    def enter(self, function, line=None):
+        stats = self.stats(function)
+        stats.calls += 1
+        self.push(stats)
+
+    def tail(self, function, line=None):
+        # The running function is done, and another one takes its place
+        self.pop()
+        stats = self.stats(function)
+        stats.tail_calls += 1
+        self.push(stats)
+
+    def leave(self):
+        self.pop()
+
+    def push(self, stats):
+        stats.active += 1
+        self.stack.append([stats, self.clock(), 0.0])
+
+    def pop(self):
+        stats, start, callees = self.stack.pop()
+        elapsed = self.clock() - start
+        stats.self_time += elapsed - callees
+        stats.active -= 1
+        if stats.active == 0:
+            stats.cumulative += elapsed
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def sorted(self, key="self"):
+        return sorted(
+            (stats.as_dict() for stats in self.functions.values()),
+            key=lambda row: row[key],
+            reverse=True,
+        )
+
+    def report(self, key="self", limit=None):
+        lines = [
+            "{:>10} {:>10} {:>10} {:>10}  {}".format(
+                "calls", "tail calls", "self", "cumulative", "function"
+            )
+        ]
+        for row in self.sorted(key)[:limit]:
+            lines.append(
+                "{calls:>10} {tail_calls:>10} {self:>10.6f} {cumulative:>10.6f}  "
+                "{function}".format(**row)
+            )
+        return "\n".join(lines)
+
+    def dump(self, stream):
+        json.dump(self.sorted(), stream, indent=2)
+
+
+class Sampler:
+    # A background thread samples a shadow stack of the running functions,
+    # each with the file and line it was called from. A tail call replaces
+    # the top of the stack, so a loop stays one frame.
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stack = []
+        self.samples = collections.Counter()
+        self.running = False
+        self.thread = None
+
+    # Names are only worked out when the samples are written
+    def enter(self, function, line=None):
+        self.stack.append((function, line, self.caller()))
+
+    def tail(self, function, line=None):
+        # The call is in the body of the function it replaces
+        self.stack[-1] = (function, line, self.stack[-1][0].filename)
+
+    def caller(self):
+        # The file the running code is from: the running function's, or
+        # else the one being used, if any
+        if self.stack:
+            return self.stack[-1][0].filename
+        loading = LOADING.get()
+        return loading[-1] if loading else None
+
+    def leave(self):
+        self.stack.pop()
+
+    def start(self):
+        self.running = True
+        # Threads only take turns every switch interval, which would
+        # otherwise cap the sampling rate
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, self.interval))
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        sys.setswitchinterval(self.switch_interval)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def sample(self):
+        while self.running:
+            stack = tuple(self.stack)
+            if stack:
+                self.samples[stack] += 1
+            time.sleep(self.interval)
+
+    def collapsed(self):
+        # One line per stack, outermost first, in the format flamegraph
+        # tools read
+        lines = collections.Counter()
+        for stack, count in self.samples.items():
+            lines[";".join(location(*call) for call in stack)] += count
+        return "".join(
+            "{} {}\n".format(stack, count) for stack, count in sorted(lines.items())
+        )
@@ -0,0 +1,236 @@
+from . import expr
+
+
+# Local names get a (depth, slot) address: how many frames up the chain the
+# binding lives, and its index inside that frame. Names not bound by any
+# enclosing function or `let` are globals and keep `depth = None`, since
+# top-level bindings can still change through `use` and the REPL.
+#
+# Functions don't see the frames they were made in. The locals of
+# enclosing functions they use are copied into a frame of their own when
+# they're made, one past their arguments' frame, and their `free` lists
+# where to copy each one from.
+class Context:
+    # A function being resolved, or the top level
+    def __init__(self, function=None):
+        self.function = function
+        self.scopes = []
+        self.captures = {}
+
+
+class Resolver:
+    def __init__(self):
+        self.contexts = [Context()]
+        # (scope, let, names assigned so far) for the lets whose values are
+        # being resolved
+        self.binding = []
+        # Steps left to do, last first, each a function and its arguments.
+        # Nodes are resolved from here rather than on the call stack, so
+        # expressions can nest to any depth.
+        self.work = []
+
+    @property
+    def scopes(self):
+        return self.contexts[-1].scopes
+
+    def statement(self, statement):
+        if isinstance(statement, expr.Use):
+            pass
+        elif isinstance(statement, expr.Let):
+            # Top-level bindings are globals, looked up by name
+            for (_, value) in statement.assignments:
+                self.expression(value)
+        else:
+            self.expression(statement)
+        return statement
+
+    def expression(self, e):
+        work = self.work
+        work.append((self.node, e))
+        while work:
+            step, *args = work.pop()
+            step(*args)
+
+    def schedule(self, steps):
+        # Runs steps in order, before those scheduled earlier
+        self.work.extend(reversed(steps))
+
+    def body(self, body):
+        # The steps that resolve body, and then drop the scopes it adds
+        scopes = self.scopes
+        steps = []
+        for statement in body:
+            if isinstance(statement, expr.Let):
+                steps.append((self.let, statement))
+            elif isinstance(statement, expr.Use):
+                # What the file defines is only known once it runs, so it's
+                # looked up by name, from a frame without slots
+                steps.append((scopes.append, {}))
+            else:
+                steps.append((self.node, statement))
+        steps.append((scopes.__delitem__, slice(len(scopes), None)))
+        return steps
+
+    def let(self, statement):
+        # Every name in a single let shares the new scope. Its values see a
+        # name there once it's been assigned, and before that the enclosing
+        # binding, like `let x <- x + 1;` does at the top level. Functions
+        # they make always see the new scope, which is how they recurse.
+        scope = {}
+        for (name, _) in statement.assignments:
+            name.depth = 0
+            name.slot = scope.setdefault(name.name, len(scope))
+        statement.size = len(scope)
+        statement.recursive = False
+        self.scopes.append(scope)
+        assigned = set()
+        self.binding.append((scope, statement, assigned))
+        steps = []
+        for (name, value) in statement.assignments:
+            steps.append((self.node, value))
+            steps.append((assigned.add, name.name))
+        steps.append((self.binding.pop,))
+        self.schedule(steps)
+
+    def node(self, e):
+        if isinstance(e, expr.Identifier):
+            self.identifier(e)
+        elif isinstance(e, expr.Expression):
+            self.schedule([(self.node, s) for s in e.call])
+        elif isinstance(e, expr.Symchain):
+            self.schedule(
+                [(self.node, e.left), (self.node, e.op), (self.node, e.right)]
+            )
+        elif isinstance(e, expr.Function):
+            e.free = []
+            context = Context(e)
+            context.scopes.append({arg.name: slot for slot, arg in enumerate(e.args)})
+            self.contexts.append(context)
+            self.schedule(self.body(e.body) + [(self.leave, e)])
+        elif isinstance(e, expr.Conditional):
+            steps = []
+            for condition, body in e.cases:
+                steps.append((self.node, condition))
+                steps.extend(self.body(body))
+            self.schedule(steps)
+
+    def leave(self, function):
+        self.contexts.pop()
+        function.intrinsic = intrinsic(function)
+
+    def identifier(self, identifier):
+        address = self.address(identifier.name, len(self.contexts) - 1)
+        identifier.depth, identifier.slot = address or (None, None)
+
+    def address(self, name, level):
+        # Where the name is, seen from the innermost scope of a context.
+        # Goes out a context at a time until it's found, then back in,
+        # capturing it in each function on the way.
+        inner = len(self.contexts) - 1
+        missing = []
+        while True:
+            context = self.contexts[level]
+            address = self.local(name, context, level < inner)
+            if address is not None:
+                break
+            if context.function is None:
+                return None
+            if name in context.captures:
+                address = (len(context.scopes), context.captures[name])
+                break
+            missing.append(context)
+            level -= 1
+        for context in reversed(missing):
+            context.captures[name] = len(context.captures)
+            context.function.free.append(address)
+            address = (len(context.scopes), context.captures[name])
+        return address
+
+    def local(self, name, context, outer):
+        # Where the name is among the scopes of context, if it's there
+        for depth, scope in enumerate(reversed(context.scopes)):
+            if name in scope:
+                if not outer and not self.assigned(scope, name):
+                    continue
+                if outer:
+                    self.captured(scope)
+                return (depth, scope[name])
+        return None
+
+    def captured(self, scope):
+        # A function made while a let is being bound may copy one of its
+        # slots before it's set, so the let has to fill them in afterwards
+        for binding, let, _ in self.binding:
+            if binding is scope:
+                let.recursive = True
+
+    def assigned(self, scope, name):
+        # Whether a value can use the name in scope yet
+        for binding, _, assigned in self.binding:
+            if binding is scope:
+                return name in assigned
+        return True
+
+
+def resolve(statement):
+    # Resolves a top-level statement the first time it's run. The addresses
+    # don't depend on the environment, so running it again reuses them.
+    if not isinstance(statement, expr.Use) and not statement.resolved:
+        Resolver().statement(statement)
+        statement.resolved = True
+    return statement
+
+
+# What every engine does with a top-level statement. A `use` goes to the
+# environment's modules, which run the file's statements with interpret; a
+# `let` binds its names in a new child of the environment, and anything else
+# is just evaluated. evaluate(e, environment[, name]) is the engine's value of e at
+# the top level, given the name a `let` binds it to.
+def interpret(statement, environment, evaluate, interpret):
+    resolve(statement)
+    if isinstance(statement, expr.Use):
+        return environment.modules.use(statement, environment, interpret)
+    elif isinstance(statement, expr.Let):
+        environment = environment.new_child()
+        for (name, value) in statement.assignments:
+            environment[name.name] = evaluate(value, environment, name.name)
+        return (None, environment)
+    else:
+        return (evaluate(statement, environment), environment)
+
+
+async def interpret_async(statement, environment, evaluate, interpret):
+    # interpret, where evaluate and interpret are coroutines
+    resolve(statement)
+    if isinstance(statement, expr.Use):
+        return await environment.modules.use_async(statement, environment, interpret)
+    elif isinstance(statement, expr.Let):
+        environment = environment.new_child()
+        for (name, value) in statement.assignments:
+            environment[name.name] = await evaluate(value, environment, name.name)
+        return (None, environment)
+    else:
+        return (await evaluate(statement, environment), environment)
+
+
+# Functions like `{ x y | {#add} x y; }` only hand their arguments, in
+# order, to a builtin. Returns that builtin's name so calls can go straight
+# to it, or None. This is a property of the function itself, so it stays
+# correct whatever names it ends up bound to.
+def intrinsic(function):
+    if len(function.body) != 1:
+        return None
+    call = function.body[0]
+    if not isinstance(call, expr.Expression):
+        return None
+    builtin, params = call.call[0], call.call[1:]
+    if not isinstance(builtin, expr.Builtin) or len(params) != len(function.args):
+        return None
+
+    names = [arg.name for arg in function.args]
+    if len(set(names)) != len(names):
+        return None
+    for name, param in zip(names, params):
+        if not isinstance(param, expr.Identifier) or param.name != name:
+            return None
+    return builtin.name
@@ -0,0 +1,114 @@
+import io
+import sys
+import threading
+from contextlib import contextmanager
+from . import expr as expr
+from . import interpreter, parallel
+from .parser import Parser
+from .scanner import Scanner
+
+
+class Interpreter:
+    # An environment, module cache, builtins, pair of streams, profiler and
+    # fuel of its own, so that several can run side by side in threads.
+    # Every run starts from the environment as it was when it began and
+    # adds its definitions to it when it's done, so concurrent runs never
+    # see each other half way.
+    def __init__(self, engine="tree", stdin=None, stdout=None, builtins=None):
+        from . import ENGINES
+
+        self.engine = ENGINES[engine] if isinstance(engine, str) else engine
+        self.stdin = sys.stdin if stdin is None else stdin
+        self.stdout = sys.stdout if stdout is None else stdout
+        # What {#name} means here: the default builtins and the ones given
+        self.builtins = interpreter.Builtins(interpreter.BUILTIN)
+        if builtins is not None:
+            self.builtins.update(builtins)
+        self.environment = self.engine.get_default_env()
+        self.environment.builtins = self.builtins
+        # What runs report their calls to, and how many calls each run may
+        # make, if anything. A Profiler keeps one stack, so only profile one
+        # run at a time.
+        self.profiler = None
+        self.fuel = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def running(self):
+        # What the code it runs sees as the running Interpreter, profiler
+        # and fuel, in this thread or task
+        current = interpreter.CURRENT.set(self)
+        profiler = interpreter.PROFILER.set(self.profiler)
+        fuel = interpreter.FUEL.set(None if self.fuel is None else [self.fuel])
+        try:
+            yield
+        finally:
+            interpreter.FUEL.reset(fuel)
+            interpreter.PROFILER.reset(profiler)
+            interpreter.CURRENT.reset(current)
+
+    def interpret(self, statement, environment):
+        if isinstance(statement, expr.Use):
+            return environment.modules.use(statement, environment, self.interpret)
+        return self.engine.interpret(statement, environment)
+
+    def run(self, source):
+        if isinstance(source, str):
+            source = io.StringIO(source)
+        parser = Parser(Scanner().scan_stream(source))
+        with self.lock:
+            base = environment = self.environment
+        result = None
+        try:
+            with self.running():
+                for statement in parser.statements():
+                    result, environment = self.interpret(statement, environment)
+        finally:
+            self.merge(base, environment)
+        return result
+
+    async def interpret_async(self, statement, environment):
+        if isinstance(statement, expr.Use):
+            return await environment.modules.use_async(
+                statement, environment, self.interpret_async
+            )
+        return await self.engine.interpret_async(statement, environment)
+
+    async def run_async(self, source):
+        # run, without blocking the event loop: print!, read! and sleep! wait
+        # on it, and long computations give way to it now and then. stdin
+        # and stdout may be asyncio streams.
+        if not hasattr(self.engine, "interpret_async"):
+            raise Exception(self.engine, "Engine can't run asynchronously")
+        if isinstance(source, str):
+            source = io.StringIO(source)
+        parser = Parser(Scanner().scan_stream(source))
+        with self.lock:
+            base = environment = self.environment
+        result = None
+        try:
+            with self.running():
+                for statement in parser.statements():
+                    result, environment = await self.interpret_async(
+                        statement, environment
+                    )
+        finally:
+            self.merge(base, environment)
+        return result
+
+    def call(self, name, *params):
+        with self.running():
+            with self.lock:
+                f = self.environment[name]
+            return parallel.call(f, *params)
+
+    def merge(self, base, environment):
+        # Whatever was added on top of base goes on top of the current
+        # environment, which other runs may have added to in the meantime
+        with self.lock:
+            if self.environment is base:
+                self.environment = environment
+                return
+            added = environment.changes(base)
+            if added:
+                self.environment = self.environment.new_child(added)
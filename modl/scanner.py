@@ -1,5 +1,39 @@
+import re
 from .tokens import Token, TokenType
 
+# What kind of token a character can start. Anything not in the table is
+# classified (and cached) the first time it's seen.
+BUILTIN_OR_BRACKET = 0
+COMMENT_OR_SYMBOL = 1
+UNIQUE = 2
+NUMBER = 3
+NEWLINE = 4
+SPACE = 5
+STRING = 6
+TYPENAME = 7
+IDENTIFIER = 8
+SYMBOLIC = 9
+INVALID_NUMBER = 10
+
+# Runs of characters, matched in one go instead of one peek() at a time.
+# \w is exactly isalnum() plus "_".
+IDENTIFIER_CHARS = re.compile(r"[\w']*")
+SYMBOLIC_CHARS = re.compile(r"(?:[^\s\w;{}(),]|_)*")
+SPACE_CHARS = re.compile(r"\s+")
+STRING_CHARS = re.compile(r'[^"\\]*')
+# An optional sign and dot, followed by digits and dots with at least one digit
+NUMBER_CHARS = re.compile(r"-?\.?\.*\d[\d.]*")
+
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "\\": "\\", '"': '"'}
+
+# How much of a stream is read at a time
+CHUNK_SIZE = 64 * 1024
+
+
+# Raised when the source ends in the middle of a token
+class UnexpectedEnd(Exception):
+    pass
+
 
 class Scanner:
     # These tokens may not appear as part of a longer token
@@ -28,204 +62,241 @@ class Scanner:
         "cond": TokenType.COND,
     }
 
-    def __init__(self, source):
+    # Reserved words that have a bang variant
+    bang_words = {
+        "use": TokenType.USE_BANG,
+    }
+
+    kinds = {}
+
+    def __init__(self, source=""):
         self.source = source
+        self.final = True
 
-        self.start = 0
-        self.current = 0
         self.line = 1
         self.tokens = []
 
-    def scan_tokens(self):
-        while not self.is_at_end():
-            self.start = self.current
-            self.scan_token()
-
-        self.tokens.append(Token(TokenType.EOF, "", None, self.line))
-        return self.tokens
-
-    def is_at_end(self):
-        return self.current >= len(self.source)
-
-    def scan_token(self):
-        c = self.peek()
-        if self.match("{#"):
-            self.builtin()
-        elif self.match("/*"):
-            self.comment()
-        elif c in self.unique_tokens:
-            self.advance()
-            self.add_token(self.unique_tokens[c])
-        elif c in ["-", "."] or c.isnumeric():
-            self.number()
-        elif self.match("\n"):
-            self.line += 1
+    @classmethod
+    def kind(cls, c):
+        # Same precedence as the checks in the original per-character scanner
+        if c == "{":
+            kind = BUILTIN_OR_BRACKET
+        elif c == "/":
+            kind = COMMENT_OR_SYMBOL
+        elif c in cls.unique_tokens:
+            kind = UNIQUE
+        elif c in "-." or c.isdecimal():
+            kind = NUMBER
+        elif c.isnumeric():
+            kind = INVALID_NUMBER
+        elif c == "\n":
+            kind = NEWLINE
         elif c.isspace():
-            self.advance()
-        elif self.match('"'):
-            self.string()
+            kind = SPACE
+        elif c == '"':
+            kind = STRING
         elif c.isupper():
-            self.typename()
+            kind = TYPENAME
         elif c.isalpha():
-            self.identifier()
+            kind = IDENTIFIER
         else:
             # All other characters count as symbols
-            self.symbolic()
-
-    def builtin(self):
-        while self.valid_in_identifier(self.peek()):
-            self.advance()
-        if not self.match("}"):
-            raise Exception(self.line, "Unterminated builtin literal")
-        self.add_token(TokenType.BUILTIN, self.current_lexeme()[2:-1])
+            kind = SYMBOLIC
+        cls.kinds[c] = kind
+        return kind
 
-    def number(self):
-        self.match("-")  # May match a starting -
-        self.match(".")  # May match .??? or -.???
+    def scan_tokens(self):
+        self.scan(0, True)
+        self.tokens.append(Token(TokenType.EOF, "", None, self.line))
+        return self.tokens
 
-        is_number = False
-        while True:
-            c = self.peek()
-            if c is None:
-                break
-            elif c.isnumeric():
-                self.advance()
-                is_number = True
-            elif c == ".":
-                self.advance()
+    def scan_stream(self, stream, chunk_size=CHUNK_SIZE):
+        # Reads the source a chunk at a time, yielding tokens as soon as
+        # they're known to be complete
+        self.source = ""
+        final = False
+        while not final:
+            chunk = stream.read(chunk_size)
+            final = not chunk
+            consumed = self.scan(0, final, self.source + chunk)
+            self.source = self.source[consumed:]
+            yield from self.tokens
+            self.tokens = []
+        yield Token(TokenType.EOF, "", None, self.line)
+
+    def scan(self, current, final, source=None):
+        # Scans tokens into self.tokens, returning where it stopped. Unless
+        # this is the final piece of the source, a token that reaches the
+        # end (or fails because it does) is left for when there's more.
+        if source is not None:
+            self.source = source
+        self.final = final
+        source = self.source
+        length = len(source)
+        tokens = self.tokens
+        kinds = self.kinds
+
+        while current < length:
+            start = current
+            line = self.line
+            scanned = len(tokens)
+            c = source[current]
+            kind = kinds.get(c)
+            if kind is None:
+                kind = self.kind(c)
+
+            try:
+                if kind == SPACE or kind == NEWLINE:
+                    current = SPACE_CHARS.match(source, current).end()
+                    self.line += source.count("\n", start, current)
+                elif kind == IDENTIFIER:
+                    current = self.identifier(start)
+                elif kind == UNIQUE:
+                    current += 1
+                    tokens.append(Token(self.unique_tokens[c], c, None, self.line))
+                    continue
+                elif kind == SYMBOLIC:
+                    current = self.symbolic(start)
+                elif kind == NUMBER:
+                    current = self.number(start)
+                elif kind == BUILTIN_OR_BRACKET:
+                    if source.startswith("#", current + 1):
+                        current = self.builtin(start)
+                    else:
+                        current += 1
+                        token = Token(TokenType.OPEN_BRACKETS, c, None, self.line)
+                        tokens.append(token)
+                elif kind == COMMENT_OR_SYMBOL:
+                    if source.startswith("*", current + 1):
+                        current = self.comment(start)
+                    else:
+                        current = self.symbolic(start)
+                elif kind == STRING:
+                    current = self.string(start)
+                    continue
+                elif kind == TYPENAME:
+                    current = IDENTIFIER_CHARS.match(source, current).end()
+                    lexeme = source[start:current]
+                    tokens.append(Token(TokenType.TYPENAME, lexeme, None, self.line))
+                else:
+                    raise Exception(self.line, c + " is not a valid number")
+            except UnexpectedEnd:
+                if final:
+                    raise
+                current = length
+
+            if current >= length and not final:
+                self.line = line
+                del tokens[scanned:]
+                return start
+
+        return current
+
+    def identifier(self, start):
+        source = self.source
+        current = IDENTIFIER_CHARS.match(source, start).end()
+        lexeme = source[start:current]
+        bang = source.startswith("!", current)
+        if lexeme in self.reserved_words:
+            if bang:
+                if lexeme not in self.bang_words:
+                    raise Exception("Can't use bangs after reserved words.")
+                current += 1
+                token_type = self.bang_words[lexeme]
             else:
-                break
-
-        if not is_number:
-            return self.symbolic()
-
-        if "." in self.current_lexeme():
-            self.add_token(TokenType.B10_FLOAT, float(self.current_lexeme()))
+                token_type = self.reserved_words[lexeme]
+        elif bang:
+            current += 1
+            token_type = TokenType.IDENTIFIER
         else:
-            self.add_token(TokenType.B10_INTEGER, int(self.current_lexeme(), 10))
-
-    def typename(self):
-        while self.valid_in_identifier(self.peek()):
-            self.advance()
-
-        self.add_token(TokenType.TYPENAME)
-
-    def identifier(self):
-        while self.valid_in_identifier(self.peek()):
-            self.advance()
-
-        lexeme = self.current_lexeme()
-        if lexeme in self.reserved_words:
-            if self.match("!"):
-                raise Exception("Can't use bangs after reserved words.")
-            self.add_token(self.reserved_words[lexeme])
+            token_type = TokenType.IDENTIFIER
+        self.tokens.append(Token(token_type, source[start:current], None, self.line))
+        return current
+
+    def builtin(self, start):
+        current = IDENTIFIER_CHARS.match(self.source, start + 2).end()
+        if current >= len(self.source):
+            raise UnexpectedEnd(self.line, "Unterminated builtin literal")
+        if not self.source.startswith("}", current):
+            raise Exception(self.line, "Unterminated builtin literal")
+        current += 1
+        lexeme = self.source[start:current]
+        self.tokens.append(Token(TokenType.BUILTIN, lexeme, lexeme[2:-1], self.line))
+        return current
+
+    def number(self, start):
+        match = NUMBER_CHARS.match(self.source, start)
+        if match is None:
+            return self.symbolic(start)
+
+        current = match.end()
+        if current >= len(self.source) and not self.final:
+            return current  # It may go on in the next chunk
+        if current < len(self.source) and self.source[current].isnumeric():
+            raise Exception(self.line, self.source[current] + " is not a valid number")
+
+        lexeme = match.group()
+        if "." in lexeme:
+            literal = float(lexeme)
+            self.tokens.append(Token(TokenType.B10_FLOAT, lexeme, literal, self.line))
         else:
-            self.match("!")
-            self.add_token(TokenType.IDENTIFIER)
-
-    def valid_in_identifier(self, c):
-        if c is None:
-            return False
-        if c.isalnum():
-            return True
-        if c in "'_":
-            return True
-        return False
-
-    def symbolic(self):
-        while self.valid_as_symbolic(self.peek()):
-            self.advance()
-        lexeme = self.current_lexeme()
+            literal = int(lexeme, 10)
+            self.tokens.append(Token(TokenType.B10_INTEGER, lexeme, literal, self.line))
+        return current
+
+    def symbolic(self, start):
+        current = SYMBOLIC_CHARS.match(self.source, start).end()
+        if current >= len(self.source) and not self.final:
+            return current  # It may go on in the next chunk
+        lexeme = self.source[start:current]
         if lexeme == "*/":
             raise Exception(self.line, "Unopened comment.")
-        elif lexeme in self.reserved_symbols:
-            self.add_token(self.reserved_symbols[lexeme])
-        else:
-            self.add_token(TokenType.SYMBOLIC)
+        token_type = self.reserved_symbols.get(lexeme, TokenType.SYMBOLIC)
+        self.tokens.append(Token(token_type, lexeme, None, self.line))
+        return current
+
+    def string(self, start):
+        source = self.source
+        length = len(source)
+        current = start + 1
+        literal = []
+        while True:
+            current_end = STRING_CHARS.match(source, current).end()
+            literal.append(source[current:current_end])
+            self.line += source.count("\n", current, current_end)
+            current = current_end
+
+            if current >= length:
+                raise UnexpectedEnd(self.line, "Unterminated string")
+            if source[current] == '"':
+                break
 
-    def valid_as_symbolic(self, c):
-        if c is None:
-            return False
-        elif c.isspace():
-            return False
-        elif c.isalnum():
-            return False
-        elif c in self.unique_tokens:
-            return False
-        else:
-            return True
-
-    def string(self):
-        literal = ""
-        while self.peek() != '"' and not self.is_at_end():
-            c = self.peek()  # Sure would like to have the walrus op
-            if c == "\n":
-                self.line += 1
-
-            if c == "\\":  # Escape characters
-                self.advance()
-                if self.is_at_end():
-                    break
-                e = self.peek()
-                if e == "n":
-                    literal += "\n"
-                elif e == "r":
-                    literal += "\r"
-                elif e == "t":
-                    literal += "\t"
-                elif e == "\\":
-                    literal += "\\"
-                elif e == '"':
-                    literal += '"'
-                elif e == "x":
-                    # fetch 4 characters as hex and decode as unicode
-                    codepoint = self.source[self.current + 1 : self.current + 5]
-                    if len(codepoint) < 4:
-                        raise Exception(self.line, "Unterminated string")
-                    literal += chr(int(codepoint, 16))
-                    self.current += 4
-                else:
-                    raise Exception(self.line, "\\" + e + " is not an escape sequence")
+            current += 1  # Escape characters
+            if current >= length:
+                raise UnexpectedEnd(self.line, "Unterminated string")
+            e = source[current]
+            if e in ESCAPES:
+                literal.append(ESCAPES[e])
+                current += 1
+            elif e == "x":
+                # fetch 4 characters as hex and decode as unicode
+                codepoint = source[current + 1 : current + 5]
+                if len(codepoint) < 4:
+                    raise UnexpectedEnd(self.line, "Unterminated string")
+                literal.append(chr(int(codepoint, 16)))
+                current += 5
             else:
-                literal += c
-            self.advance()
-
-        if self.is_at_end():
-            raise Exception(self.line, "Unterminated string")
-
-        self.advance()  # Closing "
-
-        self.add_token(TokenType.STRING, literal)
-
-    def comment(self):
-        while not self.match("*/"):
-            if self.is_at_end():
-                raise Exception(self.line, "Unterminated comment")
-            if self.peek() == "\n":
-                self.line += 1
-            self.advance()
-
-        # self.add_token(TokenType.COMMENT, self.current_lexeme())
-
-    def advance(self):
-        self.current += 1
-        return self.source[self.current - 1]
-
-    def peek(self, n=1):
-        if self.current + n > len(self.source):
-            return None
-        return self.source[self.current : self.current + n]
-
-    def current_lexeme(self):
-        return self.source[self.start : self.current]
-
-    def add_token(self, token_type, literal=None):
-        self.tokens.append(Token(token_type, self.current_lexeme(), literal, self.line))
-
-    def match(self, c):
-        if self.is_at_end():
-            return False
-        if self.peek(len(c)) != c:
-            return False
-        self.current += len(c)
-        return True
+                raise Exception(self.line, "\\" + e + " is not an escape sequence")
+
+        current += 1  # Closing "
+        lexeme = source[start:current]
+        self.tokens.append(Token(TokenType.STRING, lexeme, "".join(literal), self.line))
+        return current
+
+    def comment(self, start):
+        end = self.source.find("*/", start + 2)
+        if end == -1:
+            self.line += self.source.count("\n", start)
+            raise UnexpectedEnd(self.line, "Unterminated comment")
+        self.line += self.source.count("\n", start, end)
+        return end + 2
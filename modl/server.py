@@ -0,0 +1,147 @@
+# Keeps an Interpreter with the prelude already used, and runs each script
+# it's sent in a child forked from it, so a script starts as soon as it
+# arrives and can't change what the next one sees. bin/modl_client.py sends
+# the scripts.
+#
+# Both ends talk in frames: a kind byte, a 4 byte length and that many bytes.
+# The client sends "d" (its working directory) and "s" (the script). The
+# server answers with any number of "o" (output), "e" (errors) and "?" (a
+# line of input is needed, which the client sends back as "i", empty at the
+# end of input), then "x" with the exit status.
+import gc
+import os
+import socket
+import socketserver
+import stat
+import struct
+import traceback
+from . import snapshot as snapshots
+from .runtime import Interpreter
+
+HEADER = struct.Struct(">cI")
+
+
+def send(stream, kind, payload=b""):
+    stream.write(HEADER.pack(kind, len(payload)) + payload)
+    stream.flush()
+
+
+def receive(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise EOFError()
+    kind, size = HEADER.unpack(header)
+    return kind, stream.read(size)
+
+
+class Output:
+    def __init__(self, stream, kind):
+        self.stream = stream
+        self.kind = kind
+
+    def write(self, text):
+        send(self.stream, self.kind, text.encode("utf8"))
+
+    def flush(self):
+        pass
+
+
+class Input:
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+
+    def readline(self):
+        send(self.wfile, b"?")
+        kind, line = receive(self.rfile)
+        if kind != b"i":
+            raise Exception(kind, "Expected a line of input from the client")
+        return line.decode("utf8")
+
+
+class Handler(socketserver.StreamRequestHandler):
+    # Runs in the child, which exits once it's done
+    def handle(self):
+        request = {}
+        while b"s" not in request:
+            try:
+                kind, payload = receive(self.rfile)
+            except EOFError:
+                return  # Left without asking anything, like remove_stale does
+            request[kind] = payload.decode("utf8")
+
+        modl = self.server.modl
+        modl.stdin = Input(self.rfile, self.wfile)
+        modl.stdout = Output(self.wfile, b"o")
+        try:
+            os.chdir(request.get(b"d", "."))
+            result = modl.run(request[b"s"])
+        except Exception:
+            send(self.wfile, b"e", traceback.format_exc().encode("utf8"))
+            status = 1
+        else:
+            status = status_of(result)
+            if not isinstance(status, int):
+                send(self.wfile, b"e", "{}\n".format(status).encode("utf8"))
+                status = 1
+        send(self.wfile, b"x", str(status).encode("utf8"))
+
+
+def status_of(result):
+    # What the script's result would make modl_cli.py exit with
+    if result is None:
+        return 0
+    if isinstance(result, int):
+        return int(result)
+    return result
+
+
+def remove_stale(path):
+    # A server that was killed leaves its socket behind, and binding to the
+    # path fails until it's gone. If nothing answers on it, it's taken over.
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.remove(path)
+    else:
+        # Closing isn't enough for the child that answers to see the end: a
+        # server in this same process may have forked it with probe open
+        probe.shutdown(socket.SHUT_RDWR)
+    finally:
+        probe.close()
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    max_children = 256
+
+    def __init__(self, path, engine="tree", prelude=(), snapshot=None):
+        self.modl = Interpreter(engine)
+        if snapshot is not None:
+            self.modl.environment = snapshots.load(snapshot, self.modl)
+        for filename in prelude:
+            self.modl.run('use "{}";'.format(os.path.abspath(filename)))
+        # Objects made so far are never freed, and the collector touching
+        # them would copy the pages every child shares with the server
+        gc.freeze()
+        remove_stale(path)
+        # Only a socket this server made is removed when it closes: a failed
+        # bind closes it too
+        self.bound = False
+        super().__init__(path, Handler)
+
+    def server_bind(self):
+        super().server_bind()
+        self.bound = True
+        # Whoever can connect runs code as this user, whatever the umask
+        os.chmod(self.server_address, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if self.bound:
+            os.remove(self.server_address)
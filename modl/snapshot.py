@@ -0,0 +1,43 @@
+# Saves an evaluated environment to a file and loads it back, instead of
+# running the files that built it again. Everything goes into one pickle,
+# so closures that shared a frame or a version of the environment still share
+# it once loaded. Used files are saved too, since the environment keeps
+# them, so that using them again finds them already loaded unless they
+# changed since.
+#
+# A snapshot holds a header and then the environment.
+import io
+import pickle
+from . import loader, parallel
+
+# Bump whenever what a snapshot holds changes. Snapshots hold AST nodes, so
+# they also go stale with loader.MAGIC.
+MAGIC = "modl-snapshot-5"
+
+
+def engine_name(engine):
+    # Through an Interpreter or an Optimizing, down to the engine module
+    while hasattr(engine, "engine"):
+        engine = engine.engine
+    return engine.__name__
+
+
+def save(path, environment, engine):
+    header = {"magic": MAGIC, "ast": loader.MAGIC, "engine": engine_name(engine)}
+    output = io.BytesIO()
+    pickler = parallel.Pickler(output, pickle.HIGHEST_PROTOCOL)
+    pickler.dump(header)
+    pickler.dump(environment)
+    with open(path, "wb") as file:
+        file.write(output.getvalue())
+
+
+def load(path, engine):
+    with open(path, "rb") as file:
+        unpickler = parallel.Unpickler(io.BytesIO(file.read()))
+    header = unpickler.load()
+    if header.get("magic") != MAGIC or header.get("ast") != loader.MAGIC:
+        raise Exception(path, "Snapshot was made by another version of MODL")
+    if header["engine"] != engine_name(engine):
+        raise Exception(path, "Snapshot was made by engine " + header["engine"])
+    return unpickler.load()
@@ -26,6 +26,7 @@ class TokenType(enum.Enum):
 
     # Keywords
     USE = enum.auto()
+    USE_BANG = enum.auto()
     LET = enum.auto()
 
     # Literals
@@ -41,6 +42,8 @@ class TokenType(enum.Enum):
 
 
 class Token:
+    __slots__ = ("token_type", "lexeme", "literal", "line")
+
     def __init__(self, token_type, lexeme, literal, line):
         self.token_type = token_type
         self.lexeme = lexeme
@@ -0,0 +1,385 @@
+# Runs the bytecode from modl.bytecode on a stack machine. Calls between
+# closures don't recurse in Python: the caller's place is saved on a list
+# and the loop carries on with the callee, so MODL recursion is only limited
+# by memory. Tail calls replace the running function instead.
+import asyncio
+from functools import partial
+from types import CoroutineType
+from .bytecode import CALL, ENTER_LET, ENTER_LETREC, FIX_LET, JUMP, JUMP_IF_FALSE
+from .bytecode import LEAVE_LET, LOAD_BUILTIN, LOAD_CONST, LOAD_DEREF, LOAD_GLOBAL
+from .bytecode import LOAD_LOCAL, MAKE_CLOSURE, POP, RETURN, STORE_LOCAL, SWAP
+from .bytecode import TAIL_CALL, USE, compile_expression
+from .interpreter import ASYNC_BUILTIN, FUEL, PROFILER, Frame, LetFrame
+from .interpreter import Memo, Partial, UNSET, burn, capture, use_locally
+from . import interpreter, resolver
+
+# Every engine module offers these, for modl.ENGINES
+get_default_env = interpreter.get_default_env
+profiling = interpreter.profiling
+
+
+class Closure:
+    def __init__(self, code, frame):
+        self.code = code
+        self.frame = frame
+
+    @property
+    def function(self):
+        return self.code.function
+
+
+def interpret(statement, environment):
+    return resolver.interpret(statement, environment, top, interpret)
+
+
+def top(statement, environment, name="<lambda>"):
+    return run(compile_expression(statement, name), Frame((), None, environment))
+
+
+async def interpret_async(statement, environment):
+    # interpret, for inside an event loop
+    return await resolver.interpret_async(
+        statement, environment, top_async, interpret_async
+    )
+
+
+async def top_async(statement, environment, name="<lambda>"):
+    code = compile_expression(statement, name)
+    return await run_async(code, Frame((), None, environment))
+
+
+def run(code, frame, entered=0):
+    steps = execute(code, frame, {}, 0, entered)
+    try:
+        awaitable = next(steps)
+    except StopIteration as stop:
+        return stop.value
+    steps.close()
+    awaitable.close()
+    raise Exception("Async builtin called outside of run_async")
+
+
+async def run_async(code, frame):
+    # run, awaiting the coroutines builtins return. Every SLICE calls it
+    # lets the event loop run something else, so that long computations
+    # don't hold up other sessions.
+    steps = execute(code, frame, ASYNC_BUILTIN, SLICE)
+    value = None
+    try:
+        while True:
+            awaitable = steps.send(value)
+            if awaitable is None:
+                await asyncio.sleep(0)
+                value = None
+            else:
+                value = await awaitable
+    except StopIteration as stop:
+        return stop.value
+
+
+# How many calls run_async makes between giving way to the event loop
+SLICE = 10000
+
+
+def execute(code, frame, overrides, quantum, entered=0):
+    # A generator, so that it can stop whenever a builtin returns a
+    # coroutine: it yields the coroutine and carries on with its result.
+    # If quantum isn't 0, it also yields None every that many calls.
+    # entered is 1 if the caller already told the profiler about code.
+    # {#name} is looked up in overrides first, and then in the builtins of
+    # the environment the running code was made in.
+    profiler = PROFILER.get()
+    fuel = FUEL.get()
+    if profiler is None:
+        return (yield from loop(code, frame, overrides, quantum, fuel, None, 0))
+    # Calls this leaves unfinished are over for the profiler too
+    base = len(profiler.stack) - entered
+    try:
+        return (
+            yield from loop(code, frame, overrides, quantum, fuel, profiler, entered)
+        )
+    except BaseException:
+        while len(profiler.stack) > base:
+            profiler.leave()
+        raise
+
+
+def loop(code, frame, overrides, quantum, fuel, profiler, entered):
+    # execute's loop. While profiling, every call on calls was told to the
+    # profiler, and so was the code it started with if entered is 1.
+    ops = code.ops
+    consts = code.consts
+    names = code.names
+    lines = code.lines
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    # Where to go back to when each running call returns. Entries whose code
+    # is None are (None, memo, key, ...) instead: a memoized call that
+    # stores the value it returns, then returns it in turn.
+    calls = []
+    budget = quantum
+    pc = 0
+    while True:
+        op = ops[pc]
+        arg = ops[pc + 1]
+        pc += 2
+        if op == LOAD_LOCAL:
+            value = frame.slots[arg]
+            if value is UNSET:
+                identifier = code.identifiers[pc]
+                raise Exception(identifier, "Name used before it was assigned")
+            push(value)
+        elif op == LOAD_GLOBAL:
+            push(frame.globals[names[arg]])
+        elif op == CALL:
+            params = stack[-arg:]
+            del stack[-arg:]
+            f = pop()
+            if type(f) is Partial:
+                params = [*f.params, *params]
+                f = f.function
+            key = None
+            if type(f) is Memo and type(f.function) is Closure:
+                if f.arity == len(params):
+                    key = f.key(params)
+                    if key is None:
+                        # Nothing to keep the result by, so it's a plain call
+                        f = f.function
+                if key is not None:
+                    found, value = f.lookup(key)
+                    if found:
+                        push(value)
+                        continue
+                    memo = f
+                    f = f.function
+            if type(f) is Closure and f.code.arity == len(params):
+                if profiler is not None:
+                    profiler.enter(f.code.function, lines.get(pc))
+                if f.code.intrinsic is None:
+                    if quantum:
+                        budget -= 1
+                        if not budget:
+                            budget = quantum
+                            yield None
+                    if fuel is not None:
+                        burn(fuel)
+                    calls.append((code, ops, consts, names, lines, pc, frame))
+                    if key is not None:
+                        calls.append((None, memo, key, None, None, None, None))
+                    code = f.code
+                    ops = code.ops
+                    consts = code.consts
+                    names = code.names
+                    lines = code.lines
+                    frame = Frame(params, f.frame, f.frame.globals)
+                    pc = 0
+                    continue
+                name = f.code.intrinsic
+                if name in overrides:
+                    value = overrides[name](*params)
+                else:
+                    value = f.frame.globals.builtins[name](*params)
+                if key is not None:
+                    memo.store(key, value)
+                if profiler is not None:
+                    profiler.leave()
+            elif profiler is None:
+                value = call(f, params)
+            else:
+                value = call(f, params, lines.get(pc))
+            if type(value) is CoroutineType:
+                value = yield value
+            push(value)
+        elif op == TAIL_CALL:
+            params = stack[-arg:]
+            del stack[-arg:]
+            f = pop()
+            if type(f) is Partial:
+                params = [*f.params, *params]
+                f = f.function
+            key = None
+            found = False
+            if type(f) is Memo and type(f.function) is Closure:
+                if f.arity == len(params):
+                    key = f.key(params)
+                    if key is None:
+                        f = f.function
+                if key is not None:
+                    found, value = f.lookup(key)
+                    if not found:
+                        memo = f
+                        f = f.function
+            if found:
+                # The memo already had the value
+                pass
+            elif type(f) is Closure and f.code.arity == len(params):
+                if profiler is not None:
+                    if calls or entered:
+                        profiler.tail(f.code.function, lines.get(pc))
+                    else:
+                        profiler.enter(f.code.function, lines.get(pc))
+                        entered = 1
+                if f.code.intrinsic is None:
+                    if quantum:
+                        budget -= 1
+                        if not budget:
+                            budget = quantum
+                            yield None
+                    if fuel is not None:
+                        burn(fuel)
+                    if key is not None:
+                        # The result is stored once the callee returns, so
+                        # the call can still replace this one
+                        calls.append((None, memo, key, None, None, None, None))
+                    if f.frame is frame.parent:
+                        # A function calling itself reuses its frame, which
+                        # nothing else can see
+                        frame.slots = params
+                        pc = 0
+                        continue
+                    code = f.code
+                    ops = code.ops
+                    consts = code.consts
+                    names = code.names
+                    lines = code.lines
+                    frame = Frame(params, f.frame, f.frame.globals)
+                    pc = 0
+                    continue
+                name = f.code.intrinsic
+                if name in overrides:
+                    value = overrides[name](*params)
+                else:
+                    value = f.frame.globals.builtins[name](*params)
+                if key is not None:
+                    memo.store(key, value)
+            elif profiler is None:
+                value = call(f, params)
+            else:
+                value = call(f, params, lines.get(pc))
+            if type(value) is CoroutineType:
+                value = yield value
+            if profiler is not None and (calls or entered):
+                profiler.leave()
+            if not calls:
+                return value
+            code, ops, consts, names, lines, pc, frame = calls.pop()
+            while code is None:
+                ops.store(consts, value)
+                if not calls:
+                    return value
+                code, ops, consts, names, lines, pc, frame = calls.pop()
+            push(value)
+        elif op == LOAD_CONST:
+            push(consts[arg])
+        elif op == JUMP_IF_FALSE:
+            value = pop()
+            if value is False:
+                pc = arg
+            elif value is not True:
+                raise Exception("Type mismatch, condition must be boolean", value)
+        elif op == RETURN:
+            if profiler is not None and (calls or entered):
+                profiler.leave()
+            if not calls:
+                return pop()
+            value = pop()
+            code, ops, consts, names, lines, pc, frame = calls.pop()
+            while code is None:
+                ops.store(consts, value)
+                if not calls:
+                    return value
+                code, ops, consts, names, lines, pc, frame = calls.pop()
+            push(value)
+        elif op == LOAD_DEREF:
+            f = frame
+            for _ in range(arg >> 16):
+                f = f.parent
+            value = f.slots[arg & 0xFFFF]
+            if value is UNSET:
+                identifier = code.identifiers[pc]
+                raise Exception(identifier, "Name used before it was assigned")
+            push(value)
+        elif op == JUMP:
+            pc = arg
+        elif op == POP:
+            pop()
+        elif op == SWAP:
+            stack[-2], stack[-1] = stack[-1], stack[-2]
+        elif op == MAKE_CLOSURE:
+            closure = consts[arg]
+            push(Closure(closure, capture(closure.function, frame)))
+        elif op == LOAD_BUILTIN:
+            name = names[arg]
+            if name in overrides:
+                push(overrides[name])
+            else:
+                push(frame.globals.builtins[name])
+        elif op == ENTER_LET:
+            frame = Frame([UNSET] * arg, frame, frame.globals)
+        elif op == STORE_LOCAL:
+            frame.slots[arg] = pop()
+        elif op == LEAVE_LET:
+            for _ in range(arg):
+                frame = frame.parent
+        elif op == ENTER_LETREC:
+            frame = LetFrame([UNSET] * arg, frame, frame.globals)
+        elif op == FIX_LET:
+            frame.fix()
+        elif op == USE:
+            value, frame = use_locally(consts[arg], frame, interpret)
+            push(value)
+        else:
+            raise Exception("Unknown opcode", op)
+
+
+def call(f, params, line=None):
+    # line is where the call is, for profiling
+    if type(f) is Partial:
+        params = [*f.params, *params]
+        f = f.function
+    if type(f) is Memo:
+        if line is not None:
+            return f.call(partial(do_call, line=line), params)
+        return f.call(do_call, params)
+    # Currying, but optimized if there are multiple parameters
+    if type(f) is Closure:
+        code = f.code
+        if code.arity == len(params):
+            profiler = PROFILER.get()
+            if profiler is not None:
+                return profiled_call(profiler, f, params, line)
+            if code.intrinsic is not None:
+                return f.frame.globals.builtins[code.intrinsic](*params)
+            fuel = FUEL.get()
+            if fuel is not None:
+                burn(fuel)
+            return run(code, Frame(params, f.frame, f.frame.globals))
+        elif code.arity > len(params):
+            return Partial(f, tuple(params))
+        else:
+            raise Exception(f, "Function received too many parameters")
+    elif callable(f):
+        return f(*params)
+    else:
+        raise Exception(f, "Tried to call a non-function object")
+
+
+def do_call(f, *params, line=None):
+    return call(f, list(params), line)
+
+
+def profiled_call(profiler, f, params, line):
+    # The rest of call for a closure while profiling. run leaves the call
+    # once it's over, as its code may tail call something else first.
+    code = f.code
+    profiler.enter(code.function, line)
+    if code.intrinsic is None:
+        fuel = FUEL.get()
+        if fuel is not None:
+            burn(fuel)
+        return run(code, Frame(params, f.frame, f.frame.globals), 1)
+    try:
+        return f.frame.globals.builtins[code.intrinsic](*params)
+    finally:
+        profiler.leave()
@@ -0,0 +1,17 @@
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+
+def interpret(engine, source, env=None):
+    # Runs every statement in source, returning the last result and the
+    # environment they leave
+    if env is None:
+        env = engine.get_default_env()
+    result = None
+    for statement in Parser(Scanner(source).scan_tokens()).program():
+        result, env = engine.interpret(statement, env)
+    return result, env
+
+
+def run(engine, source):
+    return interpret(engine, source)[0]
@@ -0,0 +1,20 @@
+import unittest
+
+from modl import closures
+from modl.scanner import Scanner
+from modl.parser import Parser
+
+from .helpers import run
+
+
+class ClosureEngineTests(unittest.TestCase):
+    def test_use_binds_std(self):
+        env = closures.get_default_env()
+        parser = Parser(Scanner('use "std.dl";').scan_tokens())
+        result, env = closures.interpret(parser.statement(), env)
+        self.assertIsNone(result)
+        self.assertIsInstance(env["+"], closures.Closure)
+
+    def test_deep_tail_calls(self):
+        program = 'use "std.dl"; foldl (+) 0 (range 0 5000);'
+        self.assertEqual(run(closures, program), sum(range(5000)))
@@ -0,0 +1,61 @@
+import pickle
+import unittest
+
+from modl import ENGINES
+from modl.environment import Environment
+
+from .helpers import run
+
+
+class EnvironmentTests(unittest.TestCase):
+    def test_later_versions_shadow(self):
+        base = Environment()
+        base["x"] = 1
+        child = base.new_child({"x": 2, "y": 3})
+        self.assertEqual((base["x"], child["x"], child["y"]), (1, 2, 3))
+        self.assertNotIn("y", base)
+        self.assertIsNone(base.get("y"))
+        self.assertIs(child.table, base.table)
+
+    def test_branches_get_their_own_table(self):
+        base = Environment()
+        base["x"] = 1
+        first = base.new_child({"x": 2})
+        second = base.new_child({"x": 3})
+        self.assertEqual((base["x"], first["x"], second["x"]), (1, 2, 3))
+        self.assertIsNot(first.table, second.table)
+        self.assertEqual(first.new_child({"y": 4})["x"], 2)
+
+    def test_branches_dont_copy_what_they_can_see(self):
+        base = Environment()
+        for i in range(1000):
+            base["pad{}".format(i)] = i
+        base.new_child({"x": 1})
+        branch = base.new_child({"x": 2})
+        self.assertEqual(list(branch.table.bindings), ["x"])
+        self.assertEqual((branch["pad7"], branch["x"]), (7, 2))
+        self.assertEqual(branch.new_child({"y": 3}).changes(base), {"x": 2, "y": 3})
+
+    def test_changes(self):
+        base = Environment()
+        base["x"] = 1
+        env = base.new_child({"x": 2}).new_child({"y": 3}).new_child({"y": 4})
+        self.assertEqual(env.changes(base), {"x": 2, "y": 4})
+
+    def test_cache_is_not_pickled(self):
+        env = Environment()
+        env["x"] = 1
+        child = env.new_child({"y": 2})
+        child["x"]
+        child, env = pickle.loads(pickle.dumps((child, env)))
+        self.assertEqual(dict.__len__(child), 0)
+        self.assertIs(child.table, env.table)
+        self.assertEqual((child["x"], child["y"]), (1, 2))
+
+    def test_functions_see_the_version_they_were_defined_in(self):
+        source = "let x <- 1; let f <- { y | x; }; let x <- 2; let g <- { y | x; };"
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                self.assertEqual(run(engine, source + "{#cons} (f 0) (g 0);"), (1, 2))
+                with self.assertRaises(KeyError):
+                    run(engine, "let f <- { y | h y; }; let h <- { y | y; }; f 1;")
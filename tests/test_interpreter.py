@@ -1,9 +1,12 @@
 import unittest
+from unittest import mock
 
-from modl import interpreter
+from modl import ENGINES, closures, interpreter
 from modl.scanner import Scanner
 from modl.parser import Parser
 
+from .helpers import interpret, run
+
 
 class InterpretAllTheThings(unittest.TestCase):
     def test_use(self):
@@ -38,3 +41,292 @@ class InterpretAllTheThings(unittest.TestCase):
         for statement in parser.program():
             result, env = interpreter.interpret(statement, env)
         self.assertEqual(result, 8)
+
+    def test_later_lets_are_not_seen(self):
+        scanner = Scanner(
+            'use "std.dl"; let a <- "outer";'
+            'let f <- { x | let g <- { y | a; }; let a <- "inner"; g x; };'
+            "f 1;"
+        )
+        parser = Parser(scanner.scan_tokens())
+        env = interpreter.get_default_env()
+        for statement in parser.program():
+            result, env = interpreter.interpret(statement, env)
+        self.assertEqual(result, "outer")
+
+    def test_mutual_recursion(self):
+        scanner = Scanner('use "test.dl"; odd 7;')
+        parser = Parser(scanner.scan_tokens())
+        env = interpreter.get_default_env()
+        for statement in parser.program():
+            result, env = interpreter.interpret(statement, env)
+        self.assertIs(result, True)
+
+    def test_let_is_evaluated_in_order(self):
+        scanner = Scanner(
+            'use "std.dl"; let f <- { x | let a <- add1 x, add1 <- { y | y + 1; }; a; };'
+            "f 1;"
+        )
+        parser = Parser(scanner.scan_tokens())
+        env = interpreter.get_default_env()
+        with self.assertRaises(Exception):
+            for statement in parser.program():
+                result, env = interpreter.interpret(statement, env)
+
+    def test_partials_merge(self):
+        scanner = Scanner(
+            'use "std.dl"; let add3 <- { a b c | a + b + c; };'
+            "let p <- add3 1; let q <- p 2; q 3;"
+        )
+        parser = Parser(scanner.scan_tokens())
+        env = interpreter.get_default_env()
+        for statement in parser.program():
+            result, env = interpreter.interpret(statement, env)
+        self.assertEqual(result, 6)
+        self.assertIsInstance(env["q"], interpreter.Partial)
+        self.assertIs(env["q"].function, env["add3"])
+        self.assertEqual(env["q"].params, (1, 2))
+
+
+def run_all(source):
+    return {
+        name: run(engine, 'use "std.dl";' + source) for name, engine in ENGINES.items()
+    }
+
+
+class EngineTests(unittest.TestCase):
+    programs = [
+        'use "test.dl"; fibo 10;',
+        'use "test.dl"; flatfibo 500;',
+        'use "test.dl"; memofibo 60;',
+        'use "test.dl"; odd 7;',
+        "reverse (range 0 100);",
+        "foldl (+) 0 (map ((*) 2) (range 0 50));",
+        "filter { x | (x % 3) == 0; } (range 0 20);",
+        "let f <- { x | let y <- x + 1; cond | y > 3 -> y; | otherwise -> 0; ; }; f 5;",
+        "let f <- { x | cond | x > 3 -> let y <- x; y; ; x + 1; }; f 5;",
+        'let a <- "outer"; let f <- { x | let g <- { y | a; }; let a <- "inner"; g x; };'
+        "f 1;",
+    ]
+
+    def test_engines_agree(self):
+        for program in self.programs:
+            results = run_all(program)
+            for name, result in results.items():
+                with self.subTest(program=program, engine=name):
+                    self.assertEqual(result, results["tree"])
+
+    def test_long_chains(self):
+        terms = 5000
+        sums = "1" + " + 1" * terms
+        source = "let f <- { x | x" + " + x" * terms + "; };"
+        source += "(" + sums + ") :: (f 2) :: 0" + " :: 0" * terms + " :: empty;"
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                total, rest = result
+                doubled, items = rest
+                self.assertEqual(total, terms + 1)
+                self.assertEqual(doubled, 2 * (terms + 1))
+                length = 0
+                while items:
+                    items = items[1]
+                    length += 1
+                self.assertEqual(length, terms + 1)
+
+
+class TailCallTests(unittest.TestCase):
+    def test_self_calls(self):
+        source = (
+            "let count <- { n a | cond | n == 0 -> a;"
+            "| otherwise -> let m <- n - 1; count m (a + n); ; };"
+            "let sum <- { n | cond | n == 0 -> 0;"
+            "| otherwise -> n + (sum (n - 1)); ; };"
+            "(count 100 0) :: (sum 100);"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, (5050, 5050))
+
+    def test_parameters_are_read_before_being_set(self):
+        source = (
+            "let swap <- { a b n | cond | n == 0 -> a :: b;"
+            "| otherwise -> swap b a (n - 1); ; };"
+            "(swap 1 2 3) :: (swap 1 2 4);"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, ((2, 1), (1, 2)))
+
+    def test_self_calls_make_no_tail_calls(self):
+        made = []
+
+        class Counting(interpreter.TailCall):
+            __slots__ = ()
+
+            def __init__(self, *args):
+                made.append(args)
+                super().__init__(*args)
+
+        source = (
+            'use "std.dl"; let count <- { n a | cond | n == 0 -> a;'
+            "| otherwise -> count (n - 1) (a + 1); ; }; count 100 0;"
+        )
+        with mock.patch.object(interpreter, "TailCall", Counting):
+            with mock.patch.object(closures, "TailCall", Counting):
+                for name in ("tree", "closure"):
+                    with self.subTest(engine=name):
+                        self.assertEqual(run(ENGINES[name], source), 100)
+        self.assertEqual(made, [])
+
+    def test_frames_kept_by_closures_are_not_reused(self):
+        source = (
+            "let collect <- { n acc | cond | n == 0 -> acc;"
+            "| otherwise -> collect (n - 1) ({ x | n; } :: acc); ; };"
+            "map { f | f 0; } (collect 3 empty);"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, (1, (2, (3, ()))))
+
+
+class CaptureTests(unittest.TestCase):
+    def test_local_recursion(self):
+        source = (
+            "let f <- { n | let even <- { x | cond | x == 0 -> true;"
+            "| otherwise -> odd (x - 1); ; },"
+            "odd <- { x | cond | x == 0 -> false; | otherwise -> even (x - 1); ; };"
+            "let count <- { x a | cond | x == 0 -> a;"
+            "| otherwise -> count (x - 1) (a + n); ; };"
+            "(even n) :: (count 10 0); };"
+            "f 7;"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, (False, 70))
+
+    def test_local_memo(self):
+        source = (
+            "let f <- { n | let fibo <- memo { x | cond | x < 2 -> n;"
+            "| otherwise -> fibo (x - 1) + fibo (x - 2); ; }; fibo 20; };"
+            "(f 1) :: (f 2);"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, (10946, 21892))
+
+    def test_names_set_after_closures_copied_them(self):
+        source = (
+            "let f <- { y | let g <- { a | { w | h; }; }, k <- g 0, h <- y;"
+            "k 0; };"
+            "f 5;"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, 5)
+
+    def test_names_set_again_in_the_same_let(self):
+        source = (
+            "let f <- { z | let a <- 1, g <- { x | a; }, b <- g 0,"
+            "h <- { x | { y | a; }; }, k <- h 0, a <- 2;"
+            "(g 0) :: b :: (k 0); };"
+            "f 0;"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, (2, (1, 2)))
+
+    def test_values_see_the_enclosing_name_until_it_is_set(self):
+        programs = {
+            "let f <- { x | let x <- x + 1; x; }; f 5;": 6,
+            "let x <- 3; let f <- { y | let x <- x + y; x; }; f 1;": 4,
+        }
+        for source, expected in programs.items():
+            for name, result in run_all(source).items():
+                with self.subTest(program=source, engine=name):
+                    self.assertEqual(result, expected)
+
+    def test_names_used_before_they_are_set(self):
+        source = "let f <- { y | let a <- g 0, g <- { x | y; }; a; }; f 1;"
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                with self.assertRaises(Exception):
+                    run(engine, source)
+
+
+class UseTests(unittest.TestCase):
+    def test_use_in_a_body(self):
+        source = (
+            'let f <- { x | let a <- x + 1; use "test.dl"; { y | fibo a; }; };'
+            'let g <- { x | cond | x -> use "test.dl"; fibo 5; | otherwise -> 0; ; };'
+            "((f 4) 0) :: (g true);"
+        )
+        for name, result in run_all(source).items():
+            with self.subTest(engine=name):
+                self.assertEqual(result, (8, 8))
+
+    def test_definitions_stay_in_the_body(self):
+        source = 'let f <- { x | use "test.dl"; fibo x; }; f 3; fibo 3;'
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                parser = Parser(Scanner(source).scan_tokens())
+                env = engine.get_default_env()
+                with self.assertRaises(KeyError):
+                    for statement in parser.program():
+                        result, env = engine.interpret(statement, env)
+                self.assertEqual(engine.do_call(env["f"], 3), 3)
+
+
+class MemoTests(unittest.TestCase):
+    def run_program(self, source):
+        return interpret(interpreter, source)
+
+    def test_counts_hits_and_misses(self):
+        result, env = self.run_program(
+            'use "std.dl"; let fibo <- memo { x |'
+            "cond | x < 2 -> 1; | otherwise -> fibo (x - 1) + fibo (x - 2); ; };"
+            "fibo 30;"
+        )
+        self.assertEqual(result, 1346269)
+        self.assertEqual(
+            env["fibo"].stats(),
+            {"hits": 28, "misses": 31, "uncached": 0, "size": 31},
+        )
+
+    def test_evicts_least_recently_used(self):
+        _, env = self.run_program('use "std.dl"; let f <- memo { x | x * 2; };')
+        f = env["f"]
+        f.size = 2
+        for x in [1, 2, 1, 3]:
+            interpreter.do_call(f, x)
+        keys = [interpreter.memo_key([1]), interpreter.memo_key([3])]
+        self.assertEqual(list(f.cache), keys)
+
+    def test_keys_tell_types_apart(self):
+        result, _ = self.run_program(
+            'use "std.dl"; let f <- memo { x | x == 1; };'
+            "let a <- f 1, b <- f 1.0, c <- f true; a :: b :: c :: empty;"
+        )
+        self.assertEqual(result, (True, (True, (True, ()))))
+        self.assertNotEqual(
+            interpreter.memo_key([(1, ())]), interpreter.memo_key([(True, ())])
+        )
+
+    def test_functions_are_not_cached(self):
+        result, env = self.run_program(
+            'use "std.dl"; let apply <- memo { f x | f x; };'
+            "apply { x | x + 1; } 1; apply { x | x + 2; } 1;"
+        )
+        self.assertEqual(result, 3)
+        self.assertEqual(env["apply"].stats()["uncached"], 2)
+
+    def test_partial_application(self):
+        result, env = self.run_program(
+            'use "std.dl"; let add <- memo { x y | x + y; }; let inc <- add 1;'
+            "inc 1; inc 1;"
+        )
+        self.assertEqual(result, 2)
+        self.assertEqual(env["add"].stats()["hits"], 1)
+
+    def test_bang_functions_cant_be_memoized(self):
+        with self.assertRaises(Exception):
+            self.run_program('use "std.dl"; memo print!;')
@@ -0,0 +1,78 @@
+import contextlib
+import io
+import unittest
+
+from modl import ENGINES, interpreter, lazy
+
+from .helpers import run
+
+
+class LazyTests(unittest.TestCase):
+    def test_unused_arguments_are_not_evaluated(self):
+        program = 'use "std.dl"; false && (head empty);'
+        self.assertIs(run(lazy, program), False)
+        with self.assertRaises(IndexError):
+            run(interpreter, program)
+
+    def test_arguments_are_evaluated_once(self):
+        program = (
+            'use "std.dl"; let f <- memo { x | x; };'
+            "let twice <- { x | x + x; }; twice (f 1);"
+        )
+        result = run(lazy, program + " f;")
+        self.assertEqual(result.stats()["misses"], 1)
+        self.assertEqual(result.stats()["hits"], 0)
+
+    def test_long_chains_of_thunks(self):
+        program = 'use "std.dl"; foldl (+) 0 (range 0 5000);'
+        self.assertEqual(run(lazy, program), sum(range(5000)))
+
+    def test_bang_functions_are_strict(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run(lazy, 'use "test.dl"; tracefibo 1 1 2;')
+        self.assertEqual(
+            output.getvalue().split("\n"),
+            ["going deeper", "going deeper", "exiting", ""],
+        )
+
+    def test_long_chains_through_lets_and_wrappers(self):
+        loop = (
+            "let loop <- { n acc |"
+            " cond | n == 0 -> acc; | otherwise -> loop (n - 1) (step acc); ; };"
+            "loop 30000 0;"
+        )
+        wrappers = "".join(
+            "let w{} <- {{ a | w{} a; }};".format(i + 1, i) for i in range(12)
+        )
+        programs = [
+            'use "std.dl"; let step <- { a | let b <- a + 1; b; };' + loop,
+            'use "std.dl"; let w0 <- { a | a + 1; };'
+            + wrappers
+            + "let step <- w12;"
+            + loop,
+        ]
+        for program in programs:
+            with self.subTest(program=program):
+                self.assertEqual(run(lazy, program), 30000)
+
+    def test_arguments_that_cant_be_found(self):
+        with self.assertRaises(KeyError):
+            run(lazy, "let h <- { x | x; }; h nosuchname;")
+        program = "let h <- { x | x; }; let f <- { x | let a <- h ({ y | b; } 0), b <- 1; a; };"
+        for engine in (lazy, interpreter):
+            with self.subTest(engine=engine.__name__):
+                with self.assertRaisesRegex(Exception, "before it was assigned"):
+                    run(engine, program + " f 0;")
+
+    def test_bang_calls_in_arguments_run(self):
+        program = (
+            'use "std.dl"; let g! <- { ! x | print! x; x; };'
+            "let f <- { a b | b; }; f (g! 1) 2;"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    self.assertEqual(run(engine, program), 2)
+                self.assertEqual(output.getvalue(), "1\n")
@@ -0,0 +1,152 @@
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from modl import expr, interpreter, loader
+
+from .helpers import run
+
+
+class LoaderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "module.dl")
+        self.write("let a <- 1;")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, source, mtime=None):
+        with open(self.path, "w") as file:
+            file.write(source)
+        if mtime is not None:
+            os.utime(self.path, ns=(mtime, mtime))
+
+    def test_writes_a_cache(self):
+        statements = loader.load(self.path)
+        self.assertEqual(repr(statements), "[(DEFINE a 1)]")
+        self.assertTrue(os.path.exists(self.path + loader.SUFFIX))
+
+    def test_reads_from_the_cache(self):
+        loader.load(self.path)
+        parse = loader.parse
+        loader.parse = None  # Any call would blow up
+        try:
+            self.assertEqual(repr(loader.load(self.path)), "[(DEFINE a 1)]")
+        finally:
+            loader.parse = parse
+
+    def test_changes_invalidate_the_cache(self):
+        loader.load(self.path)
+        self.write("let a <- 2;", mtime=os.stat(self.path).st_mtime_ns + 10**9)
+        self.assertEqual(repr(loader.load(self.path)), "[(DEFINE a 2)]")
+
+    def test_same_size_and_mtime_trusts_the_cache(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        loader.load(self.path)
+        self.write("let b <- 1;", mtime=mtime)
+        self.assertEqual(repr(loader.load(self.path)), "[(DEFINE a 1)]")
+
+    def test_broken_cache_is_rebuilt(self):
+        with open(self.path + loader.SUFFIX, "wb") as file:
+            file.write(b"garbage")
+        self.assertEqual(repr(loader.load(self.path)), "[(DEFINE a 1)]")
+
+    def test_stale_cache_is_rebuilt(self):
+        # A header that matches, followed by statements that don't unpickle
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+        header = {
+            "magic": loader.MAGIC,
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": digest,
+        }
+        for body in (b"cmodl.expr\nNoSuchNode\n.", b"\x80\x05\x95"):
+            for mtime in (stat.st_mtime_ns, stat.st_mtime_ns + 10**9):
+                with self.subTest(body=body, mtime=mtime):
+                    with open(self.path + loader.SUFFIX, "wb") as file:
+                        file.write(pickle.dumps(header) + body)
+                    os.utime(self.path, ns=(mtime, mtime))
+                    self.assertEqual(repr(loader.load(self.path)), "[(DEFINE a 1)]")
+
+    def test_compile_tree(self):
+        os.mkdir(os.path.join(self.directory, "sub"))
+        nested = os.path.join(self.directory, "sub", "nested.dl")
+        with open(nested, "w") as file:
+            file.write("1;")
+        self.assertEqual(loader.compile_tree(self.directory), [self.path, nested])
+        self.assertTrue(os.path.exists(nested + loader.SUFFIX))
+
+
+class RegistryTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = loader.Registry()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, source):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as file:
+            file.write(source)
+        return path
+
+    def use(self, path, env, reload=False):
+        return self.registry.use(expr.Use(path, reload), env, self.interpret)
+
+    def interpret(self, statement, env):
+        if isinstance(statement, expr.Use):
+            return self.use(statement.filename, env, statement.reload)
+        return interpreter.interpret(statement, env)
+
+    def test_modules_are_evaluated_once(self):
+        path = self.write("counter.dl", 'let a <- 1; print! "loaded"; let b <- a;')
+        std = os.path.abspath("std.dl")
+        env = interpreter.get_default_env()
+        _, env = self.use(std, env)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            _, first = self.use(path, env)
+            _, second = self.use(path, env)
+        self.assertEqual(output.getvalue(), "loaded\n")
+        self.assertEqual(second["b"], 1)
+        self.assertEqual(second.version, env.version + 1)
+
+    def test_reload_evaluates_again(self):
+        path = self.write("module.dl", "let a <- 1;")
+        env = interpreter.get_default_env()
+        _, env = self.use(path, env)
+        version = env.version
+        _, env = self.use(path, env, reload=True)
+        self.assertEqual(env.version, version + 1)
+
+    def test_environments_have_their_own_modules(self):
+        path = self.write("module.dl", "let h <- { x | g; };")
+        source = 'let g <- {}; use "{}"; h 0;'
+        results = [run(interpreter, source.format(g, path)) for g in (1, 100)]
+        self.assertEqual(results, [1, 100])
+
+    def test_changed_files_are_evaluated_again(self):
+        path = self.write("module.dl", "let a <- 1;")
+        env = interpreter.get_default_env()
+        _, env = self.use(path, env)
+        self.write("module.dl", "let a <- 22;")
+        os.utime(path, ns=(0, 0))
+        _, env = self.use(path, env)
+        self.assertEqual(env["a"], 22)
+
+    def test_cycles_are_detected(self):
+        first = os.path.join(self.directory, "first.dl")
+        second = self.write("second.dl", "use {!r};".format(first).replace("'", '"'))
+        self.write("first.dl", "use {!r};".format(second).replace("'", '"'))
+        with self.assertRaises(Exception) as raised:
+            self.use(first, interpreter.get_default_env())
+        self.assertIn("Import cycle", raised.exception.args)
@@ -0,0 +1,110 @@
+import unittest
+
+from modl import ENGINES, expr, interpreter, optimizer
+from modl.parser import Parser
+from modl.scanner import Scanner
+
+from .helpers import interpret
+
+
+def parse(source):
+    return Parser(Scanner(source).scan_tokens()).statement()
+
+
+def run(source, engine=interpreter):
+    engine = optimizer.Optimizing(engine)
+    result, env = interpret(engine, source)
+    return result, env, engine.report
+
+
+def rewrite(source, statement):
+    _, env, _ = run(source)
+    return optimizer.Optimizer(env, interpreter.do_call).statement(parse(statement))
+
+
+class OptimizerTests(unittest.TestCase):
+    def test_folds_pure_builtins_on_literals(self):
+        e = rewrite('use "std.dl";', "(1 + 2) * 4;")
+        self.assertIsInstance(e, expr.Literal)
+        self.assertEqual(e.value, 12)
+
+    def test_leaves_effects_alone(self):
+        e = rewrite('use "std.dl";', "{#print} (1 + 2);")
+        self.assertIsInstance(e, expr.Expression)
+        self.assertEqual(e.call[1].value, 3)
+
+    def test_does_not_fold_names_bound_by_the_same_let(self):
+        e = rewrite('use "std.dl";', "let + <- { x y | {#sub} x y; }, z <- 1 + 2;")
+        self.assertIsInstance(e.assignments[1][1], expr.Symchain)
+
+    def test_respects_shadowing(self):
+        result, _, _ = run(
+            'use "std.dl"; let + <- { x y | {#sub} x y; };'
+            "let f <- { n | n + 1; }; f 5;"
+        )
+        self.assertEqual(result, 4)
+
+    def test_prunes_cond_cases(self):
+        e = rewrite(
+            'use "std.dl";',
+            "{ n | cond | 1 == 2 -> 0; | n > 1 -> 1; | otherwise -> 2; | n -> 3; ; };",
+        )
+        cases = e.body[0].cases
+        self.assertEqual(len(cases), 2)
+        self.assertIs(cases[1][0].value, True)
+
+    def test_cond_with_every_case_dropped(self):
+        for engine in ENGINES.values():
+            with self.subTest(engine=engine.__name__):
+                result, _, report = run(
+                    'use "std.dl"; cond | false -> 1; | 1 == 2 -> 2; ;', engine
+                )
+                self.assertIsNone(result)
+                self.assertIn("dropped dead case False", report)
+
+    def test_inlines_small_functions(self):
+        e = rewrite('use "std.dl"; let square <- { x | x * x; };', "square 7;")
+        self.assertIsInstance(e, expr.Literal)
+        self.assertEqual(e.value, 49)
+
+    def test_does_not_inline_recursion(self):
+        e = rewrite('use "test.dl";', "{ x | fibo x; };")
+        self.assertIsInstance(e.body[0], expr.Expression)
+
+    def test_pre_evaluates_pure_calls_inside_functions(self):
+        e = rewrite('use "test.dl";', "{ x | (fibo 10) + x; };")
+        self.assertEqual(e.body[0].call[1].value, 89)
+
+        e = rewrite('use "std.dl";', "{ x | let r <- range 0 1000; foldl (+) x r; };")
+        self.assertIsInstance(e.body[0].assignments[0][1], expr.Literal)
+
+    def test_does_not_pre_evaluate_effects(self):
+        e = rewrite(
+            'use "std.dl"; let loud <- { x | {#print} x; x + 1; };',
+            "{ x | (loud 10) + x; };",
+        )
+        self.assertIsInstance(e.body[0].left, expr.Expression)
+
+    def test_engines_agree(self):
+        source = (
+            'use "test.dl"; let square <- { x | x * x; };'
+            "let f <- { n | cond | n > (square 3) -> fibo 10; | otherwise -> n; ; };"
+            "foldl (+) 0 (map f (range 0 20));"
+        )
+        for engine in ENGINES.values():
+            with self.subTest(engine=engine.__name__):
+                self.assertEqual(run(source, engine)[0], 935)
+
+    def test_gives_up_on_calls_that_never_end(self):
+        source = (
+            'use "std.dl"; let add1 <- (+) 1; let spin <- { x | spin (add1 x); };'
+            "let grow <- { l | grow (1 :: l); };"
+            "let f <- { y | spin 1; }; let g <- { y | grow empty; };"
+        )
+        for engine in ENGINES.values():
+            with self.subTest(engine=engine.__name__):
+                _, env, report = run(source, engine)
+                self.assertFalse([r for r in report if r.startswith("pre-evaluated")])
+                for name in ("f", "g"):
+                    body = env[name].function.body
+                    self.assertIsInstance(body[0], expr.Expression)
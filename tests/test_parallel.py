@@ -0,0 +1,148 @@
+import unittest
+
+from modl import ENGINES, parallel
+
+from .helpers import interpret, run
+
+
+class PmapTests(unittest.TestCase):
+    def setUp(self):
+        self.workers = parallel.WORKERS
+        parallel.WORKERS = 2
+
+    def tearDown(self):
+        parallel.WORKERS = self.workers
+
+    def test_matches_map(self):
+        source = (
+            'use "test.dl"; let k <- 3; let f <- { x | fibo (x % 10) + k; };'
+            "(pmap f (range 0 40)) == (map f (range 0 40));"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                self.assertIs(run(engine, source), True)
+
+    def test_closures_over_locals(self):
+        source = (
+            'use "std.dl"; let scale <- { k l | pmap { x | x * k; } l; };'
+            "scale 3 (range 0 10);"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                result = run(engine, source)
+                self.assertEqual(result, parallel.build_list(range(0, 30, 3), ()))
+
+    def test_long_lists_in_the_environment(self):
+        source = (
+            'use "std.dl"; let big <- range 0 5000;'
+            "pmap { x | x + (foldl (+) 0 big); } (1 :: 2 :: empty);"
+        )
+        total = sum(range(5000))
+        pools = []
+        plain = parallel.run
+        parallel.run = lambda *args: pools.append(args) or plain(*args)
+        try:
+            result = run(ENGINES["vm"], source)
+        finally:
+            parallel.run = plain
+        self.assertEqual(result, (total + 1, (total + 2, ())))
+        self.assertEqual(len(pools), 1)
+
+    def test_pool_is_kept(self):
+        source = 'use "std.dl"; pmap { x | x + 1; } (range 0 10);'
+        run(ENGINES["vm"], source)
+        pool = parallel.POOL
+        run(ENGINES["tree"], source)
+        self.assertIsNotNone(pool)
+        self.assertIs(parallel.POOL, pool)
+
+    def test_errors_reach_the_caller(self):
+        source = 'use "std.dl"; pmap head (empty :: empty);'
+        with self.assertRaises(IndexError):
+            run(ENGINES["tree"], source)
+
+    def test_flat_pickling(self):
+        l = parallel.build_list(list(range(10000)), ())
+        l = parallel.loads(parallel.dumps((l, l)))[1]
+        for i in range(10000):
+            self.assertEqual(l[0], i)
+            l = l[1]
+        self.assertEqual(l, ())
+
+    def test_functions_are_sent_once_per_worker(self):
+        f = run(ENGINES["tree"], 'use "std.dl"; { x | x * 2; };')
+        payload = parallel.dumps(f)
+        digest = parallel.hashlib.sha256(payload).digest()
+        chunk = parallel.dumps([1, 2])
+        parallel.start()
+        try:
+            self.assertIsNone(parallel.run_chunk(digest, None, chunk))
+            result = parallel.run_chunk(digest, payload, chunk)
+            self.assertEqual(parallel.loads(result), [2, 4])
+            # Kept from now on
+            result = parallel.run_chunk(digest, None, chunk)
+            self.assertEqual(parallel.loads(result), [2, 4])
+        finally:
+            parallel.FUNCTIONS = None
+
+    def test_functions_are_pickled_again_only_when_globals_change(self):
+        pickled = []
+        plain = parallel.dumps
+
+        def dumps(value):
+            if type(value) is not list:
+                pickled.append(value)
+            return plain(value)
+
+        parallel.dumps = dumps
+        try:
+            for name, engine in ENGINES.items():
+                with self.subTest(engine=name):
+                    pickled[:] = []
+                    _, env = interpret(engine, 'use "std.dl"; let f <- { x | x * 2; };')
+                    for _ in range(3):
+                        interpret(engine, "pmap f (range 0 10);", env)
+                    self.assertEqual(len(pickled), 1)
+                    _, env = interpret(engine, "let g <- 1;", env)
+                    interpret(engine, "pmap f (range 0 10);", env)
+                    self.assertEqual(len(pickled), 2)
+        finally:
+            parallel.dumps = plain
+
+    def test_first_chunks_carry_new_functions(self):
+        source = 'use "std.dl"; let f <- { x | x - 17; }; pmap f (range 0 40);'
+        sent = []
+        plain = parallel.pool
+
+        def pool(workers):
+            executor = plain(workers)
+            return Recorder(executor, sent)
+
+        parallel.pool = pool
+        try:
+            _, env = interpret(ENGINES["tree"], source)
+            first, sent[:] = sent[:8], []
+            interpret(ENGINES["tree"], "pmap f (range 0 40);", env)
+        finally:
+            parallel.pool = plain
+        self.assertEqual(first, [True, True] + [False] * 6)
+        self.assertEqual(sent[:8], [False] * 8)
+
+    def test_bang_functions_are_rejected(self):
+        source = 'use "std.dl"; pmap print! (range 0 10);'
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                with self.assertRaises(Exception) as raised:
+                    run(engine, source)
+                self.assertIn("Only pure functions", raised.exception.args[1])
+
+
+class Recorder:
+    # Records which chunks are sent with their function
+    def __init__(self, executor, sent):
+        self.executor = executor
+        self.sent = sent
+
+    def submit(self, fn, digest, payload, chunk):
+        self.sent.append(payload is not None)
+        return self.executor.submit(fn, digest, payload, chunk)
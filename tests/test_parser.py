@@ -55,6 +55,30 @@ class PrimaryTests(unittest.TestCase):
         self.assertIsInstance(statement.right, expr.Literal)
         self.assertEqual(statement.right.value, 2)
 
+    def test_symbols_are_right_associative(self):
+        scanner = Scanner("1 :: 2 :: l;")
+        statement = Parser(scanner.scan_tokens()).statement()
+        self.assertEqual(statement.left.value, 1)
+        self.assertEqual(statement.right.left.value, 2)
+        self.assertEqual(statement.right.right.name, "l")
+
+    def test_types_end_a_chain(self):
+        scanner = Scanner("a + b : T * c;")
+        statement = Parser(scanner.scan_tokens()).statement()
+        self.assertEqual(statement.op.name, "*")
+        self.assertEqual(statement.left.op.name, "+")
+        self.assertEqual(statement.left.right.types, ("T",))
+        self.assertEqual(statement.right.name, "c")
+
+    def test_long_chains(self):
+        scanner = Scanner("0" + " :: 0" * 100000 + " :: l;")
+        statement = Parser(scanner.scan_tokens()).statement()
+        length = 0
+        while isinstance(statement, expr.Symchain):
+            statement = statement.right
+            length += 1
+        self.assertEqual(length, 100001)
+
     def test_parentheses_are_invisible(self):
         scanner = Scanner("(ident);")
         parser = Parser(scanner.scan_tokens())
@@ -263,3 +287,32 @@ class GreenspunTest(unittest.TestCase):
         parser = Parser(scanner.scan_tokens())
         program = parser.program()
         self.assertEqual("\n".join(repr(st) for st in program), self.output)
+
+
+class StreamingTest(unittest.TestCase):
+    class Lines:
+        def __init__(self, lines):
+            self.lines = lines
+            self.read_count = 0
+
+        def read(self, size=-1):
+            self.read_count += 1
+            return self.lines.pop(0) if self.lines else ""
+
+    def test_statements_are_yielded_as_they_end(self):
+        stream = self.Lines(["let f <- { x |\n", "x; };\n", "f 1;\n", "f 2;\n"])
+        parser = Parser(Scanner().scan_stream(stream))
+        statements = parser.statements()
+        self.assertIsInstance(next(statements), expr.Let)
+        self.assertEqual(stream.read_count, 2)
+        self.assertIsInstance(next(statements), expr.Expression)
+        self.assertEqual(stream.read_count, 3)
+        self.assertEqual(len(list(statements)), 1)
+
+    def test_matches_whole_source(self):
+        with open("std.dl") as file:
+            source = file.read()
+        with open("std.dl") as file:
+            streamed = Parser(Scanner().scan_stream(file, 7)).program()
+        whole = Parser(Scanner(source).scan_tokens()).program()
+        self.assertEqual(repr(streamed), repr(whole))
@@ -0,0 +1,207 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from modl import ENGINES
+from modl.parser import Parser
+from modl.profiler import Profiler, Sampler
+from modl.scanner import Scanner
+
+from .helpers import run
+
+
+def by_name(profiler):
+    return {row["function"]: row for row in profiler.sorted()}
+
+
+class ProfilerTests(unittest.TestCase):
+    def test_counts_calls_and_tail_calls(self):
+        source = (
+            'use "std.dl"; let count <- { n | cond | n == 0 -> 0;'
+            "| otherwise -> count (n - 1); ; }; count 100;"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                profiler = Profiler()
+                with engine.profiling(profiler):
+                    self.assertEqual(run(engine, source), 0)
+                rows = by_name(profiler)
+                self.assertEqual(rows["count"]["calls"], 1)
+                self.assertEqual(rows["count"]["tail_calls"], 100)
+                self.assertEqual(rows["=="]["calls"], 101)
+                self.assertEqual(profiler.stack, [])
+
+    def test_recursion_is_not_counted_twice(self):
+        profiler = Profiler()
+        engine = ENGINES["tree"]
+        with engine.profiling(profiler):
+            run(engine, 'use "test.dl"; fibo 10;')
+        fibo = by_name(profiler)["fibo"]
+        self.assertEqual(fibo["calls"], 177)
+        self.assertGreaterEqual(fibo["cumulative"], fibo["self"])
+
+    def test_lambdas_are_named_by_line(self):
+        profiler = Profiler()
+        engine = ENGINES["closure"]
+        with engine.profiling(profiler):
+            run(engine, 'use "std.dl";\nmap { x | x * 2; } (range 0 10);')
+        self.assertEqual(by_name(profiler)["<lambda:2>"]["calls"], 10)
+
+    def test_errors_unwind_the_stack(self):
+        profiler = Profiler()
+        engine = ENGINES["vm"]
+        with engine.profiling(profiler):
+            with self.assertRaises(Exception):
+                run(engine, 'use "std.dl"; let f <- { x | head x; }; f empty;')
+        self.assertEqual(profiler.stack, [])
+
+    def test_deep_recursion(self):
+        source = (
+            'use "std.dl"; let sum <- { n | cond | n == 0 -> 0;'
+            "| otherwise -> n + sum (n - 1); ; }; sum 20000;"
+        )
+        for name in ("vm", "lazy"):
+            engine = ENGINES[name]
+            for profiler in (Profiler(), Sampler()):
+                with self.subTest(engine=name, profiler=type(profiler).__name__):
+                    with engine.profiling(profiler):
+                        self.assertEqual(run(engine, source), 200010000)
+                    self.assertEqual(profiler.stack, [])
+
+    def test_profiling_is_switched_off_after(self):
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                profiler = Profiler()
+                with engine.profiling(profiler):
+                    run(engine, 'use "test.dl"; fibo 3;')
+                calls = by_name(profiler)["fibo"]["calls"]
+                run(engine, 'use "test.dl"; fibo 3;')
+                self.assertEqual(by_name(profiler)["fibo"]["calls"], calls)
+
+    def test_other_threads_are_not_profiled(self):
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                profiler = Profiler()
+                with engine.profiling(profiler):
+                    thread = threading.Thread(
+                        target=run, args=(engine, 'use "test.dl"; fibo 3;')
+                    )
+                    thread.start()
+                    thread.join()
+                self.assertNotIn("fibo", by_name(profiler))
+
+    def test_dump(self):
+        profiler = Profiler()
+        engine = ENGINES["tree"]
+        with engine.profiling(profiler):
+            run(engine, 'use "test.dl"; flatfibo 20;')
+        output = io.StringIO()
+        profiler.dump(output)
+        rows = {row["function"]: row for row in json.loads(output.getvalue())}
+        self.assertEqual(rows["fib"]["tail_calls"], 20)
+        self.assertIn("fib", profiler.report())
+
+
+class SamplerTests(unittest.TestCase):
+    def test_tail_calls_stay_one_frame(self):
+        source = (
+            'use "std.dl"; let count <- { n | cond | n == 0 -> 0;'
+            "| otherwise -> count (n - 1); ; }; count 20000;"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                sampler = Sampler(0.0005)
+                with engine.profiling(sampler), sampler:
+                    run(engine, source)
+                self.assertTrue(sampler.samples)
+                for stack in sampler.samples:
+                    names = [function.name for function, *_ in stack]
+                    self.assertEqual(names.count("count"), 1)
+                self.assertEqual(sampler.stack, [])
+
+    def test_collapsed(self):
+        parser = Parser(
+            Scanner("let f <- { x | x; };\nlet g <- { x | x; };").scan_tokens(),
+            "a.dl",
+        )
+        f, g = [statement.assignments[0][1] for statement in parser.program()]
+        sampler = Sampler()
+        sampler.samples[((f, None, None),)] = 2
+        sampler.samples[((f, None, None), (g, 5, "b.dl"))] = 3
+        self.assertEqual(sampler.collapsed(), "f (a.dl:1) 2\nf (a.dl:1);g (b.dl:5) 3\n")
+
+    def test_calls_are_labelled_by_call_site(self):
+        source = (
+            'use "std.dl";\n'
+            "let f <- { x | x + 1; };\n"
+            "let g <- { x |\n"
+            "    let y <- f x;\n"
+            "    y;\n"
+            "};\n"
+            "g 1;\n"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                sampler = Recorder()
+                with engine.profiling(sampler):
+                    run(engine, source)
+                self.assertIn(
+                    "g (<input>:7);f (<input>:4) 1", sampler.collapsed().split("\n")
+                )
+
+    def test_files_are_kept_apart(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        paths = []
+        for name in ("a.dl", "b.dl"):
+            paths.append(os.path.join(directory, name))
+            with open(paths[-1], "w") as file:
+                file.write("let f <- { x | x; };\nlet g <- { x | f x; x; };\ng 1;\n")
+        source = "".join('use "{}";'.format(path) for path in paths)
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                sampler = Recorder()
+                with engine.profiling(sampler):
+                    run(engine, source)
+                self.assertEqual(
+                    sampler.collapsed(),
+                    "".join(
+                        "g ({0}:3) 1\ng ({0}:3);f ({0}:2) 1\n".format(path)
+                        for path in paths
+                    ),
+                )
+
+    def test_scripts_name_their_top_level_calls(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        script = os.path.join(directory, "script.dl")
+        with open(script, "w") as file:
+            file.write(
+                'use "std.dl";\n'
+                "let count <- { n | cond | n == 0 -> 0; | otherwise -> count (n - 1); ; };\n"
+                "let loop <- { n | count n; 0; };\n"
+                "loop 200000;\n"
+            )
+        output = os.path.join(directory, "stacks")
+        subprocess.run(
+            [sys.executable, "bin/modl_cli.py", "--sample", output, script],
+            check=True,
+        )
+        with open(output) as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertTrue(line.startswith("loop ({}:4)".format(script)), line)
+
+
+class Recorder(Sampler):
+    # Takes a sample on every call instead of every so often
+    def enter(self, function, line=None):
+        super().enter(function, line)
+        self.samples[tuple(self.stack)] += 1
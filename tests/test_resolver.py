@@ -0,0 +1,122 @@
+import unittest
+
+from modl import interpreter
+from modl.parser import Parser
+from modl.resolver import Resolver, intrinsic
+from modl.scanner import Scanner
+
+from .helpers import interpret
+
+
+def resolve(source):
+    parser = Parser(Scanner(source).scan_tokens())
+    return Resolver().statement(parser.statement())
+
+
+class ResolverTests(unittest.TestCase):
+    def test_globals_are_unresolved(self):
+        statement = resolve("f x;")
+        for identifier in statement.call:
+            self.assertIsNone(identifier.depth)
+
+    def test_arguments_are_slots(self):
+        function = resolve("{ x y | y x; };")
+        y, x = function.body[0].call
+        self.assertEqual((y.depth, y.slot), (0, 1))
+        self.assertEqual((x.depth, x.slot), (0, 0))
+
+    def test_statements_are_resolved_once(self):
+        parser = Parser(Scanner("{ x | { y | x y; }; };").scan_tokens())
+        function = parser.statement()
+        env = interpreter.get_default_env()
+        interpreter.interpret(function, env)
+        free = function.body[0].free
+        interpreter.interpret(function, env)
+        self.assertIs(function.body[0].free, free)
+
+    def test_enclosing_functions_add_depth(self):
+        function = resolve("{ x | { y | x y; }; };")
+        x, y = function.body[0].body[0].call
+        self.assertEqual((x.depth, x.slot), (1, 0))
+        self.assertEqual((y.depth, y.slot), (0, 0))
+
+    def test_functions_capture_enclosing_locals(self):
+        function = resolve("{ x y | let a <- x; { z | a y z; }; };")
+        _, inner = function.body
+        self.assertEqual(inner.free, [(0, 0), (1, 1)])
+        a, y, z = inner.body[0].call
+        self.assertEqual((a.depth, a.slot), (1, 0))
+        self.assertEqual((y.depth, y.slot), (1, 1))
+        self.assertEqual((z.depth, z.slot), (0, 0))
+
+    def test_captures_pass_through_functions(self):
+        function = resolve("{ x | { y | { z | x; }; }; };")
+        middle = function.body[0]
+        inner = middle.body[0]
+        self.assertEqual(function.free, [])
+        self.assertEqual(middle.free, [(0, 0)])
+        self.assertEqual(inner.free, [(1, 0)])
+
+    def test_lets_captured_while_bound_are_recursive(self):
+        function = resolve(
+            "{ x | let f <- { y | f y; }; let a <- x, g <- { y | f y; }; a; };"
+        )
+        first, second, _ = function.body
+        self.assertTrue(first.recursive)
+        self.assertFalse(second.recursive)
+
+    def test_let_shares_a_single_scope(self):
+        function = resolve("{ x | let a <- b, b <- a; a; };")
+        let, a = function.body
+        self.assertEqual(let.size, 2)
+        first, second = (value for (_, value) in let.assignments)
+        # b isn't set yet when a's value runs, so that's the global b
+        self.assertEqual((first.depth, first.slot), (None, None))
+        self.assertEqual((second.depth, second.slot), (0, 0))
+        self.assertEqual((a.depth, a.slot), (0, 0))
+
+    def test_later_lets_are_new_scopes(self):
+        function = resolve("{ x | let a <- x; let b <- a; x; };")
+        _, second, x = function.body
+        (_, a) = second.assignments[0]
+        self.assertEqual((a.depth, a.slot), (1, 0))
+        self.assertEqual((x.depth, x.slot), (2, 0))
+
+    def test_let_scope_ends_with_the_case(self):
+        function = resolve("{ x | cond | x -> let x <- 1; x; ; x; };")
+        conditional, x = function.body
+        (_, body) = conditional.cases[0]
+        self.assertEqual(body[1].depth, 0)
+        self.assertEqual((x.depth, x.slot), (0, 0))
+
+    def test_use_in_a_body_adds_a_scope(self):
+        function = resolve('{ x | use "std.dl"; x y; };')
+        x, y = function.body[1].call
+        self.assertEqual((x.depth, x.slot), (1, 0))
+        self.assertIsNone(y.depth)
+
+
+class IntrinsicTests(unittest.TestCase):
+    def test_forwarding_wrappers(self):
+        self.assertEqual(intrinsic(resolve("{ x y | {#add} x y; };")), "add")
+        self.assertEqual(intrinsic(resolve("{ l | {#head} l; };")), "head")
+
+    def test_anything_else_is_not_intrinsic(self):
+        for source in [
+            "{ x y | {#add} y x; };",
+            "{ x y | {#add} x; };",
+            "{ x | {#add} x 1; };",
+            "{ x x | {#add} x x; };",
+            "{ x y | f x y; };",
+            "{ x y | {#print} x; {#add} x y; };",
+            "{ ! s | {#print} s; };",
+        ]:
+            with self.subTest(source=source):
+                self.assertIsNone(intrinsic(resolve(source)))
+
+    def test_shadowed_operators_still_work(self):
+        source = (
+            'use "std.dl"; let f <- { x | x + 1; };'
+            "let + <- { x y | {#sub} x y; }; (f 5) + 1;"
+        )
+        self.assertEqual(interpret(interpreter, source)[0], 5)
@@ -0,0 +1,224 @@
+import asyncio
+import io
+import os
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from modl import ENGINES, Interpreter, interpreter, parallel
+from modl.profiler import Profiler
+
+
+class InterpreterTests(unittest.TestCase):
+    def test_runs_add_to_the_environment(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                modl = Interpreter(name)
+                modl.run('use "test.dl"; let x <- fibo 10;')
+                self.assertEqual(modl.run("x + 1;"), 90)
+                self.assertEqual(modl.call("fibo", 7), 21)
+
+    def test_streams_are_its_own(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                stdout = io.StringIO()
+                modl = Interpreter(name, stdin=io.StringIO("hi\n"), stdout=stdout)
+                result = modl.run('use "std.dl"; print! 42; read!;')
+                self.assertEqual(result, "hi")
+                self.assertEqual(stdout.getvalue(), "42\n")
+
+    def test_instances_are_isolated(self):
+        a, b = Interpreter(), Interpreter()
+        a.run("let x <- 1;")
+        b.run("let x <- 2;")
+        self.assertEqual(a.run("x;"), 1)
+        self.assertEqual(b.run("x;"), 2)
+        self.assertIsNot(a.environment.modules, b.environment.modules)
+
+    def test_errors_keep_what_was_done(self):
+        modl = Interpreter()
+        with self.assertRaises(Exception):
+            modl.run("let x <- 1; head empty;")
+        self.assertEqual(modl.run("x;"), 1)
+
+    def test_builtins_are_its_own(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                modl = Interpreter(name, builtins={"double": lambda x: x * 2})
+                modl.run('use "std.dl"; let double <- { x | {#double} x; };')
+                self.assertEqual(modl.run("double (1 + 2);"), 6)
+                with self.assertRaises(KeyError):
+                    Interpreter(name).run("{#double} 3;")
+
+    def test_closures_keep_their_builtins(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                twice = Interpreter(name, builtins={"scale": lambda x: x * 2})
+                twice.run(
+                    'use "std.dl"; let f <- { x | {#scale} x; },'
+                    "g <- { x | {#scale} (x + 1); };"
+                )
+                thrice = Interpreter(name, builtins={"scale": lambda x: x * 3})
+                thrice.environment = thrice.environment.new_child(
+                    {"f": twice.environment["f"], "g": twice.environment["g"]}
+                )
+                self.assertEqual(thrice.run("{#add} (f 1) (g 1);"), 6)
+                if name == "vm":
+                    result = asyncio.run(thrice.run_async("{#add} (f 1) (g 1);"))
+                    self.assertEqual(result, 6)
+
+    def test_fuel_is_its_own(self):
+        loop = "let loop <- { n | loop (n + 1); }; loop 0;"
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                modl = Interpreter(name)
+                modl.fuel = 1000
+                with self.assertRaises(interpreter.OutOfFuel):
+                    modl.run('use "std.dl";' + loop)
+                self.assertEqual(Interpreter(name).run('use "test.dl"; fibo 15;'), 987)
+
+    def test_profilers_are_its_own(self):
+        for name in ENGINES:
+            with self.subTest(engine=name):
+                profiled, plain = Interpreter(name), Interpreter(name)
+                profiled.profiler = Profiler()
+                barrier = threading.Barrier(2)
+
+                def work(modl):
+                    barrier.wait()
+                    modl.run('use "test.dl"; fibo 10;')
+
+                with ThreadPoolExecutor(2) as pool:
+                    list(pool.map(work, (profiled, plain)))
+                rows = {row["function"]: row for row in profiled.profiler.sorted()}
+                self.assertEqual(rows["fibo"]["calls"], 177)
+                self.assertEqual(profiled.profiler.stack, [])
+
+    def test_threads(self):
+        def work(n):
+            stdout = io.StringIO()
+            modl = Interpreter("vm", stdout=stdout)
+            modl.run('use "test.dl"; use "std.dl";')
+            modl.run("print! (fibo {});".format(n))
+            return stdout.getvalue()
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(work, range(16)))
+        fibo = [1, 1]
+        while len(fibo) < 16:
+            fibo.append(fibo[-1] + fibo[-2])
+        self.assertEqual(results, ["{}\n".format(n) for n in fibo])
+
+    def test_threads_sharing_one_instance(self):
+        modl = Interpreter()
+        modl.run('use "test.dl";')
+        barrier = threading.Barrier(4)
+
+        def work(n):
+            barrier.wait()
+            modl.run("let x{} <- fibo {};".format(n, n))
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(work, range(4)))
+        self.assertEqual(modl.run("x0 + x1 + x2 + x3;"), 1 + 1 + 2 + 3)
+
+
+class AsyncTests(unittest.TestCase):
+    def test_matches_run(self):
+        program = 'use "test.dl"; let x <- fibo 10; x + (fibo 5);'
+        result = asyncio.run(Interpreter("vm").run_async(program))
+        self.assertEqual(result, Interpreter("vm").run(program))
+
+    def test_sessions_sleep_together(self):
+        async def session(n):
+            stdout = io.StringIO()
+            modl = Interpreter("vm", stdout=stdout)
+            await modl.run_async('use "std.dl"; sleep! 0.2; print! {};'.format(n))
+            return stdout.getvalue()
+
+        async def main():
+            return await asyncio.gather(*(session(n) for n in range(200)))
+
+        start = time.perf_counter()
+        results = asyncio.run(main())
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(results, ["{}\n".format(n) for n in range(200)])
+
+    def test_streams(self):
+        async def main():
+            stdin = asyncio.StreamReader()
+            stdin.feed_data(b"hello\n")
+            stdin.feed_eof()
+            stdout = Writer()
+            modl = Interpreter("vm", stdin=stdin, stdout=stdout)
+            await modl.run_async('use "std.dl"; let s <- read!; print! s;')
+            return stdout.written
+
+        self.assertEqual(asyncio.run(main()), [b"hello\n"])
+
+    def test_calls_run_async_cant_await_still_print(self):
+        # A memo whose parameters can't be kept, and pmap mapping in this
+        # process, both call the function themselves
+        async def main():
+            loop = asyncio.get_running_loop()
+            output, pipe = os.pipe()
+            transport, protocol = await loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, os.fdopen(pipe, "wb")
+            )
+            stdout = asyncio.StreamWriter(transport, protocol, None, loop)
+            modl = Interpreter("vm", stdout=stdout)
+            await modl.run_async(
+                'use "std.dl"; let show <- memo { f x | print! (f x); x; };'
+                "show { y | y + 1; } 1; pmap { x | print! x; x; } (range 3 5);"
+                'print! "done";'
+            )
+            transport.close()
+            return output
+
+        workers = parallel.WORKERS
+        parallel.WORKERS = 1
+        try:
+            output = asyncio.run(main())
+        finally:
+            parallel.WORKERS = workers
+        with os.fdopen(output, "rb") as file:
+            self.assertEqual(file.read(), b"2\n3\n4\ndone\n")
+
+    def test_long_computations_give_way(self):
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0)
+
+        async def main():
+            task = asyncio.create_task(ticker())
+            result = await Interpreter("vm").run_async(
+                'use "std.dl"; foldl (+) 0 (range 0 50000);'
+            )
+            task.cancel()
+            return result
+
+        self.assertEqual(asyncio.run(main()), sum(range(50000)))
+        self.assertGreater(len(ticks), 1)
+
+    def test_sync_run_refuses_async_builtins(self):
+        modl = Interpreter("vm")
+        modl.run("let f <- { g | g 0; };")
+        with self.assertRaises(Exception):
+            modl.call("f", asyncio.sleep)
+        with self.assertRaises(Exception):
+            asyncio.run(Interpreter("tree").run_async("1;"))
+
+
+class Writer:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        pass
@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 import unittest
@@ -157,6 +158,27 @@ class TestScannerTokens(unittest.TestCase):
         scanner.scan_tokens()  # Discard
         self.assertEqual(scanner.line, 6)
 
+    def test_token_stream(self):
+        scanner = Scanner('let f <- {#add}\n  /* two\nlines */ "a\nb" -.5 x!;')
+        tokens = [
+            (token.token_type, token.lexeme, token.literal, token.line)
+            for token in scanner.scan_tokens()
+        ]
+        self.assertEqual(
+            tokens,
+            [
+                (TokenType.LET, "let", None, 1),
+                (TokenType.IDENTIFIER, "f", None, 1),
+                (TokenType.LEFT_ARROW, "<-", None, 1),
+                (TokenType.BUILTIN, "{#add}", "add", 1),
+                (TokenType.STRING, '"a\nb"', "a\nb", 4),
+                (TokenType.B10_FLOAT, "-.5", -0.5, 4),
+                (TokenType.IDENTIFIER, "x!", None, 4),
+                (TokenType.SEMICOLON, ";", None, 4),
+                (TokenType.EOF, "", None, 4),
+            ],
+        )
+
     def test_builtin(self):
         scanner = Scanner("{#builtin_name}")
         tokens = scanner.scan_tokens()
@@ -173,6 +195,11 @@ class TestScannerTokens(unittest.TestCase):
         self.assertIs(token.token_type, TokenType.TYPENAME)
         self.assertEqual(token.lexeme, "Type")
 
+    def test_use_may_have_a_bang(self):
+        scanner = Scanner(r"use!")
+        tokens = scanner.scan_tokens()
+        self.assertIs(tokens[0].token_type, TokenType.USE_BANG)
+
 
 class InvalidTokensTest(unittest.TestCase):
     def test_unclosed_comment(self):
@@ -226,3 +253,19 @@ class ExprTest(unittest.TestCase):
         scanner = Scanner("+")
         tokens = scanner.scan_tokens()
         self.assertEqual(repr(tokens[0]), "TokenType.SYMBOLIC '+' None")
+
+
+class StreamTest(unittest.TestCase):
+    def test_tokens_split_across_chunks(self):
+        source = 'let name! <- {#builtin} "a \\x0041 string" 12.5 /* comment */ ->>;'
+        for chunk_size in range(1, 8):
+            with self.subTest(chunk_size=chunk_size):
+                streamed = Scanner().scan_stream(io.StringIO(source), chunk_size)
+                self.assertEqual(
+                    [repr(token) for token in streamed],
+                    [repr(token) for token in Scanner(source).scan_tokens()],
+                )
+
+    def test_errors_wait_for_the_end(self):
+        with self.assertRaises(Exception):
+            list(Scanner().scan_stream(io.StringIO('"unclosed'), 2))
@@ -0,0 +1,92 @@
+import io
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from modl.server import Input, Server, send
+
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")
+CLIENT = os.path.join(CLIENT, "modl_client.py")
+
+
+class ServerTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket = os.path.join(self.directory, "modl.sock")
+        self.server = Server(self.socket, "vm", ["std.dl"])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def client(self, source, stdin="", cwd=None):
+        path = os.path.join(self.directory, "script.dl")
+        with open(path, "w") as script:
+            script.write(source)
+        return subprocess.run(
+            [sys.executable, CLIENT, self.socket, path],
+            input=stdin,
+            cwd=cwd,
+            capture_output=True,
+            text=True,
+        )
+
+    def test_runs_scripts_with_the_prelude(self):
+        result = self.client("let s <- read!; print! s; print! (1 :: empty);", "hi\n")
+        self.assertEqual(result.stdout, "hi\n(1, ())\n")
+        self.assertEqual(result.returncode, 0)
+
+    def test_scripts_dont_see_each_other(self):
+        self.assertEqual(self.client("let x <- 1;").returncode, 0)
+        result = self.client("x;")
+        self.assertIn("KeyError", result.stderr)
+        self.assertEqual(result.returncode, 1)
+
+    def test_exit_status(self):
+        self.assertEqual(self.client("3;").returncode, 3)
+        result = self.client('"oops";')
+        self.assertEqual((result.stderr, result.returncode), ("oops\n", 1))
+
+    def test_uses_are_relative_to_the_client(self):
+        with open(os.path.join(self.directory, "module.dl"), "w") as module:
+            module.write("let a <- 42;")
+        result = self.client('use "module.dl"; print! a;', cwd=self.directory)
+        self.assertEqual(result.stdout, "42\n")
+
+    def test_restarts_after_being_killed(self):
+        self.server.shutdown()
+        self.thread.join()
+        # Killed without server_close: the socket file stays behind
+        self.server.socket.close()
+        self.assertTrue(os.path.exists(self.socket))
+        self.server = Server(self.socket, "vm", ["std.dl"])
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.assertEqual(self.client("print! 1;").stdout, "1\n")
+
+    def test_only_the_owner_can_connect(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.socket).st_mode), 0o600)
+
+    def test_input_must_be_an_input_frame(self):
+        def reply(kind):
+            stream = io.BytesIO()
+            send(stream, kind, b"hi\n")
+            return Input(io.BytesIO(stream.getvalue()), io.BytesIO())
+
+        self.assertEqual(reply(b"i").readline(), "hi\n")
+        with self.assertRaises(Exception):
+            reply(b"o").readline()
+
+    def test_running_servers_are_not_taken_over(self):
+        with self.assertRaises(OSError):
+            Server(self.socket, "vm", ["std.dl"])
+        self.assertEqual(self.client("print! 1;").stdout, "1\n")
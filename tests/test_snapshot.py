@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from modl import ENGINES, Interpreter, snapshot
+
+from .helpers import interpret
+
+
+class SnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "prelude.img")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        source = (
+            'use "test.dl"; use "std.dl"; let big <- range 0 5000;'
+            "let a <- 2, f <- { x | x * a; }, g <- { x | f (x + 1); };"
+        )
+        for name, engine in ENGINES.items():
+            with self.subTest(engine=name):
+                _, env = interpret(engine, source)
+                snapshot.save(self.path, env, engine)
+                env = snapshot.load(self.path, engine)
+                program = "(g 1) + (fibo 10) + (foldl (+) 0 big);"
+                result, _ = interpret(engine, program, env)
+                self.assertEqual(result, 4 + 89 + sum(range(5000)))
+
+    def test_values_stay_shared(self):
+        engine = ENGINES["tree"]
+        source = (
+            'use "std.dl"; let make <- { a | let f <- { x | a; }, g <- { x | a; };'
+            "f :: g; }; let fg <- make { y | y; };"
+        )
+        _, env = interpret(engine, source)
+        snapshot.save(self.path, env, engine)
+        f, g = snapshot.load(self.path, engine)["fg"]
+        self.assertIs(f.frame.slots[0], g.frame.slots[0])
+
+    def test_long_environments(self):
+        engine = ENGINES["vm"]
+        source = "let f0 <- { x | x; };" + "".join(
+            "let f{} <- {{ x | f{} x; }};".format(i, i - 1) for i in range(1, 2000)
+        )
+        _, env = interpret(engine, source)
+        snapshot.save(self.path, env, engine)
+        env = snapshot.load(self.path, engine)
+        self.assertEqual(engine.do_call(env["f1999"], 7), 7)
+
+    def test_used_files_come_back(self):
+        module = os.path.join(self.directory, "module.dl")
+        with open(module, "w") as file:
+            file.write("let a <- 1;")
+        modl = Interpreter()
+        modl.run('use "{}";'.format(module))
+        snapshot.save(self.path, modl.environment, modl)
+
+        restored = Interpreter()
+        restored.environment = snapshot.load(self.path, restored)
+        self.assertIn(module, restored.environment.modules.modules)
+
+        with open(module, "w") as file:
+            file.write("let a <- 22;")
+        os.utime(module, ns=(0, 0))
+        self.assertEqual(restored.run('use "{}"; a;'.format(module)), 22)
+
+    def test_other_engines_are_refused(self):
+        engine = ENGINES["tree"]
+        snapshot.save(self.path, engine.get_default_env(), engine)
+        with self.assertRaises(Exception):
+            snapshot.load(self.path, ENGINES["vm"])
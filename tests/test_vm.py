@@ -0,0 +1,107 @@
+import contextlib
+import io
+import unittest
+
+from modl import interpreter, vm
+from modl.bytecode import compile_function, disassemble
+from modl.parser import Parser
+from modl.resolver import Resolver
+from modl.scanner import Scanner
+
+from .helpers import run
+
+
+class VMTests(unittest.TestCase):
+    def test_tail_calls_dont_grow_the_stack(self):
+        program = 'use "std.dl"; foldl (+) 0 (range 0 5000);'
+        self.assertEqual(run(vm, program), sum(range(5000)))
+
+    def test_calls_dont_grow_the_stack(self):
+        program = (
+            'use "std.dl";'
+            "let sum <- { n | cond | n == 0 -> 0; | otherwise -> n + sum (n - 1); ; };"
+            "sum 20000;"
+        )
+        self.assertEqual(run(vm, program), sum(range(20001)))
+
+    def test_deep_expressions_dont_grow_the_stack(self):
+        # Resolving and compiling don't recurse on how deep the AST is either
+        chain = " + ".join(["x"] * 5000)
+        program = (
+            'use "std.dl";'
+            "let f <- { x | cond | x == 0 -> 0; | otherwise -> let y <- "
+            + chain
+            + "; y; ; };"
+            "f 2;"
+        )
+        self.assertEqual(run(vm, program), 10000)
+
+    def test_memoized_calls_dont_grow_the_stack(self):
+        program = (
+            'use "std.dl";'
+            "let f <- memo { n | cond | n == 0 -> 0; | otherwise -> 1 + (f (n - 1)); ; };"
+            "let g <- memo { n a | cond | n == 0 -> a; | otherwise -> g (n - 1) (a + 1); ; };"
+            "(f 20000) :: (g 20000 0) :: (f 20000);"
+        )
+        self.assertEqual(run(vm, program), (20000, (20000, 20000)))
+
+    def test_errors_in_nested_calls(self):
+        program = (
+            'use "std.dl"; let f <- { l | 1 + head l; }; let g <- { l | f l + 1; };'
+            "g empty;"
+        )
+        with self.assertRaises(IndexError):
+            run(vm, program)
+
+    def test_implicit_bang(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            run(vm, 'use "test.dl"; tracefibo 1 1 2;')
+        self.assertEqual(
+            output.getvalue().split("\n"),
+            ["going deeper", "going deeper", "exiting", ""],
+        )
+
+    def test_symchains_evaluate_left_first(self):
+        program = 'use "std.dl"; (print! "left") +++ 1;'
+        for engine in (interpreter, vm):
+            with self.subTest(engine=engine.__name__):
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    with self.assertRaises(KeyError):
+                        run(engine, program)
+                self.assertEqual(output.getvalue(), "left\n")
+
+    def test_pools_hold_each_value_once(self):
+        parser = Parser(Scanner("{ x | f 1 g 1 x (f x) g; };").scan_tokens())
+        code = compile_function(Resolver().statement(parser.statement()))
+        self.assertEqual(code.names, ["f", "g"])
+        self.assertEqual(code.consts, [1])
+
+    def test_disassemble(self):
+        parser = Parser(Scanner("{ x | f x; };").scan_tokens())
+        function = Resolver().statement(parser.statement())
+        listing = disassemble(compile_function(function, "g"))
+        self.assertEqual(
+            listing.split("\n"),
+            [
+                "<code g arity 1>",
+                "    0 LOAD_GLOBAL      0 f",
+                "    2 LOAD_LOCAL       0",
+                "    4 TAIL_CALL        1",
+            ],
+        )
+
+    def test_errors_name_unassigned_names(self):
+        programs = [
+            "let f <- { x | let g <- { y | b; }, a <- g 0, b <- 1; a; }; f 0;",
+            "let f <- { x | let a <- { y | b; } 0, b <- 1; a; }; f 0;",
+        ]
+        for program in programs:
+            for engine in (interpreter, vm):
+                with self.subTest(program=program, engine=engine.__name__):
+                    with self.assertRaises(Exception) as raised:
+                        run(engine, program)
+                    identifier, message = raised.exception.args
+                    self.assertEqual(identifier.name, "b")
+                    self.assertEqual(message, "Name used before it was assigned")